@@ -0,0 +1,201 @@
+import csv
+import io
+import tempfile
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta, timezone
+
+from sqlalchemy import delete, func, insert, select
+
+from database import Order, OrderRollup
+import counters
+
+# --- إحصاءات المبيعات ---
+# جدول order_rollups يحمل عدد الطلبات ومجموع أسعارها لكل (يوم الإنشاء، المنتج، الخيار، الحالة الحالية).
+# كل تغيير حالة في repository.py يطرح الطلب من صف حالته القديمة ويضيفه لصف الجديدة في نفس المعاملة،
+# فالتقارير تقرأ بضع مئات من الصفوف مهما كبر جدول orders. التصدير وحده يقرأ orders (بفهرس created_at).
+
+REVENUE_STATUSES = ("paid", "delivered")
+# قمع التحويل بعد مرحلة الإنشاء: كل مرحلة تشمل الطلبات التي تجاوزتها
+FUNNEL = (("paid", REVENUE_STATUSES), ("delivered", ("delivered",)))
+
+CSV_COLUMNS = ("id", "created_at", "user_id", "username", "product_name", "option", "price", "status")
+
+
+def _day(created_at):
+    return (created_at or datetime.now(timezone.utc)).date()
+
+
+def record_changes(session, changes):
+    """
+    changes: [(order, old_status, new_status)]؛ old_status=None لطلب جديد.
+    تُضاف إلى المعاملة الحالية (بدون commit) كاستعلام upsert واحد، مع عدادات الحالات الإجمالية (counters.py).
+    """
+    deltas = defaultdict(lambda: [0, 0.0])
+    for order, old_status, new_status in changes:
+        if old_status == new_status:
+            continue
+        base = (_day(order.created_at), order.product_name or "", order.option or "")
+        price = order.price or 0.0
+        if old_status is not None:
+            delta = deltas[base + (old_status,)]
+            delta[0] -= 1
+            delta[1] -= price
+        delta = deltas[base + (new_status,)]
+        delta[0] += 1
+        delta[1] += price
+    rows = [
+        {"day": day, "product_name": product, "option": option, "status": status, "orders": count, "revenue": revenue}
+        for (day, product, option, status), (count, revenue) in deltas.items()
+        if count or revenue
+    ]
+    if rows:
+        upsert = counters.upsert_increment(
+            session, OrderRollup.__table__, ["day", "product_name", "option", "status"], ("orders", "revenue")
+        )
+        session.execute(upsert, rows)
+
+    totals = defaultdict(lambda: [0, 0.0])
+    for (_date, _product, _option, status), (count, revenue) in deltas.items():
+        totals[counters.order_key(status)][0] += count
+        totals[counters.order_key(status)][1] += revenue
+    counters.bump(session, totals)
+
+
+def rebuild(conn):
+    """إعادة بناء الجدول كاملًا من orders (في migrations.py عند إنشائه لأول مرة)."""
+    rollups, orders = OrderRollup.__table__, Order.__table__
+    day = func.date(orders.c.created_at)
+    conn.execute(delete(rollups))
+    conn.execute(insert(rollups).from_select(
+        ["day", "product_name", "option", "status", "orders", "revenue"],
+        select(
+            day,
+            func.coalesce(orders.c.product_name, ""),
+            func.coalesce(orders.c.option, ""),
+            func.coalesce(orders.c.status, "pending"),
+            func.count(),
+            func.coalesce(func.sum(orders.c.price), 0.0),
+        ).group_by(day, orders.c.product_name, orders.c.option, orders.c.status)
+    ))
+
+
+# ================= التقرير =================
+
+def report(session, start, end):
+    """ملخص الأيام من start إلى end (شاملة) من جدول order_rollups فقط."""
+    rollups = OrderRollup.__table__
+    rows = session.execute(
+        select(rollups.c.day, rollups.c.product_name, rollups.c.option, rollups.c.status,
+               rollups.c.orders, rollups.c.revenue)
+        .where(rollups.c.day >= start, rollups.c.day <= end)
+    ).all()
+
+    by_status = defaultdict(lambda: [0, 0.0])
+    by_product = defaultdict(lambda: [0, 0.0])
+    by_option = defaultdict(lambda: [0, 0.0])
+    by_day = defaultdict(lambda: [0, 0.0])
+    for day, product, option, status, count, revenue in rows:
+        by_status[status][0] += count
+        by_status[status][1] += revenue
+        counted = status in REVENUE_STATUSES
+        for bucket in (by_product[product], by_option[(product, option)], by_day[day]):
+            bucket[0] += count
+            if counted:
+                bucket[1] += revenue
+
+    funnel = [("created", sum(count for count, _revenue in by_status.values()))]
+    funnel.extend((stage, sum(by_status[s][0] for s in statuses)) for stage, statuses in FUNNEL)
+    return {
+        "start": start,
+        "end": end,
+        "by_status": dict(by_status),
+        "by_product": dict(by_product),
+        "by_option": dict(by_option),
+        "by_day": dict(by_day),
+        "funnel": funnel,
+        "revenue": sum(by_status[s][1] for s in REVENUE_STATUSES),
+    }
+
+
+def _top(items, limit):
+    """ترتيب حسب الإيراد ثم العدد."""
+    return sorted(items.items(), key=lambda kv: (kv[1][1], kv[1][0]), reverse=True)[:limit]
+
+
+def render_report(data, top=10, max_days=31):
+    lines = [f"📊 Sales {data['start']} → {data['end']}", ""]
+    total = data["funnel"][0][1]
+    lines.append(f"🧾 Orders: {total} · 💵 Revenue: ${data['revenue']:g}")
+    lines.append(" | ".join(f"{status}: {count}" for status, (count, _rev) in sorted(data["by_status"].items())))
+
+    funnel = []
+    for stage, count in data["funnel"]:
+        share = f" ({count / total:.0%})" if total and stage != "created" else ""
+        funnel.append(f"{stage} {count}{share}")
+    lines.append("🔻 " + " → ".join(funnel))
+
+    if data["by_product"]:
+        lines.append("")
+        lines.append("📦 By product (orders · revenue):")
+        lines.extend(f"  {name}: {count} · ${revenue:g}" for name, (count, revenue) in _top(data["by_product"], top))
+        lines.append("")
+        lines.append("🔹 By option:")
+        lines.extend(
+            f"  {product} ({option}): {count} · ${revenue:g}"
+            for (product, option), (count, revenue) in _top(data["by_option"], top)
+        )
+
+    if data["by_day"]:
+        lines.append("")
+        lines.append("📅 By day:")
+        days = sorted(data["by_day"].items(), reverse=True)
+        lines.extend(f"  {day}: {count} · ${revenue:g}" for day, (count, revenue) in days[:max_days])
+        if len(days) > max_days:
+            lines.append(f"  … {len(days) - max_days} more days")
+    return "\n".join(lines)
+
+
+# ================= التصدير =================
+
+def parse_range(args, default_days=30, today=None):
+    """'[from] [to]' بصيغة YYYY-MM-DD. الافتراضي آخر default_days يومًا. ValueError إذا كانت الصيغة خاطئة."""
+    today = today or datetime.now(timezone.utc).date()
+    parts = args.split()
+    if len(parts) > 2:
+        raise ValueError("expected at most two dates")
+    start = date.fromisoformat(parts[0]) if parts else today - timedelta(days=default_days - 1)
+    end = date.fromisoformat(parts[1]) if len(parts) > 1 else today
+    if end < start:
+        raise ValueError("end date is before start date")
+    return start, end
+
+
+def export_orders_csv(session, start, end, fp, batch_size=1000):
+    """كتابة طلبات الفترة إلى fp كـ CSV دفعة دفعة (yield_per) دون تحميلها كلها في الذاكرة. تُرجع عدد الصفوف."""
+    orders = Order.__table__
+    since = datetime.combine(start, time.min, tzinfo=timezone.utc)
+    until = datetime.combine(end + timedelta(days=1), time.min, tzinfo=timezone.utc)
+    result = session.execute(
+        select(*(orders.c[name] for name in CSV_COLUMNS))
+        .where(orders.c.created_at >= since, orders.c.created_at < until)
+        .order_by(orders.c.created_at, orders.c.id)
+        .execution_options(yield_per=batch_size)
+    )
+    writer = csv.writer(fp)
+    writer.writerow(CSV_COLUMNS)
+    count = 0
+    for rows in result.partitions():
+        writer.writerows(rows)
+        count += len(rows)
+    return count
+
+
+def export_orders_file(session, start, end, spool_size=1 << 20):
+    """CSV الفترة في ملف مؤقت (في الذاكرة حتى spool_size ثم على القرص). تُرجع (ملف ثنائي من بدايته، عدد الصفوف)."""
+    fp = tempfile.SpooledTemporaryFile(max_size=spool_size, mode="w+b")
+    text = io.TextIOWrapper(fp, encoding="utf-8", newline="")
+    count = export_orders_csv(session, start, end, text)
+    text.flush()
+    text.detach()
+    fp.seek(0)
+    return fp, count
@@ -0,0 +1,80 @@
+"""
+مقارنة زمن get/set بين MemoryStorage و SQLAlchemyStorage.
+
+التشغيل من جذر المشروع:
+    python -m benchmarks.fsm_storage [--users 2000] [--rounds 5]
+
+يستخدم قاعدة SQLite مؤقتة إلا إذا حُدد DATABASE_URL.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+_tmpdir = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmpdir}/bench_fsm.db")
+
+from aiogram.contrib.fsm_storage.memory import MemoryStorage  # noqa: E402
+
+from database import create_db  # noqa: E402
+from fsm_storage import SQLAlchemyStorage  # noqa: E402
+
+
+def _summary(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1e6
+    return f"mean {statistics.mean(samples) * 1e6:8.1f}µs  p50 {pick(0.5):8.1f}µs  p99 {pick(0.99):8.1f}µs"
+
+
+async def _measure(storage, users, rounds):
+    results = {"set_state": [], "update_data": [], "get_state": [], "get_data": []}
+    for _ in range(rounds):
+        for user in range(users):
+            for op, call in (
+                ("set_state", lambda: storage.set_state(chat=user, user=user, state="Bench:waiting")),
+                ("update_data", lambda: storage.update_data(chat=user, user=user, data={"order_id": user})),
+                ("get_state", lambda: storage.get_state(chat=user, user=user)),
+                ("get_data", lambda: storage.get_data(chat=user, user=user)),
+            ):
+                started = time.perf_counter()
+                await call()
+                results[op].append(time.perf_counter() - started)
+    return results
+
+
+async def main(users, rounds):
+    create_db()
+    memory = MemoryStorage()
+    sql = SQLAlchemyStorage(flush_interval=0.5)
+
+    for name, storage in (("MemoryStorage", memory), ("SQLAlchemyStorage", sql)):
+        results = await _measure(storage, users, rounds)
+        print(f"\n{name} ({users} users x {rounds} rounds)")
+        for op, samples in results.items():
+            print(f"  {op:12} {_summary(samples)}")
+
+    started = time.perf_counter()
+    flushed = await sql.flush()
+    print(f"\nSQLAlchemyStorage flush: {flushed} records in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+    # قراءة باردة: ذاكرة فارغة، كل سجل يُحمَّل من قاعدة البيانات
+    cold = SQLAlchemyStorage()
+    samples = []
+    for user in range(users):
+        started = time.perf_counter()
+        await cold.get_state(chat=user, user=user)
+        samples.append(time.perf_counter() - started)
+    print(f"SQLAlchemyStorage cold get_state {_summary(samples)}")
+
+    await sql.close()
+    await cold.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.rounds))
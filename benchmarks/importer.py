@@ -0,0 +1,80 @@
+"""
+زمن استيراد كتالوج كبير: استيراد أولي، ثم إعادة استيراد بعد تعديل الأسعار وحذف وإضافة خيارات.
+
+التشغيل من جذر المشروع:
+    python -m benchmarks.importer [--products 500] [--options 20] [--format json|csv]
+
+يستخدم قاعدة SQLite مؤقتة إلا إذا حُدد DATABASE_URL.
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import tempfile
+import time
+
+_tmpdir = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmpdir}/bench_import.db")
+
+from migrations import upgrade  # noqa: E402
+from importer import import_catalog  # noqa: E402
+
+
+def _write(path, catalog, fmt):
+    with open(path, "w", encoding="utf-8", newline="") as fp:
+        if fmt == "csv":
+            writer = csv.writer(fp)
+            writer.writerow(["product", "option", "price"])
+            for product, options in catalog.items():
+                for option, price in options.items():
+                    writer.writerow([product, option, price])
+        else:
+            json.dump(catalog, fp, ensure_ascii=False)
+
+
+def _mutate(catalog, rng):
+    """تعديل 10% من الأسعار، حذف 5% من المنتجات، وإضافة خيار لكل عاشر منتج."""
+    mutated = {}
+    for i, (product, options) in enumerate(catalog.items()):
+        if rng.random() < 0.05:
+            continue
+        options = {o: (p + 1 if rng.random() < 0.1 else p) for o, p in options.items()}
+        if i % 10 == 0:
+            options["bonus"] = 1.0
+        mutated[product] = options
+    return mutated
+
+
+def _timed(label, path, **kwargs):
+    started = time.perf_counter()
+    diff, revision = import_catalog(path, **kwargs)
+    print(f"{label:18} {time.perf_counter() - started:7.2f}s  {diff.summary()}")
+
+
+def main(products, options, fmt):
+    upgrade()
+    rng = random.Random(0)
+    catalog = {
+        f"Product {p}": {f"Option {o}": float(rng.randint(1, 100)) for o in range(options)}
+        for p in range(products)
+    }
+    path = os.path.join(_tmpdir, f"catalog.{fmt}")
+    print(f"{products} products x {options} options = {products * options} options ({fmt})\n")
+
+    _write(path, catalog, fmt)
+    _timed("initial import", path)
+    _timed("no-op reimport", path)
+
+    _write(path, _mutate(catalog, rng), fmt)
+    _timed("dry run", path, dry_run=True)
+    _timed("changed reimport", path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--options", type=int, default=20)
+    parser.add_argument("--format", choices=("json", "csv"), default="json")
+    args = parser.parse_args()
+    main(args.products, args.options, args.format)
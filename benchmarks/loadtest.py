@@ -0,0 +1,374 @@
+"""
+اختبار حمل محلي للبوت بدون إنترنت.
+
+يشغّل خادم aiohttp يحاكي Bot API، ويوجّه Bot إليه، ثم يرسل تحديثات مصطنعة إلى
+dp.process_updates: /start، اختيار اللغة، اختيار منتج، buy/paid، رسائل التذاكر،
+وتأكيد المدير وإرسال المنتج. النتيجة: الإنتاجية، وزمن p50/p95/p99 لكل نوع تحديث
+ولكل معالج، وعدد استعلامات قاعدة البيانات لكل نوع تحديث.
+
+التشغيل من جذر المشروع:
+    python -m benchmarks.loadtest [--users 200] [--ticket-messages 3] [--api-latency-ms 0]
+
+تُستخدم قاعدة SQLite مؤقتة تُملأ من products.json.
+"""
+import argparse
+import asyncio
+import contextvars
+import itertools
+import json
+import os
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADMIN_ID = 1
+BOT_USER = {"id": 42, "is_bot": True, "first_name": "Store", "username": "store_bot"}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _configure_environment(port, real_limits):
+    """يجب أن يتم قبل استيراد bot/config/database."""
+    tmpdir = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmpdir}/loadtest.db"
+    os.environ["BOT_TOKEN"] = "123456:LOADTEST"
+    os.environ["ADMIN_ID"] = str(ADMIN_ID)
+    os.environ.setdefault("BINANCE_ID", "loadtest")
+    os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{port}"
+    os.environ.pop("WEBHOOK_HOST", None)
+    if not real_limits:
+        # لا نريد قياس حدود تيليجرام هنا بل زمن المعالجات
+        os.environ["OUTBOX_GLOBAL_RATE"] = "100000"
+        os.environ["OUTBOX_CHAT_RATE"] = "100000"
+        os.environ["OUTBOX_CHAT_BURST"] = "100000"
+        os.environ["OUTBOX_BULK_RATE"] = "100000"
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+
+
+# ================= FAKE BOT API =================
+class FakeBotAPI:
+    """خادم يرد على طلبات Bot API بنتائج مقبولة ويسجل أزرار الردود لكل محادثة."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.callbacks = defaultdict(list)   # chat_id -> [callback_data, ...]
+        self._message_ids = itertools.count(1)
+
+    async def handle(self, request: web.Request):
+        method = request.match_info["method"]
+        data = dict(await request.post())
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat_id = int(data.get("chat_id") or 0)
+        markup = data.get("reply_markup")
+        if markup:
+            for row in json.loads(markup).get("inline_keyboard", []):
+                for button in row:
+                    if "callback_data" in button:
+                        self.callbacks[chat_id].append(button["callback_data"])
+
+        if method.lower() == "getme":
+            result = BOT_USER
+        elif method.lower() in ("sendmessage", "editmessagetext", "senddocument"):
+            result = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": data.get("text", ""),
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    def take_callback(self, chat_id, prefix):
+        """آخر زر يبدأ بـ prefix أرسله البوت لهذه المحادثة (ويُزال من القائمة)."""
+        buttons = self.callbacks[chat_id]
+        for i in range(len(buttons) - 1, -1, -1):
+            if buttons[i].startswith(prefix):
+                return buttons.pop(i)
+        return None
+
+    async def start(self, port):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        return runner
+
+
+# ================= MEASUREMENT =================
+class UpdateProbe:
+    __slots__ = ("queries", "query_time", "handlers")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.handlers = []
+
+
+current_probe = contextvars.ContextVar("current_probe", default=None)
+
+
+def install_query_counter(engine):
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["loadtest_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        probe = current_probe.get()
+        if probe is not None:
+            probe.queries += 1
+            probe.query_time += time.perf_counter() - conn.info.pop("loadtest_started", time.perf_counter())
+
+
+def install_handler_probe(dp):
+    from aiogram.dispatcher.handler import current_handler
+    from aiogram.dispatcher.middlewares import BaseMiddleware
+
+    class HandlerProbe(BaseMiddleware):
+        async def _record(self, data):
+            probe = current_probe.get()
+            if probe is not None:
+                routed = data.get("routed_handler")
+                probe.handlers.append(routed.__name__ if routed is not None else current_handler.get().__name__)
+
+        async def on_process_message(self, message, data):
+            await self._record(data)
+
+        async def on_process_callback_query(self, callback, data):
+            await self._record(data)
+
+    dp.middleware.setup(HandlerProbe())
+
+
+class Stats:
+    def __init__(self):
+        self.latency = defaultdict(list)         # step -> [seconds]
+        self.queries = defaultdict(list)         # step -> [count]
+        self.handler_latency = defaultdict(list)  # handler -> [seconds]
+        self.errors = Counter()
+
+    def add(self, step, elapsed, probe, error=None):
+        self.latency[step].append(elapsed)
+        self.queries[step].append(probe.queries)
+        for handler in probe.handlers or ["<no handler>"]:
+            self.handler_latency[handler].append(elapsed)
+        if error is not None:
+            self.errors[f"{step}: {type(error).__name__}"] += 1
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    return pick(0.50), pick(0.95), pick(0.99)
+
+
+def _print_table(title, rows, with_queries):
+    print(f"\n{title}")
+    header = f"  {'name':28} {'n':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    if with_queries:
+        header += f" {'queries/upd':>12}"
+    print(header)
+    for name, samples, queries in rows:
+        p50, p95, p99 = _percentiles(samples)
+        line = f"  {name:28} {len(samples):>6} {p50:>8.2f} {p95:>8.2f} {p99:>8.2f}"
+        if with_queries:
+            line += f" {statistics.mean(queries):>12.2f}"
+        print(line)
+
+
+# ================= TRAFFIC =================
+class Traffic:
+    def __init__(self, dp, api, stats):
+        self.dp = dp
+        self.api = api
+        self.stats = stats
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    def message(self, user_id, text):
+        update_id = next(self._ids)
+        return {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text,
+            },
+        }
+
+    def callback(self, user_id, data):
+        update_id = next(self._ids)
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "chat_instance": str(user_id),
+                "from": self._user(user_id),
+                "data": data,
+                "message": {
+                    "message_id": update_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": BOT_USER,
+                    "text": "-",
+                },
+            },
+        }
+
+    async def send(self, step, raw_update):
+        from aiogram import types
+
+        probe = UpdateProbe()
+        token = current_probe.set(probe)
+        error = None
+        started = time.perf_counter()
+        try:
+            await self.dp.process_updates([types.Update(**raw_update)])
+        except Exception as e:
+            error = e
+        finally:
+            elapsed = time.perf_counter() - started
+            current_probe.reset(token)
+        self.stats.add(step, elapsed, probe, error)
+
+    async def customer(self, user_id, products, ticket_messages):
+        await self.send("start", self.message(user_id, "/start"))
+        await self.send("setlang", self.callback(user_id, f"setlang:{random.choice(['en', 'ar'])}"))
+        await self.send("product_tap", self.message(user_id, random.choice(products)))
+
+        buy = self.api.take_callback(user_id, "buy")
+        if buy:
+            await self.send("buy", self.callback(user_id, buy))
+        paid = self.api.take_callback(user_id, "paid")
+        if paid:
+            await self.send("paid", self.callback(user_id, paid))
+
+        if ticket_messages:
+            from i18n import _
+            await self.send("report_problem", self.message(user_id, _("report_problem", "en")))
+            for i in range(ticket_messages):
+                await self.send("ticket_message", self.message(user_id, f"message {i} from {user_id}"))
+
+    async def admin(self, customers_done: asyncio.Event):
+        """يؤكد الدفعات ويرسل المنتجات حتى تنتهي طلبات العملاء."""
+        while True:
+            confirm = self.api.take_callback(ADMIN_ID, "confirm")
+            if confirm:
+                await self.send("admin_confirm", self.callback(ADMIN_ID, confirm))
+                send_product = self.api.take_callback(ADMIN_ID, "sendproduct")
+                if send_product:
+                    await self.send("admin_sendproduct", self.callback(ADMIN_ID, send_product))
+                    await self.send("admin_details", self.message(ADMIN_ID, "LICENSE-KEY-0000"))
+                continue
+            if customers_done.is_set():
+                # مهلة قصيرة لوصول آخر الإشعارات عبر طابور الإرسال
+                await asyncio.sleep(0.5)
+                if not any(b.startswith("confirm") for b in self.api.callbacks[ADMIN_ID]):
+                    return
+            await asyncio.sleep(0.01)
+
+
+# ================= MAIN =================
+async def run(args):
+    import bot as bot_module
+    import database
+    import migrations
+
+    api = FakeBotAPI(latency=args.api_latency_ms / 1000)
+    api_runner = await api.start(args.port)
+
+    migrations.upgrade()
+    import runpy
+    runpy.run_path(os.path.join(ROOT, "seed.py"), run_name="__main__")
+
+    install_query_counter(database.engine)
+    install_handler_probe(bot_module.dp)
+    from aiogram import Bot, Dispatcher
+    Bot.set_current(bot_module.bot)
+    Dispatcher.set_current(bot_module.dp)
+    await bot_module.on_startup(bot_module.dp)
+
+    with open(os.path.join(ROOT, "products.json"), encoding="utf-8") as f:
+        products = list(json.load(f))
+
+    stats = Stats()
+    traffic = Traffic(bot_module.dp, api, stats)
+    customers_done = asyncio.Event()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one_customer(user_id):
+        async with semaphore:
+            await traffic.customer(user_id, products, args.ticket_messages)
+
+    started = time.perf_counter()
+    admin_task = asyncio.create_task(traffic.admin(customers_done))
+    await asyncio.gather(*(one_customer(10_000 + i) for i in range(args.users)))
+    customers_done.set()
+    await admin_task
+    wall = time.perf_counter() - started
+
+    await bot_module.on_shutdown(bot_module.dp)
+    await bot_module.dp.storage.close()
+    await (await bot_module.bot.get_session()).close()
+    await api_runner.cleanup()
+
+    total = sum(len(v) for v in stats.latency.values())
+    print(f"\n{args.users} users, {total} updates in {wall:.2f}s -> {total / wall:.1f} updates/s")
+    _print_table(
+        "Per update type",
+        [(step, stats.latency[step], stats.queries[step]) for step in stats.latency],
+        with_queries=True,
+    )
+    _print_table(
+        "Per handler",
+        [(name, samples, None) for name, samples in sorted(stats.handler_latency.items())],
+        with_queries=False,
+    )
+    print("\nBot API calls:", dict(api.calls))
+    if stats.errors:
+        print("Errors:", dict(stats.errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="عدد العملاء الوهميين")
+    parser.add_argument("--concurrency", type=int, default=50, help="عدد العملاء النشطين في نفس الوقت")
+    parser.add_argument("--ticket-messages", type=int, default=3, help="رسائل التذكرة لكل عميل")
+    parser.add_argument("--api-latency-ms", type=float, default=0.0, help="تأخير مصطنع لكل طلب Bot API")
+    parser.add_argument("--real-limits", action="store_true", help="استخدام حدود الإرسال الفعلية بدل تعطيلها")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    args.port = _free_port()
+
+    random.seed(args.seed)
+    _configure_environment(args.port, args.real_limits)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,391 +1,829 @@
-import os
-import threading
-import asyncio
-import json
-from flask import Flask
-from aiogram import Bot, Dispatcher, executor, types
-from aiogram.dispatcher import FSMContext
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
-from aiogram.dispatcher.filters.state import State, StatesGroup
-
-# --- استيراد النماذج من ملف قاعدة البيانات ---
-from database import SessionLocal, Product, Order, Ticket, TicketMessage, User
-import config
-
-# --- إعداد نظام الترجمة ---
-LANGUAGES = {}
-def load_translations():
-    """تحميل ملفات الترجمة JSON عند بدء التشغيل."""
-    for lang_code in ['en', 'ar']:
-        # تأكد من وجود الملفات قبل محاولة فتحها
-        if os.path.exists(f'{lang_code}.json'):
-            with open(f'{lang_code}.json', 'r', encoding='utf-8') as f:
-                LANGUAGES[lang_code] = json.load(f)
-        else:
-            print(f"WARNING: Translation file '{lang_code}.json' not found.")
-            LANGUAGES[lang_code] = {}
-
-def _(text_key, lang='en', **kwargs):
-    """دالة لجلب النص المترجم. إذا لم تكن اللغة موجودة، تستخدم الإنجليزية كافتراضي."""
-    # Fallback to English if language is not set or not found
-    lang = lang if lang in LANGUAGES else 'en'
-    return LANGUAGES.get(lang, {}).get(text_key, f"<{text_key}>").format(**kwargs)
-
-# --- تهيئة البوت وقاعدة البيانات ---
-bot = Bot(token=config.TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(bot, storage=storage)
-db_session = SessionLocal()
-
-
-# ================= STATES =================
-class SendProductState(StatesGroup):
-    waiting_for_details = State()
-
-class ReplyToTicketState(StatesGroup):
-    waiting_for_reply = State()
-
-# --- دوال مساعدة ---
-def get_or_create_user(user_id, username):
-    """جلب مستخدم من قاعدة البيانات أو إنشائه إذا لم يكن موجودًا."""
-    user = db_session.query(User).filter_by(user_id=user_id).first()
-    if not user:
-        user = User(user_id=user_id, username=username, language=None)
-        db_session.add(user)
-        db_session.commit()
-        db_session.refresh(user)
-    return user
-
-# ================= START & LANGUAGE SELECTION =================
-@dp.message_handler(commands=['start'])
-async def start(message: types.Message):
-    """التعامل مع أمر /start، وطلب اختيار اللغة إذا كانت غير محددة."""
-    user = get_or_create_user(message.from_user.id, message.from_user.username)
-    
-    if user.language is None:
-        keyboard = types.InlineKeyboardMarkup(row_width=2)
-        keyboard.add(
-            types.InlineKeyboardButton("English 🇬🇧", callback_data="setlang:en"),
-            types.InlineKeyboardButton("العربية 🇸🇦", callback_data="setlang:ar")
-        )
-        # رسالة الترحيب تعرض دائمًا باللغتين
-        await message.answer("🛒 Welcome! Please choose a language:\n\n🛒 أهلاً بك! الرجاء اختيار اللغة:", reply_markup=keyboard)
-    else:
-        await show_main_menu(message)
-
-@dp.callback_query_handler(lambda c: c.data.startswith("setlang:"))
-async def set_language(callback: types.CallbackQuery):
-    """حفظ اللغة التي اختارها المستخدم وعرض القائمة الرئيسية."""
-    lang_code = callback.data.split(":")[1]
-    user = get_or_create_user(callback.from_user.id, callback.from_user.username)
-    user.language = lang_code
-    db_session.commit()
-    
-    await callback.message.delete()
-    # --- التعديل هنا: مررنا كائن المستخدم المحدث مباشرة ---
-    await show_main_menu(callback.message, user=user)
-
-async def show_main_menu(message: types.Message, user=None):
-    """عرض القائمة الرئيسية باللغة المناسبة."""
-    # --- التعديل هنا: تحقق مما إذا تم تمرير المستخدم ---
-    if user is None:
-        user = get_or_create_user(message.from_user.id, message.from_user.username)
-    
-    lang = user.language
-    
-    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-
-    if message.from_user.id == config.ADMIN_ID:
-        keyboard.add(_("view_orders", lang), _("view_tickets", lang))
-        keyboard.add(_("manage_products", lang))
-    else:
-        products = db_session.query(Product).all()
-        for product in products:
-            keyboard.add(product.name)
-        keyboard.add(_("report_problem", lang))
-    
-    keyboard.add(_("select_language_button", lang))
-    await message.answer(_("welcome_back", lang), reply_markup=keyboard)
-
-@dp.message_handler(lambda msg: msg.text in [_("select_language_button", lang) for lang in LANGUAGES.keys()])
-async def change_language_prompt(message: types.Message):
-    """السماح للمستخدم بتغيير لغته."""
-    user = get_or_create_user(message.from_user.id, message.from_user.username)
-    user.language = None
-    db_session.commit()
-    await start(message)
-
-# ================= CLIENT SIDE (PRODUCTS & ORDERS) =================
-@dp.message_handler(lambda msg: db_session.query(Product).filter_by(name=msg.text).first() is not None and msg.from_user.id != config.ADMIN_ID)
-async def product_selected(message: types.Message):
-    user = get_or_create_user(message.from_user.id, message.from_user.username)
-    product = db_session.query(Product).filter_by(name=message.text).first()
-    
-    keyboard = types.InlineKeyboardMarkup()
-    for option in product.options:
-        keyboard.add(types.InlineKeyboardButton(
-            text=f"{option.option} - ${option.price}",
-            callback_data=f"buy:{product.name}:{option.option}:{option.price}"
-        ))
-    await message.answer(f"📦 {product.name}\n{_('choose_option', user.language)}", reply_markup=keyboard)
-
-@dp.callback_query_handler(lambda c: c.data.startswith("buy:"))
-async def handle_buy(callback: types.CallbackQuery):
-    user = get_or_create_user(callback.from_user.id, callback.from_user.username)
-    
-    # --- هذا هو السطر الذي تم تصحيحه ---
-    # لقد قمنا بتغيير `_` إلى `action` لتجنب التعارض
-    action, product_name, option_text, price_str = callback.data.split(":")
-    
-    new_order = Order(
-        user_id=callback.from_user.id,
-        username=callback.from_user.username,
-        product_name=product_name,
-        option=option_text,
-        price=float(price_str),
-        status="pending"
-    )
-    db_session.add(new_order)
-    db_session.commit()
-
-    paid_button_text = "I have paid" if user.language == 'en' else "لقد دفعت"
-    keyboard = types.InlineKeyboardMarkup().add(types.InlineKeyboardButton(f"✅ {paid_button_text}", callback_data=f"paid:{new_order.id}"))
-
-    await callback.message.answer(
-        f"{_('order_placed', user.language)}\n\n"
-        f"{_('payment_prompt', user.language, product_name=product_name, option_text=option_text, price_str=price_str, binance_id=config.BINANCE_ID)}",
-        reply_markup=keyboard
-    )
-    await callback.answer()
-@dp.callback_query_handler(lambda c: c.data.startswith("paid:"))
-async def handle_paid(callback: types.CallbackQuery):
-    user = get_or_create_user(callback.from_user.id, callback.from_user.username)
-    order_id = int(callback.data.split(":")[1])
-    order = db_session.query(Order).get(order_id)
-
-    if not order:
-        await callback.message.answer("Order not found.")
-        await callback.answer()
-        return
-
-    # إشعار المدير يبقى بالإنجليزية لسهولة المتابعة
-    keyboard = types.InlineKeyboardMarkup(row_width=2)
-    keyboard.add(
-        types.InlineKeyboardButton(text="✅ Confirm Payment", callback_data=f"confirm:{order.id}"),
-        types.InlineKeyboardButton(text="❌ Reject Payment", callback_data=f"reject:{order.id}")
-    )
-    await bot.send_message(
-        config.ADMIN_ID,
-        f"⚠️ Payment confirmation received!\n\n"
-        f"Order ID: {order.id}\n"
-        f"User: @{order.username} (ID: {order.user_id})\n"
-        f"Product: {order.product_name} ({order.option}) - ${order.price}",
-        reply_markup=keyboard
-    )
-    
-    await callback.message.answer(_("payment_confirmation", user.language))
-    await callback.answer()
-
-# ================= ADMIN SIDE (MANAGING ORDERS) =================
-@dp.message_handler(lambda msg: msg.text in [_("view_orders", lang) for lang in LANGUAGES.keys()] and msg.from_user.id == config.ADMIN_ID)
-async def show_orders(message: types.Message):
-    orders = db_session.query(Order).order_by(Order.id.desc()).all()
-    if not orders:
-        await message.answer("📭 No orders yet.")
-        return
-
-    for order in orders:
-        await message.answer(
-            f"🆔 Order ID: {order.id}\n"
-            f"👤 User: @{order.username} (ID: {order.user_id})\n"
-            f"📦 Product: {order.product_name} ({order.option})\n"
-            f"💵 Price: ${order.price}\n"
-            f"📌 Status: {order.status}"
-        )
-
-@dp.callback_query_handler(lambda c: c.data.startswith("confirm:") and c.from_user.id == config.ADMIN_ID)
-async def confirm_payment(callback: types.CallbackQuery):
-    order_id = int(callback.data.split(":")[1])
-    order = db_session.query(Order).get(order_id)
-    if not order:
-        await callback.answer("Order not found!")
-        return
-    
-    order.status = "paid"
-    db_session.commit()
-    
-    await callback.message.edit_text(
-        f"✅ Payment confirmed for Order #{order.id}.\n"
-        f"User: @{order.username}\n\n"
-        f"Please prepare the product details.",
-        reply_markup=types.InlineKeyboardMarkup().add(
-            types.InlineKeyboardButton(text="📤 Send Product", callback_data=f"sendproduct:{order.id}")
-        )
-    )
-    await callback.answer()
-
-@dp.callback_query_handler(lambda c: c.data.startswith("sendproduct:") and c.from_user.id == config.ADMIN_ID)
-async def send_product(callback: types.CallbackQuery, state: FSMContext):
-    order_id = int(callback.data.split(":")[1])
-    order = db_session.query(Order).get(order_id)
-    if not order:
-        await callback.answer("Order not found!")
-        return
-
-    await callback.message.answer(f"✍️ Please type the product details to send for Order #{order.id}:")
-    await state.update_data(order_id=order.id)
-    await SendProductState.waiting_for_details.set()
-    await callback.answer()
-
-@dp.message_handler(state=SendProductState.waiting_for_details, content_types=types.ContentTypes.TEXT, user_id=config.ADMIN_ID)
-async def process_product_details(message: types.Message, state: FSMContext):
-    data = await state.get_data()
-    order_id = data.get("order_id")
-    order = db_session.query(Order).get(order_id)
-    
-    if order:
-        order.status = "delivered"
-        db_session.commit()
-        user = get_or_create_user(order.user_id, order.username)
-        # إرسال رسالة للمستخدم بلغته
-        await bot.send_message(order.user_id, _("product_delivered", user.language, details=message.text, order_id=order.id))
-        await message.answer(f"✅ Product sent to user @{order.username} for Order #{order.id}.")
-    else:
-        await message.answer("Error: Could not find the order to update.")
-    
-    await state.finish()
-
-@dp.callback_query_handler(lambda c: c.data.startswith("reject:") and c.from_user.id == config.ADMIN_ID)
-async def reject_payment(callback: types.CallbackQuery):
-    order_id = int(callback.data.split(":")[1])
-    order = db_session.query(Order).get(order_id)
-    if order:
-        order.status = "rejected"
-        db_session.commit()
-        # نحصل على المستخدم ولغته لإرسال الرسالة المترجمة
-        user = get_or_create_user(order.user_id, order.username)
-        product_info = f"{order.product_name} ({order.option})"
-        
-        # نستخدم مفتاح الترجمة الجديد هنا
-        await bot.send_message(order.user_id, _("payment_rejected", user.language, product_name=product_info))
-        
-        await callback.message.edit_text(f"❌ Payment for Order #{order.id} has been rejected.")
-    else:
-        await callback.message.answer("Order not found.")
-    await callback.answer()
-
-@dp.message_handler(lambda msg: msg.text in [_("manage_products", lang) for lang in LANGUAGES.keys()] and msg.from_user.id == config.ADMIN_ID)
-async def manage_products(message: types.Message):
-    await message.answer("⚙️ Product management is under development.")
-
-
-# ================== TICKETS SYSTEM ==================
-# استخدم هذا الفلتر الجديد الذي يتحقق من النص بجميع اللغات المتاحة
-@dp.message_handler(lambda msg: msg.text in [_("report_problem", lang) for lang in LANGUAGES.keys()])
-async def report_problem(message: types.Message):
-    user = get_or_create_user(message.from_user.id, message.from_user.username)
-    open_ticket = db_session.query(Ticket).filter_by(user_id=user.user_id, is_open=True).first()
-
-    if open_ticket:
-        await message.answer(_("ticket_exists", user.language))
-    else:
-        new_ticket = Ticket(user_id=user.user_id)
-        db_session.add(new_ticket)
-        db_session.commit()
-        await message.answer(_("ticket_created", user.language))
-
-# فلتر للرسائل النصية التي ليست أوامر أو أزرار قائمة رئيسية من المستخدمين العاديين
-@dp.message_handler(lambda msg: not msg.text.startswith('/') and msg.from_user.id != config.ADMIN_ID and not any(msg.text in [_("select_language_button", lang), _("report_problem", lang)] for lang in LANGUAGES.keys()))
-async def handle_user_message(message: types.Message):
-    user = get_or_create_user(message.from_user.id, message.from_user.username)
-    open_ticket = db_session.query(Ticket).filter_by(user_id=user.user_id, is_open=True).first()
-
-    if open_ticket:
-        new_msg = TicketMessage(ticket_id=open_ticket.id, sender='user', text=message.text)
-        db_session.add(new_msg)
-        db_session.commit()
-
-        keyboard = types.InlineKeyboardMarkup(row_width=2)
-        keyboard.add(
-            types.InlineKeyboardButton("✍️ Reply", callback_data=f"reply:{open_ticket.id}"),
-            types.InlineKeyboardButton("❌ Close Ticket", callback_data=f"close:{open_ticket.id}")
-        )
-        await bot.send_message(
-            config.ADMIN_ID,
-            f"📩 New message in Ticket #{open_ticket.id} from @{user.username}:\n\n{message.text}",
-            reply_markup=keyboard
-        )
-        await message.answer(_("message_sent", user.language))
-
-@dp.message_handler(lambda msg: msg.text in [_("view_tickets", lang) for lang in LANGUAGES.keys()] and msg.from_user.id == config.ADMIN_ID)
-async def view_open_tickets(message: types.Message):
-    open_tickets = db_session.query(Ticket).filter_by(is_open=True).all()
-    if not open_tickets:
-        await message.answer("📭 No open tickets at the moment.")
-        return
-
-    await message.answer("👇 Here are the currently open tickets:")
-    for ticket in open_tickets:
-        keyboard = types.InlineKeyboardMarkup(row_width=2)
-        keyboard.add(
-            types.InlineKeyboardButton("✍️ Reply", callback_data=f"reply:{ticket.id}"),
-            types.InlineKeyboardButton("❌ Close Ticket", callback_data=f"close:{ticket.id}")
-        )
-        await message.answer(f"**Ticket #{ticket.id}** - From: @{ticket.user.username}", reply_markup=keyboard, parse_mode="Markdown")
-
-@dp.callback_query_handler(lambda c: c.data.startswith("reply:") and c.from_user.id == config.ADMIN_ID)
-async def reply_to_ticket_callback(callback: types.CallbackQuery, state: FSMContext):
-    ticket_id = int(callback.data.split(":")[1])
-    await state.update_data(ticket_id=ticket_id)
-    await ReplyToTicketState.waiting_for_reply.set()
-    await callback.message.answer(f"✍️ Please type your reply for Ticket #{ticket_id}:")
-    await callback.answer()
-
-@dp.message_handler(state=ReplyToTicketState.waiting_for_reply, user_id=config.ADMIN_ID)
-async def process_admin_reply(message: types.Message, state: FSMContext):
-    data = await state.get_data()
-    ticket_id = data.get("ticket_id")
-    ticket = db_session.query(Ticket).get(ticket_id)
-
-    if ticket and ticket.is_open:
-        admin_message = TicketMessage(ticket_id=ticket.id, sender='admin', text=message.text)
-        db_session.add(admin_message)
-        db_session.commit()
-
-        await bot.send_message(ticket.user_id, _("admin_reply_header", ticket.user.language, text=message.text), parse_mode="Markdown")
-        await message.answer(f"✅ Your reply has been sent for Ticket #{ticket.id}.")
-    else:
-        await message.answer("This ticket seems to be closed already.")
-    await state.finish()
-
-@dp.callback_query_handler(lambda c: c.data.startswith("close:") and c.from_user.id == config.ADMIN_ID)
-async def close_ticket_callback(callback: types.CallbackQuery):
-    ticket_id = int(callback.data.split(":")[1])
-    ticket = db_session.query(Ticket).get(ticket_id)
-    if ticket:
-        ticket.is_open = False
-        db_session.commit()
-        await bot.send_message(ticket.user_id, _("ticket_closed_user", ticket.user.language))
-        await callback.message.edit_text(f"✅ Ticket #{ticket.id} has been closed.")
-    await callback.answer()
-
-# ================== FLASK & BOT RUNNER ==================
-app = Flask(__name__)
-@app.route("/")
-def home():
-    return "Bot is up and running!"
-
-def run_flask():
-    port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port)
-
-if __name__ == "__main__":
-    print("Starting bot...")
-    load_translations() # تحميل ملفات اللغة عند بدء التشغيل
-    flask_thread = threading.Thread(target=run_flask)
-    flask_thread.start()
-    executor.start_polling(dp, skip_updates=True)
-
-
-
-
+import sys
+import asyncio
+from aiohttp import web
+from aiogram import Bot, Dispatcher, executor, types
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.state import State, StatesGroup
+from aiogram.utils.exceptions import MessageNotModified
+
+# --- استيراد طبقة الوصول إلى البيانات ---
+from database import run_db, engine
+from middlewares import DBSessionMiddleware, MetricsMiddleware
+import metrics
+from fsm_storage import SQLAlchemyStorage
+from catalog import catalog
+from callbacks import CallbackRouter, decode_buy, same_revision
+import keyboards
+from user_cache import UserCache
+from idempotency import IdempotencyCache
+from outbox import Outbox, PRIORITY_ADMIN, PRIORITY_BULK, truncate_text
+import payment_digest
+from broadcast import Broadcaster
+import repository as repo
+from webserver import create_app, create_metrics_app, start_app
+from i18n import load_translations, lookup_button, _
+import workers
+import analytics
+import tickets
+import config
+
+# --- تهيئة البوت وقاعدة البيانات ---
+# TELEGRAM_API_URL يسمح باستخدام خادم Bot API محلي (أو الخادم الوهمي في اختبارات الحمل)
+bot = metrics.MeteredBot(
+    token=config.TOKEN,
+    server=TelegramAPIServer.from_base(config.TELEGRAM_API_URL) if config.TELEGRAM_API_URL else TELEGRAM_PRODUCTION
+)
+# حالات المحادثة تُحفظ في قاعدة البيانات حتى لا تضيع عند إعادة التشغيل
+storage = SQLAlchemyStorage(flush_interval=config.FSM_FLUSH_INTERVAL, ttl=config.FSM_STATE_TTL)
+dp = Dispatcher(bot, storage=storage)
+dp.middleware.setup(MetricsMiddleware())
+dp.middleware.setup(DBSessionMiddleware())
+metrics.instrument_engine(engine)
+callbacks = CallbackRouter(admin_id=config.ADMIN_ID)
+users = UserCache(maxsize=config.USER_CACHE_SIZE, ttl=config.USER_CACHE_TTL)
+# التذكرة المفتوحة لكل مستخدم من الذاكرة بدل استعلام مع كل رسالة
+open_tickets = tickets.OpenTickets()
+# ضغطات الشراء المكررة على نفس الخيار خلال BUY_DEDUP_WINDOW ثانية تُجاب من الذاكرة
+buy_requests = IdempotencyCache(ttl=config.BUY_DEDUP_WINDOW)
+# كل الرسائل الموجهة لمحادثة غير محادثة التحديث الحالي (أو المرسلة بالجملة) تمر عبر الطابور
+outbox = Outbox(
+    bot,
+    global_rate=config.OUTBOX_GLOBAL_RATE,
+    chat_rate=config.OUTBOX_CHAT_RATE,
+    chat_burst=config.OUTBOX_CHAT_BURST,
+    bulk_rate=config.OUTBOX_BULK_RATE,
+    chat_limits={config.ADMIN_ID: (config.OUTBOX_ADMIN_CHAT_RATE, config.OUTBOX_ADMIN_CHAT_BURST)},
+)
+# ردود المعالجات المباشرة تُحتسب من نفس الحد العام
+bot.throttle = outbox.throttle
+payments = payment_digest.PaymentDigest(outbox, config.ADMIN_ID, config.PAYMENT_DIGEST_INTERVAL)
+broadcaster = Broadcaster(
+    bot, outbox, config.ADMIN_ID,
+    chunk_size=config.BROADCAST_CHUNK_SIZE,
+    progress_interval=config.BROADCAST_PROGRESS_INTERVAL,
+)
+
+
+# ================= STATES =================
+class SendProductState(StatesGroup):
+    waiting_for_details = State()
+
+class ReplyToTicketState(StatesGroup):
+    waiting_for_reply = State()
+
+class BroadcastState(StatesGroup):
+    waiting_for_en = State()
+    waiting_for_ar = State()
+
+# --- دوال مساعدة ---
+async def get_or_create_user(user_id, username, update_username=True):
+    """جلب مستخدم (من الذاكرة المؤقتة أولًا) أو إنشائه إذا لم يكن موجودًا."""
+    return await users.get_or_create(user_id, username, update_username=update_username)
+
+# ================= START & LANGUAGE SELECTION =================
+@dp.message_handler(commands=['start'])
+async def start(message: types.Message):
+    """التعامل مع أمر /start، وطلب اختيار اللغة إذا كانت غير محددة."""
+    user = await get_or_create_user(message.from_user.id, message.from_user.username)
+    
+    if user.language is None:
+        # رسالة الترحيب تعرض دائمًا باللغتين
+        await message.answer("🛒 Welcome! Please choose a language:\n\n🛒 أهلاً بك! الرجاء اختيار اللغة:", reply_markup=keyboards.language_picker())
+    else:
+        await show_main_menu(message)
+
+async def set_language(callback: types.CallbackQuery, lang_code):
+    """حفظ اللغة التي اختارها المستخدم وعرض القائمة الرئيسية."""
+    user = await users.set_language(callback.from_user.id, callback.from_user.username, lang_code)
+    
+    await callback.message.delete()
+    # --- التعديل هنا: مررنا كائن المستخدم المحدث مباشرة ---
+    await show_main_menu(callback.message, user=user)
+
+async def show_main_menu(message: types.Message, user=None):
+    """عرض القائمة الرئيسية باللغة المناسبة."""
+    # --- التعديل هنا: تحقق مما إذا تم تمرير المستخدم ---
+    if user is None:
+        user = await get_or_create_user(message.from_user.id, message.from_user.username)
+    
+    lang = user.language
+    role = keyboards.ROLE_ADMIN if message.from_user.id == config.ADMIN_ID else keyboards.ROLE_CUSTOMER
+    # اللوحة جاهزة من ذاكرة العرض ما لم يتغير الكتالوج أو الترجمات
+    await message.answer(_("welcome_back", lang), reply_markup=keyboards.main_menu(lang, role))
+
+# ================= MENU ROUTING =================
+def menu_button(msg: types.Message):
+    """
+    فلتر موحد لأزرار القائمة: بحث واحد في الفهرس العكسي للترجمات
+    بدل فلتر منفصل لكل زر يعيد بناء النصوص بكل اللغات مع كل رسالة.
+    """
+    hit = lookup_button(msg.text)
+    if hit is None:
+        return False
+    handler, admin_only = MENU_ROUTES[hit[0]]
+    if admin_only and msg.from_user.id != config.ADMIN_ID:
+        return False
+    return {"routed_handler": handler}
+
+@dp.message_handler(menu_button)
+async def route_menu_button(message: types.Message, routed_handler):
+    await routed_handler(message)
+
+@dp.callback_query_handler(callbacks.match)
+async def route_callback(callback: types.CallbackQuery, state: FSMContext, callback_route):
+    """كل أزرار inline تمر من هنا؛ جدول البادئات في CALLBACK ROUTES أسفل الملف."""
+    await callbacks.dispatch(callback, callback_route, state)
+
+async def change_language_prompt(message: types.Message):
+    """السماح للمستخدم بتغيير لغته."""
+    await users.set_language(message.from_user.id, message.from_user.username, None)
+    await start(message)
+
+# ================= CLIENT SIDE (PRODUCTS & ORDERS) =================
+def is_product_name(msg: types.Message):
+    """فلتر: هل النص اسم منتج؟ يبحث في الكتالوج المخزن ويعيد المنتج للمعالج."""
+    if msg.from_user.id == config.ADMIN_ID:
+        return False
+    product = catalog.get_product(msg.text)
+    return {"product": product} if product else False
+
+@dp.message_handler(is_product_name)
+async def product_selected(message: types.Message, product):
+    user = await get_or_create_user(message.from_user.id, message.from_user.username)
+    await message.answer(f"📦 {product.name}\n{_('choose_option', user.language)}", reply_markup=keyboards.product_options(product))
+
+async def handle_buy(callback: types.CallbackQuery, revision, option_id):
+    user = await get_or_create_user(callback.from_user.id, callback.from_user.username)
+
+    # الاسم والسعر من الكتالوج في الذاكرة؛ الزر المصنوع من كتالوج أقدم يُرفض لأن السعر ربما تغير
+    option = catalog.get_option(option_id)
+    if option is None or not same_revision(revision, catalog.revision):
+        await callback.answer(_("option_unavailable", user.language), show_alert=True)
+        return
+
+    (order, _created), first = await buy_requests.run(
+        (callback.from_user.id, option.id),
+        lambda: run_db(
+            repo.get_or_create_pending_order,
+            callback.from_user.id,
+            callback.from_user.username,
+            option.product_name,
+            option.option,
+            option.price,
+            option.id
+        )
+    )
+    if not first:
+        # ضغطة مكررة: تعليمات الدفع أُرسلت للتو
+        await callback.answer(_("order_exists", user.language, order_id=order.id))
+        return
+    if order.paid_claimed_at is not None:
+        # ضغط "لقد دفعت" على هذا الطلب من قبل: لا تعليمات دفع جديدة حتى يراجعه المدير
+        await callback.answer(_("payment_under_review", user.language, order_id=order.id), show_alert=True)
+        return
+
+    # طلب جديد، أو طلب معلق موجود (ضغطة لاحقة أو تحديث أعاد تيليجرام إرساله بعد إعادة التشغيل):
+    # نعيد إرسال تعليمات الدفع لنفس الطلب دون إنشاء صف جديد. النص من الطلب نفسه، فهو ما سيراجعه المدير
+    keyboard = types.InlineKeyboardMarkup().add(
+        types.InlineKeyboardButton(_("i_have_paid", user.language), callback_data=f"paid:{order.id}")
+    )
+
+    await callback.message.answer(
+        f"{_('order_placed', user.language)}\n\n"
+        f"{_('payment_prompt', user.language, product_name=order.product_name, option_text=order.option, price_str=order.price, binance_id=config.BINANCE_ID)}",
+        reply_markup=keyboard
+    )
+    await callback.answer()
+
+async def handle_paid(callback: types.CallbackQuery, order_id):
+    user = await get_or_create_user(callback.from_user.id, callback.from_user.username)
+    order, first_claim = await run_db(repo.claim_payment, order_id, callback.from_user.id)
+
+    if not order:
+        await callback.message.answer("Order not found.")
+        await callback.answer()
+        return
+    if not first_claim:
+        # ضغطة مكررة (أو طلب عالجه المدير): لا إشعار جديد للمدير
+        await callback.answer(_("payment_confirmation", user.language), show_alert=True)
+        return
+
+    # رسالة للمدير الآن أو في الملخص التالي؛ تُعاد بعد إعادة التشغيل إذا لم تصل
+    payments.add(order)
+    await callback.message.answer(_("payment_confirmation", user.language))
+    await callback.answer()
+
+# ================= ADMIN SIDE (MANAGING ORDERS) =================
+ORDER_STATUSES = ("pending", "paid", "delivered", "rejected", "cancelled")
+TICKET_FILTERS = {"open": True, "closed": False, "all": None}
+
+def _parse_page_callback(payload):
+    """بيانات أزرار التصفح: <view>:<filter>:<o|n>:<cursor> (o = أقدم، n = أحدث، 0 = الصفحة الأولى)."""
+    page_filter, direction, cursor = payload.split(":")
+    cursor = int(cursor) or None
+    if direction == "n":
+        return page_filter, None, cursor
+    return page_filter, cursor, None
+
+def _page_nav_row(view, page_filter, rows, has_newer, has_older):
+    buttons = []
+    if rows and has_newer:
+        buttons.append(types.InlineKeyboardButton("⬅️ Newer", callback_data=f"{view}:{page_filter}:n:{rows[0].id}"))
+    if rows and has_older:
+        buttons.append(types.InlineKeyboardButton("Older ➡️", callback_data=f"{view}:{page_filter}:o:{rows[-1].id}"))
+    return buttons
+
+async def render_orders_page(page_filter="all", before=None, after=None):
+    """صفحة واحدة من الطلبات مع سطر ملخص وأزرار التصفية والتنقل."""
+    status = page_filter if page_filter in ORDER_STATUSES else None
+    orders, has_newer, has_older = await run_db(
+        repo.page_orders, status, before, after, config.ADMIN_PAGE_SIZE
+    )
+    stats = await run_db(repo.order_stats, ORDER_STATUSES)
+
+    counts = " | ".join(f"{s}: {stats[s][0]}" for s in ORDER_STATUSES)
+    revenue = sum(stats[s][1] for s in ("paid", "delivered"))
+    lines = [f"📋 Orders — {counts} | 💵 ${revenue:g}", ""]
+    if not orders:
+        lines.append("📭 No orders yet.")
+    for order in orders:
+        lines.append(
+            f"🆔 #{order.id} · @{order.username} (ID: {order.user_id})\n"
+            f"    📦 {order.product_name} ({order.option}) · ${order.price} · 📌 {order.status}"
+        )
+
+    keyboard = types.InlineKeyboardMarkup(row_width=5)
+    keyboard.row(*[
+        types.InlineKeyboardButton(
+            f"{'• ' if f == page_filter else ''}{f.title()}", callback_data=f"orders:{f}:o:0"
+        )
+        for f in ("all",) + ORDER_STATUSES
+    ])
+    nav = _page_nav_row("orders", page_filter, orders, has_newer, has_older)
+    if nav:
+        keyboard.row(*nav)
+    return "\n".join(lines), keyboard
+
+async def render_tickets_page(page_filter="open", before=None, after=None):
+    """صفحة واحدة من التذاكر (مع أصحابها في نفس الاستعلام) وأزرار الرد والإغلاق."""
+    page, has_newer, has_older = await run_db(
+        repo.page_tickets, TICKET_FILTERS.get(page_filter), before, after, config.ADMIN_PAGE_SIZE
+    )
+    stats = await run_db(repo.ticket_stats)
+
+    lines = [f"🎫 Tickets — open: {stats.get(True, 0)} | closed: {stats.get(False, 0)}", ""]
+    if not page:
+        lines.append("📭 No open tickets at the moment." if page_filter == "open" else "📭 No tickets.")
+
+    keyboard = types.InlineKeyboardMarkup(row_width=3)
+    keyboard.row(*[
+        types.InlineKeyboardButton(
+            f"{'• ' if f == page_filter else ''}{f.title()}", callback_data=f"tickets:{f}:o:0"
+        )
+        for f in TICKET_FILTERS
+    ])
+    for ticket in page:
+        lines.append(f"{'🟢' if ticket.is_open else '⚪️'} Ticket #{ticket.id} - From: @{ticket.user.username}")
+        history = types.InlineKeyboardButton(f"📜 #{ticket.id}", callback_data=f"transcript:{ticket.id}:o:0")
+        if ticket.is_open:
+            keyboard.row(
+                types.InlineKeyboardButton(f"✍️ Reply #{ticket.id}", callback_data=f"reply:{ticket.id}"),
+                types.InlineKeyboardButton(f"❌ Close #{ticket.id}", callback_data=f"close:{ticket.id}"),
+                history
+            )
+        else:
+            keyboard.row(history)
+    nav = _page_nav_row("tickets", page_filter, page, has_newer, has_older)
+    if nav:
+        keyboard.row(*nav)
+    return "\n".join(lines), keyboard
+
+async def show_orders(message: types.Message):
+    text, keyboard = await render_orders_page()
+    await message.answer(text, reply_markup=keyboard)
+
+async def page_orders_callback(callback: types.CallbackQuery, page_filter, before, after):
+    text, keyboard = await render_orders_page(page_filter, before, after)
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except MessageNotModified:
+        pass
+    await callback.answer()
+
+async def confirm_payment(callback: types.CallbackQuery, order_id):
+    order, changed = await run_db(repo.set_order_status, order_id, "paid", "pending")
+    if not order:
+        await callback.answer("Order not found!")
+        return
+    if not changed:
+        await callback.answer(f"Order #{order.id} is already {order.status}.", show_alert=True)
+        return
+    
+    await callback.message.edit_text(
+        f"✅ Payment confirmed for Order #{order.id}.\n"
+        f"User: @{order.username}\n\n"
+        f"Please prepare the product details.",
+        reply_markup=types.InlineKeyboardMarkup().add(
+            types.InlineKeyboardButton(text="📤 Send Product", callback_data=f"sendproduct:{order.id}")
+        )
+    )
+    await callback.answer()
+
+async def send_product(callback: types.CallbackQuery, order_id, state: FSMContext):
+    order = await run_db(repo.get_order, order_id)
+    if not order:
+        await callback.answer("Order not found!")
+        return
+
+    await callback.message.answer(f"✍️ Please type the product details to send for Order #{order.id}:")
+    await state.update_data(order_id=order.id)
+    await SendProductState.waiting_for_details.set()
+    await callback.answer()
+
+@dp.message_handler(state=SendProductState.waiting_for_details, content_types=types.ContentTypes.TEXT, user_id=config.ADMIN_ID)
+async def process_product_details(message: types.Message, state: FSMContext):
+    data = await state.get_data()
+    order_id = data.get("order_id")
+    order, changed = await run_db(repo.set_order_status, order_id, "delivered", "paid") if order_id else (None, False)
+
+    if order and not changed:
+        await message.answer(f"Order #{order.id} is {order.status}, not paid. Nothing was sent.")
+    elif order:
+        user = await get_or_create_user(order.user_id, order.username, update_username=False)
+        # إرسال رسالة للمستخدم بلغته. تفاصيل المنتج لا تُحفظ إلا في الطابور، فننتظر وصولها:
+        # إن لم تصل يعود الطلب إلى paid ليرسلها المدير مرة أخرى
+        try:
+            await outbox.send_message(order.user_id, _("product_delivered", user.language, details=message.text, order_id=order.id))
+        except Exception as e:
+            await run_db(repo.set_order_status, order.id, "paid", "delivered")
+            await message.answer(
+                f"❌ Could not send the product to @{order.username} for Order #{order.id}: {e}\n"
+                f"The order is back to paid.",
+                reply_markup=types.InlineKeyboardMarkup().add(
+                    types.InlineKeyboardButton(text="📤 Send Product", callback_data=f"sendproduct:{order.id}")
+                )
+            )
+        else:
+            await message.answer(f"✅ Product sent to user @{order.username} for Order #{order.id}.")
+    else:
+        await message.answer("Error: Could not find the order to update.")
+    
+    await state.finish()
+
+async def reject_payment(callback: types.CallbackQuery, order_id):
+    order, changed = await run_db(repo.set_order_status, order_id, "rejected", "pending")
+    if order and not changed:
+        await callback.answer(f"Order #{order.id} is already {order.status}.", show_alert=True)
+        return
+    if order:
+        # نحصل على المستخدم ولغته لإرسال الرسالة المترجمة
+        user = await get_or_create_user(order.user_id, order.username, update_username=False)
+        product_info = f"{order.product_name} ({order.option})"
+        
+        # نستخدم مفتاح الترجمة الجديد هنا
+        outbox.send_message(order.user_id, _("payment_rejected", user.language, product_name=product_info))
+        
+        await callback.message.edit_text(f"❌ Payment for Order #{order.id} has been rejected.")
+    else:
+        await callback.message.answer("Order not found.")
+    await callback.answer()
+
+async def notify_rejected(orders):
+    """إشعار أصحاب الطلبات المرفوضة بلغاتهم (استعلام واحد للغات، والإرسال عبر الطابور بأولوية منخفضة)."""
+    languages = await run_db(repo.get_languages, list({order.user_id for order in orders}))
+    for order in orders:
+        product_info = f"{order.product_name} ({order.option})"
+        outbox.send_message(
+            order.user_id,
+            _("payment_rejected", languages.get(order.user_id), product_name=product_info),
+            priority=PRIORITY_BULK
+        )
+
+async def digest_callback(callback: types.CallbackQuery, action, order_id):
+    """أزرار ملخص الدفعات: الاختيار يعدل الأزرار فقط، والتأكيد أو الرفض يطبق على المحدد في معاملة واحدة."""
+    entries = payment_digest.read_selection(callback.message.reply_markup)
+
+    if action not in (payment_digest.ACTION_CONFIRM, payment_digest.ACTION_REJECT):
+        entries = payment_digest.apply_selection(entries, action, order_id)
+        try:
+            await callback.message.edit_reply_markup(payment_digest.render_keyboard(entries))
+        except MessageNotModified:
+            pass
+        await callback.answer()
+        return
+
+    selected = [oid for oid, _label, is_selected in entries if is_selected]
+    if not selected:
+        await callback.answer("Nothing selected.")
+        return
+
+    status = "paid" if action == payment_digest.ACTION_CONFIRM else "rejected"
+    orders = await run_db(repo.set_orders_status, selected, status)
+    changed = {order.id for order in orders}
+    skipped = [oid for oid in selected if oid not in changed]
+
+    verb = "Confirmed" if status == "paid" else "Rejected"
+    summary = [f"{verb}: {', '.join(f'#{oid}' for oid in sorted(changed)) or '-'}"]
+    if skipped:
+        summary.append(f"Already handled: {', '.join(f'#{oid}' for oid in skipped)}")
+    # الطلبات غير المحددة تبقى في الرسالة ليقرر فيها المدير لاحقًا
+    remaining = [entry for entry in entries if entry[0] not in selected]
+    await callback.message.edit_text(
+        callback.message.text + "\n\n" + "\n".join(summary),
+        reply_markup=payment_digest.render_keyboard(remaining)
+    )
+
+    if status == "rejected":
+        await notify_rejected(orders)
+    elif orders:
+        keyboard = types.InlineKeyboardMarkup(row_width=3)
+        keyboard.add(*[
+            types.InlineKeyboardButton(f"📤 Send #{order.id}", callback_data=f"sendproduct:{order.id}")
+            for order in orders
+        ])
+        await callback.message.answer("Please prepare the product details.", reply_markup=keyboard)
+    await callback.answer()
+
+@dp.message_handler(commands=['analytics'], user_id=config.ADMIN_ID)
+async def show_analytics(message: types.Message):
+    """/analytics [from] [to]: ملخص المبيعات من جدول الإحصاءات اليومية (بدون المرور على orders)."""
+    try:
+        start, end = analytics.parse_range(message.get_args())
+    except ValueError:
+        await message.answer("Usage: /analytics [YYYY-MM-DD] [YYYY-MM-DD]")
+        return
+    data = await run_db(analytics.report, start, end)
+    await message.answer(analytics.render_report(data))
+
+@dp.message_handler(commands=['export_orders'], user_id=config.ADMIN_ID)
+async def export_orders(message: types.Message):
+    """/export_orders [from] [to]: ملف CSV بطلبات الفترة، يُكتب دفعة دفعة في خيط قاعدة البيانات."""
+    try:
+        start, end = analytics.parse_range(message.get_args())
+    except ValueError:
+        await message.answer("Usage: /export_orders [YYYY-MM-DD] [YYYY-MM-DD]")
+        return
+    fp, count = await run_db(analytics.export_orders_file, start, end)
+    with fp:
+        await message.answer_document(
+            types.InputFile(fp, filename=f"orders_{start}_{end}.csv"),
+            caption=f"🧾 {count} orders, {start} → {end}"
+        )
+
+async def manage_products(message: types.Message):
+    await message.answer("⚙️ Product management is under development.")
+
+
+# ================== BROADCAST ==================
+@dp.message_handler(commands=['broadcast'], user_id=config.ADMIN_ID)
+async def broadcast_prompt(message: types.Message):
+    await BroadcastState.waiting_for_en.set()
+    await message.answer("📣 Send the announcement text in English (or /cancel):")
+
+@dp.message_handler(commands=['cancel'], state=BroadcastState.all_states, user_id=config.ADMIN_ID)
+async def broadcast_abort(message: types.Message, state: FSMContext):
+    await state.finish()
+    await message.answer("Broadcast cancelled.")
+
+# الأوامر (مثل /skip في غير مكانه أو /broadcast_status) لا تُقبل نصًا للبث
+@dp.message_handler(lambda msg: not msg.is_command(), state=BroadcastState.waiting_for_en, content_types=types.ContentTypes.TEXT, user_id=config.ADMIN_ID)
+async def broadcast_text_en(message: types.Message, state: FSMContext):
+    await state.update_data(broadcast_en=message.text)
+    await BroadcastState.waiting_for_ar.set()
+    await message.answer("Now send the Arabic text, or /skip to send the English text to everyone:")
+
+@dp.message_handler(commands=['skip'], state=BroadcastState.waiting_for_ar, user_id=config.ADMIN_ID)
+async def broadcast_skip_ar(message: types.Message, state: FSMContext):
+    await _start_broadcast(message, state, None)
+
+@dp.message_handler(lambda msg: not msg.is_command(), state=BroadcastState.waiting_for_ar, content_types=types.ContentTypes.TEXT, user_id=config.ADMIN_ID)
+async def broadcast_text_ar(message: types.Message, state: FSMContext):
+    await _start_broadcast(message, state, message.text)
+
+@dp.message_handler(state=BroadcastState.all_states, content_types=types.ContentTypes.ANY, user_id=config.ADMIN_ID)
+async def broadcast_text_invalid(message: types.Message, state: FSMContext):
+    if await state.get_state() == BroadcastState.waiting_for_ar.state:
+        await message.answer("Send the Arabic text as a message, /skip, or /cancel.")
+    else:
+        await message.answer("Send the English text as a message, or /cancel.")
+
+async def _start_broadcast(message, state, text_ar):
+    data = await state.get_data()
+    texts = {"en": data["broadcast_en"]}
+    if text_ar is not None:
+        texts["ar"] = text_ar
+    await state.finish()
+    broadcast_id = await broadcaster.start(texts)
+    await message.answer(f"📣 Broadcast #{broadcast_id} started. /broadcast_status shows its progress.")
+
+@dp.message_handler(commands=['broadcast_status'], user_id=config.ADMIN_ID)
+async def broadcast_status(message: types.Message):
+    await message.answer("\n\n".join(broadcaster.status()) or "No broadcast is running.")
+
+@dp.message_handler(commands=['broadcast_cancel'], user_id=config.ADMIN_ID)
+async def broadcast_cancel(message: types.Message):
+    arg = message.get_args()
+    if not arg.isdigit():
+        await message.answer("Usage: /broadcast_cancel <id>")
+        return
+    if await broadcaster.cancel(int(arg)):
+        await message.answer(f"Broadcast #{arg} cancelled.")
+    else:
+        await message.answer(f"Broadcast #{arg} not found.")
+
+
+# ================== TICKETS SYSTEM ==================
+async def report_problem(message: types.Message):
+    user = await get_or_create_user(message.from_user.id, message.from_user.username)
+    # زر نادر الاستخدام: نتحقق من قاعدة البيانات (ربما أُغلقت التذكرة في عملية أخرى) ونحدّث الذاكرة
+    open_ticket = await run_db(repo.get_open_ticket, user.user_id)
+
+    if open_ticket:
+        open_tickets.opened(user.user_id, open_ticket.id)
+        await message.answer(_("ticket_exists", user.language))
+    else:
+        ticket = await run_db(repo.create_ticket, user.user_id)
+        open_tickets.opened(user.user_id, ticket.id)
+        await message.answer(_("ticket_created", user.language))
+
+# فلتر للرسائل النصية التي ليست أوامر أو أزرار قائمة رئيسية من المستخدمين العاديين
+# أزرار القائمة تلتقطها route_menu_button قبل الوصول إلى هنا
+@dp.message_handler(lambda msg: not msg.text.startswith('/') and msg.from_user.id != config.ADMIN_ID)
+async def handle_user_message(message: types.Message):
+    user = await get_or_create_user(message.from_user.id, message.from_user.username)
+    ticket_id = open_tickets.get(user.user_id)
+    if ticket_id is None:
+        return
+
+    # الإضافة تفشل إذا أُغلقت التذكرة في عملية أخرى؛ عندها ننسى التذكرة
+    if not await run_db(repo.add_message_if_open, ticket_id, 'user', message.text):
+        open_tickets.closed(user.user_id, ticket_id)
+        return
+
+    keyboard = types.InlineKeyboardMarkup(row_width=3)
+    keyboard.add(
+        types.InlineKeyboardButton("✍️ Reply", callback_data=f"reply:{ticket_id}"),
+        types.InlineKeyboardButton("❌ Close Ticket", callback_data=f"close:{ticket_id}"),
+        types.InlineKeyboardButton("📜 History", callback_data=f"transcript:{ticket_id}:o:0")
+    )
+    # الرسائل المتتالية لنفس التذكرة تُدمج في رسالة واحدة للمدير إذا لم تُرسل بعد
+    outbox.send_message(
+        config.ADMIN_ID,
+        message.text,
+        header=f"📩 New message in Ticket #{ticket_id} from @{user.username}:",
+        coalesce_key=("ticket", ticket_id),
+        reply_markup=keyboard,
+        priority=PRIORITY_ADMIN
+    )
+    await message.answer(_("message_sent", user.language))
+
+async def view_open_tickets(message: types.Message):
+    text, keyboard = await render_tickets_page()
+    await message.answer(text, reply_markup=keyboard)
+
+async def page_tickets_callback(callback: types.CallbackQuery, page_filter, before, after):
+    text, keyboard = await render_tickets_page(page_filter, before, after)
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except MessageNotModified:
+        pass
+    await callback.answer()
+
+# حتى تتسع الصفحة في رسالة واحدة (4096 وحدة UTF-16 كما يحسبها تيليجرام، لا len() في بايثون)
+TRANSCRIPT_LINE_LIMIT = 350
+
+async def render_transcript_page(ticket_id, before=None, after=None):
+    """صفحة من سجل محادثة التذكرة (من الجدول أو الأرشيف) بترتيب زمني، مع التنقل والتنزيل."""
+    ticket, messages, has_newer, has_older = await run_db(
+        tickets.page_transcript, ticket_id, before, after, config.ADMIN_PAGE_SIZE
+    )
+    if ticket is None:
+        return "Ticket not found.", None
+
+    state = "open" if ticket.is_open else ("archived" if ticket.archived_at else "closed")
+    lines = [f"📜 Ticket #{ticket.id} · @{ticket.user.username} · {state}", ""]
+    if not messages:
+        lines.append("📭 No messages.")
+    for message in reversed(messages):
+        lines.append(truncate_text(tickets.format_message(message), TRANSCRIPT_LINE_LIMIT))
+
+    keyboard = types.InlineKeyboardMarkup(row_width=3)
+    nav = _page_nav_row("transcript", ticket.id, messages, has_newer, has_older)
+    if nav:
+        keyboard.row(*nav)
+    actions = [types.InlineKeyboardButton("📄 Download", callback_data=f"transcriptfile:{ticket.id}")]
+    if ticket.is_open:
+        actions += [
+            types.InlineKeyboardButton("✍️ Reply", callback_data=f"reply:{ticket.id}"),
+            types.InlineKeyboardButton("❌ Close", callback_data=f"close:{ticket.id}"),
+        ]
+    keyboard.row(*actions)
+    # ADMIN_PAGE_SIZE أكبر من المعتاد أو عنوان طويل قد يتجاوز الحد رغم قص الأسطر
+    return truncate_text("\n".join(lines)), keyboard
+
+def _parse_transcript_callback(payload):
+    """<ticket_id>:<o|n>:<cursor> بنفس صيغة صفحات الطلبات والتذاكر."""
+    ticket_id, before, after = _parse_page_callback(payload)
+    return int(ticket_id), before, after
+
+async def transcript_callback(callback: types.CallbackQuery, ticket_id, before, after):
+    text, keyboard = await render_transcript_page(ticket_id, before, after)
+    # أول ضغطة (من رسالة تذكرة أو قائمة التذاكر) تفتح رسالة جديدة، والتنقل يعدل نفس الرسالة
+    if before is None and after is None:
+        await callback.message.answer(text, reply_markup=keyboard)
+    else:
+        try:
+            await callback.message.edit_text(text, reply_markup=keyboard)
+        except MessageNotModified:
+            pass
+    await callback.answer()
+
+async def transcript_file_callback(callback: types.CallbackQuery, ticket_id):
+    fp, count = await run_db(tickets.transcript_file, ticket_id)
+    if fp is None:
+        await callback.answer("Ticket not found!")
+        return
+    with fp:
+        await callback.message.answer_document(
+            types.InputFile(fp, filename=f"ticket_{ticket_id}.txt"),
+            caption=f"📜 Ticket #{ticket_id}: {count} messages"
+        )
+    await callback.answer()
+
+async def reply_to_ticket_callback(callback: types.CallbackQuery, ticket_id, state: FSMContext):
+    await state.update_data(ticket_id=ticket_id)
+    await ReplyToTicketState.waiting_for_reply.set()
+    await callback.message.answer(f"✍️ Please type your reply for Ticket #{ticket_id}:")
+    await callback.answer()
+
+@dp.message_handler(state=ReplyToTicketState.waiting_for_reply, user_id=config.ADMIN_ID)
+async def process_admin_reply(message: types.Message, state: FSMContext):
+    data = await state.get_data()
+    ticket_id = data.get("ticket_id")
+    ticket = await run_db(repo.get_ticket, ticket_id)
+
+    if ticket and ticket.is_open:
+        await run_db(repo.add_ticket_message, ticket.id, 'admin', message.text)
+
+        user = await get_or_create_user(ticket.user_id, ticket.user.username, update_username=False)
+        # الرد محفوظ في التذكرة، لكن وصوله للمستخدم غير مضمون (حظر البوت، انتهاء المحاولات)
+        try:
+            await outbox.send_message(ticket.user_id, _("admin_reply_header", user.language, text=message.text), parse_mode="Markdown")
+        except Exception as e:
+            await message.answer(f"❌ Your reply was saved to Ticket #{ticket.id} but could not be sent to the user: {e}")
+        else:
+            await message.answer(f"✅ Your reply has been sent for Ticket #{ticket.id}.")
+    else:
+        await message.answer("This ticket seems to be closed already.")
+    await state.finish()
+
+async def close_ticket_callback(callback: types.CallbackQuery, ticket_id):
+    ticket = await run_db(repo.close_ticket, ticket_id)
+    if ticket:
+        open_tickets.closed(ticket.user_id, ticket.id)
+        user = await get_or_create_user(ticket.user_id, ticket.user.username, update_username=False)
+        outbox.send_message(ticket.user_id, _("ticket_closed_user", user.language))
+        await callback.message.edit_text(f"✅ Ticket #{ticket.id} has been closed.")
+    await callback.answer()
+
+# جدول توجيه أزرار القائمة: المفتاح -> (المعالج، للمدير فقط؟)
+MENU_ROUTES = {
+    "select_language_button": (change_language_prompt, False),
+    "report_problem": (report_problem, False),
+    "view_orders": (show_orders, True),
+    "view_tickets": (view_open_tickets, True),
+    "manage_products": (manage_products, True),
+}
+
+# ================= CALLBACK ROUTES =================
+# البادئة -> المعالج. الوسيط الافتراضي رقم (معرف طلب أو تذكرة)؛ المعالجات التي تعلن
+# عن state تحصل على FSMContext.
+callbacks.add("setlang", set_language, parse=str)
+callbacks.add("buy", handle_buy, parse=decode_buy)
+callbacks.add("paid", handle_paid)
+callbacks.add("confirm", confirm_payment, admin_only=True)
+callbacks.add("reject", reject_payment, admin_only=True)
+callbacks.add("sendproduct", send_product, admin_only=True)
+callbacks.add(payment_digest.PREFIX, digest_callback, parse=payment_digest.parse_callback, admin_only=True)
+callbacks.add("orders", page_orders_callback, parse=_parse_page_callback, admin_only=True)
+callbacks.add("tickets", page_tickets_callback, parse=_parse_page_callback, admin_only=True)
+callbacks.add("reply", reply_to_ticket_callback, admin_only=True)
+callbacks.add("close", close_ticket_callback, admin_only=True)
+callbacks.add("transcript", transcript_callback, parse=_parse_transcript_callback, admin_only=True)
+callbacks.add("transcriptfile", transcript_file_callback, admin_only=True)
+
+def _collect_runtime_metrics():
+    metrics.outbox_queued.set(value=len(outbox))
+    metrics.outbox_messages.set("sent", value=outbox.sent)
+    metrics.outbox_messages.set("failed", value=outbox.failed)
+    metrics.outbox_messages.set("retried", value=outbox.retried)
+    metrics.outbox_messages.set("coalesced", value=outbox.coalesced)
+    metrics.cache_entries.set("users", value=len(users))
+    metrics.cache_entries.set("payment_digest", value=len(payments))
+    metrics.cache_entries.set("buy_requests", value=len(buy_requests))
+    metrics.cache_entries.set("open_tickets", value=len(open_tickets))
+    for result, count in broadcaster.totals().items():
+        metrics.broadcast_messages.set(result, value=count)
+    metrics.cache_entries.set("keyboards", value=len(keyboards.render_cache))
+
+metrics.registry.add_collector(_collect_runtime_metrics)
+
+# ================== STARTUP ==================
+async def on_startup(dispatcher: Dispatcher):
+    load_translations() # تحميل ملفات اللغة عند بدء التشغيل
+    await catalog.refresh()
+    await open_tickets.load()
+    asyncio.create_task(catalog.watch(config.CATALOG_REFRESH_INTERVAL))
+    asyncio.create_task(users.run_flusher(config.USERNAME_FLUSH_INTERVAL))
+    outbox.start()
+    # في وضع العمليات المتعددة يستأنف البث والإشعارات ويرسل ملخص الدفعات ويؤرشف التذاكر العامل
+    # المسؤول عن المدير فقط (هو من يستقبل أوامره)
+    if config.IS_ADMIN_WORKER:
+        await broadcaster.resume()
+        await payments.resume()
+        if config.PAYMENT_DIGEST_INTERVAL > 0:
+            asyncio.create_task(payments.run())
+        if config.TICKET_ARCHIVE_DAYS > 0:
+            asyncio.create_task(tickets.run_archiver(config.TICKET_ARCHIVE_DAYS, config.TICKET_ARCHIVE_INTERVAL))
+
+async def on_shutdown(dispatcher: Dispatcher):
+    await broadcaster.stop()
+    if config.IS_ADMIN_WORKER and config.PAYMENT_DIGEST_INTERVAL > 0:
+        await payments.flush()  # ضغطات "لقد دفعت" التي لم تُرسل في ملخص بعد
+    await outbox.stop()
+    await payments.drain()
+    await users.flush()
+
+# ================== BOT RUNNER ==================
+def run_webhook():
+    """تيليجرام يرسل التحديثات إلى خادم aiohttp، وفحص الصحة على نفس الخادم."""
+    app = create_app(dp, config.WEBHOOK_PATH, config.WEBHOOK_SECRET, config.WEBHOOK_MAX_CONCURRENCY)
+
+    async def _startup(app):
+        Bot.set_current(bot)
+        Dispatcher.set_current(dp)
+        await on_startup(dp)
+        app["metrics_runner"] = await start_app(create_metrics_app(), config.METRICS_HOST, config.METRICS_PORT)
+        # بدون WEBHOOK_HOST لا نسجل webhook (مفيد للتجربة المحلية بإرسال تحديثات يدويًا)
+        if config.WEBHOOK_HOST:
+            await bot.set_webhook(
+                config.WEBHOOK_HOST.rstrip("/") + config.WEBHOOK_PATH,
+                secret_token=config.WEBHOOK_SECRET,
+                drop_pending_updates=True,
+            )
+
+    async def _shutdown(app):
+        await app["webhook_handler"].drain()
+        await app["metrics_runner"].cleanup()
+        await on_shutdown(dp)
+        await dp.storage.close()
+        await dp.storage.wait_closed()
+        await (await bot.get_session()).close()
+
+    app.on_startup.append(_startup)
+    app.on_shutdown.append(_shutdown)
+    web.run_app(app, host=config.WEB_HOST, port=config.PORT)
+
+def run_polling():
+    """الوضع الاحتياطي: long polling مع خادم فحص الصحة على نفس حلقة الأحداث."""
+    async def _startup(dispatcher: Dispatcher):
+        # لا يعمل getUpdates إذا كان هناك webhook مسجل
+        await bot.delete_webhook(drop_pending_updates=True)
+        await on_startup(dispatcher)
+        dispatcher["health_runner"] = await start_app(create_app(dispatcher), config.WEB_HOST, config.PORT)
+        dispatcher["metrics_runner"] = await start_app(create_metrics_app(), config.METRICS_HOST, config.METRICS_PORT)
+
+    async def _shutdown(dispatcher: Dispatcher):
+        await dispatcher["health_runner"].cleanup()
+        await dispatcher["metrics_runner"].cleanup()
+        await on_shutdown(dispatcher)
+
+    executor.start_polling(dp, on_startup=_startup, on_shutdown=_shutdown)
+
+def run_worker():
+    """عامل تحت supervisor.py: التحديثات تصل عبر stdin موزعة حسب المستخدم."""
+    async def _main():
+        await workers.serve(
+            dp, on_startup, on_shutdown,
+            max_concurrency=config.WEBHOOK_MAX_CONCURRENCY,
+            stats_interval=config.WORKER_STATS_INTERVAL,
+        )
+    asyncio.run(_main())
+
+if __name__ == "__main__":
+    if "--worker" in sys.argv:
+        run_worker()
+        sys.exit(0)
+    print("Starting bot...")
+    # يمكن فرض الوضع من سطر الأوامر: python bot.py --polling أو --webhook
+    mode = config.RUN_MODE
+    if "--polling" in sys.argv:
+        mode = "polling"
+    elif "--webhook" in sys.argv:
+        mode = "webhook"
+
+    if mode == "webhook":
+        run_webhook()
+    else:
+        run_polling()
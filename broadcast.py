@@ -0,0 +1,232 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+
+from aiogram.utils.exceptions import BotBlocked, BotKicked, CantInitiateConversation, ChatNotFound, UserDeactivated
+
+from database import create_background_task, run_db
+from i18n import SUPPORTED_LANGUAGES, _
+from outbox import PRIORITY_ADMIN, PRIORITY_BULK
+import repository as repo
+
+log = logging.getLogger(__name__)
+
+# --- البث لكل المستخدمين ---
+# المستخدمون يُقرؤون من جدول users على دفعات بترتيب users.id (keyset)، والرسالة تُجهَّز مرة
+# واحدة لكل لغة. الإرسال يمر عبر طابور الرسائل بأولوية منخفضة، فيأخذ كل ما يسمح به حد
+# تيليجرام العام دون أن يؤخر ردود المستخدمين، ويتوقف مع RetryAfter كبقية الرسائل.
+# بعد كل دفعة تُحفظ نقطة الاستئناف والعدادات في جدول broadcasts، فإعادة التشغيل تكمل من حيث توقف.
+# النقطة لا تتجاوز أول رسالة لم تُرسل: عند الإيقاف تُلغى رسائل البث المنتظرة في الطابور،
+# وما بعد أول رسالة ملغاة يُرسل بعد الاستئناف.
+
+DEFAULT_LANGUAGE = SUPPORTED_LANGUAGES[0]
+
+# المستخدم حظر البوت أو حذف حسابه: يُعلَّم في جدول users ولا يُرسل إليه مرة أخرى
+BLOCKED_ERRORS = (BotBlocked, BotKicked, CantInitiateConversation, ChatNotFound, UserDeactivated)
+
+
+def render_texts(texts):
+    """نص البث لكل لغة مدعومة (اللغة الافتراضية لمن لا نص بلغته)."""
+    fallback = texts[DEFAULT_LANGUAGE]
+    return {lang: _("broadcast_message", lang, text=texts.get(lang) or fallback) for lang in SUPPORTED_LANGUAGES}
+
+
+class _Run:
+    """حالة بث جارٍ في هذه العملية."""
+    __slots__ = ("id", "total", "sent", "failed", "blocked", "done_at_start", "started", "stopping", "report", "queued")
+
+    def __init__(self, row):
+        self.id = row.id
+        self.total = row.total
+        self.sent = row.sent
+        self.failed = row.failed
+        self.blocked = row.blocked
+        self.done_at_start = row.sent + row.failed + row.blocked
+        self.started = time.monotonic()
+        self.stopping = None    # None، أو "cancelled" لإلغاء البث، أو "" للتوقف المؤقت عند الإيقاف
+        self.report = None      # رسالة التقدم لدى المدير
+        self.queued = set()     # futures رسائل البث التي لم تنته بعد
+
+    @property
+    def done(self):
+        return self.sent + self.failed + self.blocked
+
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return (self.done - self.done_at_start) / elapsed if elapsed > 0 else 0.0
+
+    def summary(self, status="running"):
+        line = (
+            f"📣 Broadcast #{self.id} ({status}): {self.done}/{self.total}\n"
+            f"✅ sent: {self.sent} · 🚫 blocked: {self.blocked} · ❌ failed: {self.failed}"
+        )
+        rate = self.rate
+        if status == "running" and rate > 0:
+            eta = max(self.total - self.done, 0) / rate
+            line += f"\n⚡️ {rate:.1f} msg/s · ETA {int(eta // 60)}m {int(eta % 60)}s"
+        return line
+
+
+class Broadcaster:
+    def __init__(self, bot, outbox, admin_id, chunk_size=100, max_chunks_in_flight=2, progress_interval=10):
+        self.bot = bot
+        self.outbox = outbox
+        self.admin_id = admin_id
+        self.chunk_size = chunk_size
+        self.max_chunks_in_flight = max_chunks_in_flight
+        self.progress_interval = progress_interval
+        self._runs = {}     # broadcast_id -> _Run
+        self._tasks = {}    # broadcast_id -> Task
+
+    def __len__(self):
+        return len(self._runs)
+
+    def totals(self):
+        """عدادات البثوث الجارية: {result: count}"""
+        runs = self._runs.values()
+        return {
+            "sent": sum(r.sent for r in runs),
+            "blocked": sum(r.blocked for r in runs),
+            "failed": sum(r.failed for r in runs),
+        }
+
+    # ---------- الواجهة العامة ----------
+    async def start(self, texts):
+        """إنشاء بث جديد ({lang: text}) وبدء إرساله في الخلفية. يُرجع معرفه."""
+        row = await run_db(repo.create_broadcast, json.dumps(texts, ensure_ascii=False))
+        self._launch(row)
+        return row.id
+
+    async def resume(self):
+        """استئناف البثوث التي كانت جارية قبل إعادة التشغيل."""
+        for row in await run_db(repo.running_broadcasts):
+            log.info("Resuming broadcast #%s after users.id %s", row.id, row.cursor)
+            self._launch(row)
+
+    def status(self):
+        return [run.summary() for run in self._runs.values()]
+
+    async def cancel(self, broadcast_id):
+        run = self._runs.get(broadcast_id)
+        if run is not None:
+            run.stopping = "cancelled"
+            self.outbox.cancel_queued(run.queued)
+            await self._tasks[broadcast_id]
+            return True
+        # بث لم يُستأنف في هذه العملية
+        row = await run_db(repo.set_broadcast_status, broadcast_id, "cancelled")
+        return row is not None
+
+    async def stop(self, timeout=10):
+        """
+        إيقاف إضافة دفعات جديدة وإلغاء رسائل البث المنتظرة في الطابور، ثم حفظ تقدم ما أُرسل فعلًا
+        (قبل إيقاف الطابور).
+        """
+        for run in self._runs.values():
+            if run.stopping is None:
+                run.stopping = ""
+            self.outbox.cancel_queued(run.queued)
+        if self._tasks:
+            await asyncio.wait(list(self._tasks.values()), timeout=timeout)
+
+    # ---------- الإرسال ----------
+    def _launch(self, row):
+        if row.id in self._tasks:
+            return
+        self._runs[row.id] = _Run(row)
+        # سياق نظيف: البث يعيش بعد انتهاء تحديث /broadcast ولا يرث جلسته
+        task = create_background_task(self._run(row))
+        self._tasks[row.id] = task
+        task.add_done_callback(lambda _t, broadcast_id=row.id: self._forget(broadcast_id))
+
+    def _forget(self, broadcast_id):
+        self._tasks.pop(broadcast_id, None)
+        self._runs.pop(broadcast_id, None)
+
+    async def _run(self, row):
+        run = self._runs[row.id]
+        rendered = render_texts(json.loads(row.texts))
+        last_report = time.monotonic()
+        in_flight = deque()
+        status = None
+        cursor = row.cursor
+        stalled = False     # دفعة سابقة لم تكتمل: الدفعات التالية لا تحرك النقطة
+        try:
+            # الدفعة التالية تُقرأ بينما الدفعات السابقة تُرسل، فلا يفرغ الطابور بين الدفعات
+            recipients = await run_db(repo.broadcast_recipients, row.cursor, self.chunk_size)
+            while in_flight or (recipients and run.stopping is None):
+                if recipients and run.stopping is None and len(in_flight) < self.max_chunks_in_flight:
+                    in_flight.append(asyncio.ensure_future(self._send_chunk(run, recipients, rendered)))
+                    recipients = await run_db(repo.broadcast_recipients, recipients[-1].id, self.chunk_size)
+                    continue
+
+                chunk_cursor, sent, failed, blocked_ids, complete = await in_flight.popleft()
+                if stalled:
+                    continue
+                stalled = not complete
+                if chunk_cursor is not None:
+                    cursor = chunk_cursor
+                run.sent += sent
+                run.failed += failed
+                run.blocked += len(blocked_ids)
+                if not in_flight and not recipients and run.stopping is None:
+                    status = "done"
+                await run_db(repo.save_broadcast_progress, run.id, cursor, sent, failed, blocked_ids, status)
+
+                if time.monotonic() - last_report >= self.progress_interval:
+                    last_report = time.monotonic()
+                    await self._report(run)
+
+            if status is None and run.stopping != "":
+                # ألغاه المدير، أو لم يكن هناك أي مستخدم لإرسال البث إليه
+                status = run.stopping or "done"
+                await run_db(repo.set_broadcast_status, run.id, status)
+            if status is not None:
+                await self._report(run, status)
+                log.info("Broadcast #%s %s: %s sent, %s blocked, %s failed",
+                         run.id, status, run.sent, run.blocked, run.failed)
+        except Exception:
+            log.exception("Broadcast #%s stopped", run.id)
+            for future in in_flight:
+                future.cancel()
+
+    async def _send_chunk(self, run, recipients, rendered):
+        """
+        إرسال دفعة وانتظار نتائجها. تُرجع (آخر users.id أُرسل إليه بالترتيب، المرسل، الفاشل،
+        معرفات من حظروا البوت، اكتملت الدفعة؟). الرسائل من أول رسالة ملغاة لا تُحتسب.
+        """
+        futures = [
+            self.outbox.send_message(user_id, rendered.get(language) or rendered[DEFAULT_LANGUAGE], priority=PRIORITY_BULK)
+            for _id, user_id, language in recipients
+        ]
+        run.queued.update(futures)
+        try:
+            results = await asyncio.gather(*futures, return_exceptions=True)
+        finally:
+            run.queued.difference_update(futures)
+        cursor, sent, failed, blocked_ids = None, 0, 0, []
+        for (recipient_id, user_id, _language), result in zip(recipients, results):
+            if isinstance(result, asyncio.CancelledError):
+                return cursor, sent, failed, blocked_ids, False
+            if isinstance(result, BLOCKED_ERRORS):
+                blocked_ids.append(user_id)
+            elif isinstance(result, BaseException):
+                failed += 1
+            else:
+                sent += 1
+            cursor = recipient_id
+        return cursor, sent, failed, blocked_ids, True
+
+    async def _report(self, run, status="running"):
+        """رسالة تقدم واحدة لدى المدير تُعدل كل progress_interval ثانية."""
+        text = run.summary(status)
+        try:
+            if run.report is None:
+                run.report = await self.outbox.send_message(self.admin_id, text, priority=PRIORITY_ADMIN)
+            else:
+                await self.bot.edit_message_text(text, self.admin_id, run.report.message_id)
+        except Exception as e:
+            log.warning("Broadcast #%s progress report failed: %s", run.id, e)
@@ -0,0 +1,105 @@
+import base64
+import binascii
+import inspect
+import logging
+import struct
+from dataclasses import dataclass
+
+log = logging.getLogger(__name__)
+
+# --- بيانات أزرار inline (callback_data) ---
+# تيليجرام يحد callback_data بـ 64 بايت. كل زر يُكتب "<prefix>:<payload>"، وزر الشراء
+# يحمل معرف الخيار ورقم مراجعة الكتالوج محزومين ثنائيًا (base64url) بدل الاسم والسعر كنصوص:
+# السعر يُقرأ من الكتالوج في الخادم ولا يُوثق بما يرسله العميل.
+
+MAX_CALLBACK_DATA = 64
+
+
+class CallbackDataError(ValueError):
+    """بيانات زر تالفة أو لا تطابق الصيغة المتوقعة."""
+
+
+def pack(prefix, fmt, *values):
+    payload = base64.urlsafe_b64encode(struct.pack(fmt, *values)).rstrip(b"=").decode("ascii")
+    data = f"{prefix}:{payload}"
+    if len(data.encode("utf-8")) > MAX_CALLBACK_DATA:
+        raise CallbackDataError(f"callback data too long: {data!r}")
+    return data
+
+
+def unpack(fmt, payload):
+    try:
+        raw = base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+        return struct.unpack(fmt, raw)
+    except (binascii.Error, struct.error) as e:
+        raise CallbackDataError(str(e)) from e
+
+
+# --- زر الشراء: (آخر 16 بت من مراجعة الكتالوج، معرف ProductOption) = 6 بايت ---
+BUY_FORMAT = ">HI"
+
+
+def encode_buy(option_id, revision):
+    return pack("buy", BUY_FORMAT, revision & 0xFFFF, option_id)
+
+
+def decode_buy(payload):
+    """تُرجع (revision16, option_id)."""
+    return unpack(BUY_FORMAT, payload)
+
+
+def same_revision(revision16, revision):
+    """هل صُنع الزر من نفس نسخة الكتالوج المحملة الآن؟"""
+    return revision is not None and revision16 == revision & 0xFFFF
+
+
+# --- جدول التوجيه ---
+@dataclass(frozen=True)
+class _Route:
+    handler: object
+    parse: object
+    admin_only: bool
+    wants_state: bool
+
+
+class CallbackRouter:
+    """
+    توجيه كل أزرار inline عبر فلتر واحد: بحث في قاموس بالبادئة
+    بدل تجربة سلسلة فلاتر startswith واحدًا تلو الآخر.
+    """
+
+    def __init__(self, admin_id):
+        self.admin_id = admin_id
+        self._routes = {}
+
+    def add(self, prefix, handler, parse=int, admin_only=False):
+        """parse تحول الجزء بعد ":" إلى وسائط المعالج (قيمة واحدة أو tuple)."""
+        wants_state = "state" in inspect.signature(handler).parameters
+        self._routes[prefix] = _Route(handler, parse, admin_only, wants_state)
+
+    def __contains__(self, prefix):
+        return prefix in self._routes
+
+    def match(self, callback):
+        """الفلتر: يعيد المعالج ووسائطه، أو False إذا لم تطابق أي بادئة."""
+        prefix, _sep, payload = (callback.data or "").partition(":")
+        route = self._routes.get(prefix)
+        if route is None:
+            return False
+        if route.admin_only and callback.from_user.id != self.admin_id:
+            return False
+        try:
+            args = route.parse(payload)
+        except ValueError:  # يشمل CallbackDataError
+            log.warning("Malformed callback data %r", callback.data)
+            return False
+        if not isinstance(args, tuple):
+            args = (args,)
+        return {"routed_handler": route.handler, "callback_route": (route, args)}
+
+    @staticmethod
+    async def dispatch(callback, callback_route, state):
+        route, args = callback_route
+        if route.wants_state:
+            return await route.handler(callback, *args, state=state)
+        return await route.handler(callback, *args)
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from sqlalchemy.orm import selectinload
+
+from database import run_db, CatalogVersion, Product
+
+log = logging.getLogger(__name__)
+
+# --- ذاكرة تخزين مؤقت للكتالوج ---
+# يُحمَّل الكتالوج (المنتجات وخياراتها) مرة واحدة في الذاكرة ويُخدم منها كل بحث
+# عن اسم منتج أو خيار دون الرجوع إلى قاعدة البيانات.
+# أي تعديل على الكتالوج يجب أن يستدعي bump_revision حتى تعيد نسخ البوت التحميل.
+
+
+@dataclass(frozen=True)
+class CachedOption:
+    id: int
+    option: str
+    price: float
+    product_name: str
+
+
+@dataclass(frozen=True)
+class CachedProduct:
+    id: int
+    name: str
+    options: tuple
+
+
+class Catalog:
+    """نسخة في الذاكرة من جدولي products و product_options."""
+
+    def __init__(self):
+        self.revision = None
+        self._by_name = MappingProxyType({})
+        self._options = MappingProxyType({})
+        self._names = ()
+
+    @property
+    def loaded(self):
+        return self.revision is not None
+
+    def get_product(self, name):
+        """البحث عن منتج بالاسم في O(1). تُرجع None إذا لم يكن موجودًا."""
+        return self._by_name.get(name)
+
+    def get_option(self, option_id):
+        """البحث عن خيار بالمعرف في O(1). تُرجع None إذا لم يكن موجودًا."""
+        return self._options.get(option_id)
+
+    def product_names(self):
+        """أسماء المنتجات بترتيب إضافتها."""
+        return self._names
+
+    def load(self, session):
+        """تحميل الكتالوج كاملًا من قاعدة البيانات (متزامنة، تُستدعى عبر run_db)."""
+        revision = read_revision(session)
+        products = session.query(Product).options(selectinload(Product.options)).order_by(Product.id).all()
+
+        by_name = {}
+        options = {}
+        for product in products:
+            cached_options = tuple(
+                CachedOption(id=o.id, option=o.option, price=o.price, product_name=product.name)
+                for o in sorted(product.options, key=lambda o: o.id)
+            )
+            by_name[product.name] = CachedProduct(id=product.id, name=product.name, options=cached_options)
+            for option in cached_options:
+                options[option.id] = option
+
+        # الاستبدال يتم مرة واحدة حتى لا يرى أي معالج كتالوجًا نصف محمّل
+        self._by_name = MappingProxyType(by_name)
+        self._options = MappingProxyType(options)
+        self._names = tuple(by_name)
+        self.revision = revision
+        log.info("Catalog loaded: %d products, %d options (revision %s)", len(by_name), len(options), revision)
+
+    def invalidate(self):
+        """إجبار إعادة التحميل عند الفحص القادم."""
+        self.revision = None
+
+    async def refresh(self):
+        await run_db(self.load)
+
+    async def refresh_if_changed(self):
+        """إعادة التحميل فقط إذا تغير رقم المراجعة في قاعدة البيانات."""
+        revision = await run_db(read_revision)
+        if revision != self.revision:
+            await self.refresh()
+
+    async def watch(self, interval=30):
+        """مهمة خلفية تتحقق دوريًا من تغير الكتالوج (مثلًا بعد تشغيل seed.py)."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh_if_changed()
+            except Exception:
+                log.exception("Catalog refresh failed")
+
+
+def read_revision(session):
+    row = session.get(CatalogVersion, 1)
+    return row.revision if row else 0
+
+
+def bump_revision(session):
+    """زيادة رقم مراجعة الكتالوج داخل المعاملة الحالية (بدون commit)."""
+    row = session.get(CatalogVersion, 1)
+    if row is None:
+        row = CatalogVersion(id=1, revision=0)
+        session.add(row)
+    row.revision = (row.revision or 0) + 1
+    return row.revision
+
+
+catalog = Catalog()
@@ -1,8 +1,74 @@
-import os
-
-TOKEN = os.getenv("BOT_TOKEN")
-ADMIN_ID = int(os.getenv("ADMIN_ID"))
-BINANCE_ID = os.getenv("BINANCE_ID")
-
-
-
+import os
+import secrets
+
+TOKEN = os.getenv("BOT_TOKEN")
+ADMIN_ID = int(os.getenv("ADMIN_ID"))
+BINANCE_ID = os.getenv("BINANCE_ID")
+# عنوان خادم Bot API (اختياري)، مثال: http://localhost:8081
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+# كل كم ثانية يتحقق البوت من تغير الكتالوج في قاعدة البيانات
+CATALOG_REFRESH_INTERVAL = int(os.getenv("CATALOG_REFRESH_INTERVAL", "30"))
+
+# ذاكرة المستخدمين المؤقتة
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "600"))
+USERNAME_FLUSH_INTERVAL = int(os.getenv("USERNAME_FLUSH_INTERVAL", "10"))
+
+# --- وضع التشغيل ---
+# webhook: تيليجرام يرسل التحديثات إلى WEBHOOK_HOST + WEBHOOK_PATH
+# polling: الوضع الاحتياطي (getUpdates)
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST")  # مثال: https://my-bot.up.railway.app
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# بدون WEBHOOK_HOST وبدون WEBHOOK_SECRET لا يُتحقق من الرمز (للتجربة المحلية فقط)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or (secrets.token_urlsafe(32) if WEBHOOK_HOST else None)
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "100"))
+RUN_MODE = os.getenv("RUN_MODE", "webhook" if WEBHOOK_HOST else "polling")
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "5000"))
+# /metrics (و/workers في supervisor.py) على خادم داخلي منفصل، لا على منفذ webhook العام
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# --- وضع العمليات المتعددة (supervisor.py) ---
+# WORKERS: عدد العمال الذي يشغله المشرف. WORKER_INDEX/WORKER_COUNT يضبطهما المشرف لكل عامل.
+WORKERS = int(os.getenv("WORKERS", str(os.cpu_count() or 1)))
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "1"))
+WORKER_DRAIN_TIMEOUT = float(os.getenv("WORKER_DRAIN_TIMEOUT", "25"))
+WORKER_STATS_INTERVAL = float(os.getenv("WORKER_STATS_INTERVAL", "5"))
+
+# حدود الإرسال (رسالة/ثانية): حد عام للبوت، وحد للبث (رسائل PRIORITY_BULK) ضمنه، وحد لكل محادثة.
+# الفرق بين الحدين يبقى لردود المستخدمين وإشعارات المدير أثناء البث.
+# الحدود تخص البوت كله: حصة البث كلها للعامل المسؤول عن المدير (هو وحده من يبث، انظر workers.shard_of)،
+# والباقي يُقسم على العمال. محادثة المدير تستقبل من كل العمال فيُقسم حدها عليهم كذلك.
+_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))
+_BULK_RATE = min(float(os.getenv("OUTBOX_BULK_RATE", "20")), _GLOBAL_RATE)
+IS_ADMIN_WORKER = abs(ADMIN_ID) % WORKER_COUNT == WORKER_INDEX
+OUTBOX_BULK_RATE = _BULK_RATE if IS_ADMIN_WORKER else 0
+OUTBOX_GLOBAL_RATE = max(_GLOBAL_RATE - _BULK_RATE, 1) / WORKER_COUNT + OUTBOX_BULK_RATE
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+OUTBOX_CHAT_BURST = int(os.getenv("OUTBOX_CHAT_BURST", "3"))
+OUTBOX_ADMIN_CHAT_RATE = OUTBOX_CHAT_RATE / WORKER_COUNT
+OUTBOX_ADMIN_CHAT_BURST = max(OUTBOX_CHAT_BURST // WORKER_COUNT, 1)
+
+# الضغطات المكررة على زر شراء نفس الخيار خلال هذه المدة (ثوانٍ) لا تُعالج مرة أخرى
+BUY_DEDUP_WINDOW = float(os.getenv("BUY_DEDUP_WINDOW", "10"))
+
+# عدد العناصر في كل صفحة من صفحات المدير (الطلبات والتذاكر)
+ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", "10"))
+
+# حفظ حالات المحادثة (FSM): كل كم ثانية تُحفظ التغييرات، ومتى تنتهي الحالة المهملة
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "1"))
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", str(24 * 3600)))
+
+# ملخص تأكيدات الدفع: كل كم ثانية تُجمع ضغطات "لقد دفعت" في رسالة واحدة للمدير (0 = رسالة لكل طلب)
+PAYMENT_DIGEST_INTERVAL = float(os.getenv("PAYMENT_DIGEST_INTERVAL", "0"))
+
+# البث لكل المستخدمين: عدد المستخدمين في كل دفعة (نقطة الاستئناف تُحفظ بعد كل دفعة)
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", "100"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "10"))
+
+# أرشفة التذاكر: رسائل التذاكر المغلقة منذ أكثر من هذا العدد من الأيام تُضغط (0 = بدون أرشفة)
+TICKET_ARCHIVE_DAYS = int(os.getenv("TICKET_ARCHIVE_DAYS", "30"))
+TICKET_ARCHIVE_INTERVAL = float(os.getenv("TICKET_ARCHIVE_INTERVAL", "3600"))
@@ -0,0 +1,65 @@
+from collections import defaultdict
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import Order, StatCounter, Ticket
+
+# --- عدادات إجمالية ---
+# سطر الملخص أعلى صفحات المدير (الطلبات لكل حالة، والتذاكر المفتوحة والمغلقة) يُقرأ من جدول stat_counters
+# بمفاتيحه مباشرة، بدل GROUP BY على الجداول كاملة مع كل صفحة وكل ضغطة تنقل.
+# كل تغيير يزيد العداد أو ينقصه بـ upsert ذري في نفس معاملته، فلا تتسابق عليه العمليات المتعددة.
+
+TICKETS_OPEN = "tickets:open"
+TICKETS_CLOSED = "tickets:closed"
+
+
+def order_key(status):
+    return f"orders:{status}"
+
+
+def upsert_increment(session, table, index_elements, columns):
+    """INSERT ... ON CONFLICT DO UPDATE (SQLite و Postgres) يزيد الأعمدة columns بدل الكتابة فوقها."""
+    dialect = sqlite if session.get_bind().dialect.name == "sqlite" else postgresql
+    stmt = dialect.insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={name: table.c[name] + stmt.excluded[name] for name in columns},
+    )
+
+
+def bump(session, deltas):
+    """deltas: {key: (count, total)}. يُضاف إلى المعاملة الحالية (بدون commit)."""
+    rows = [{"key": key, "count": count, "total": total} for key, (count, total) in deltas.items() if count or total]
+    if rows:
+        session.execute(upsert_increment(session, StatCounter.__table__, ["key"], ("count", "total")), rows)
+
+
+def select_counters(keys):
+    table = StatCounter.__table__
+    return select(table.c.key, table.c.count, table.c.total).where(table.c.key.in_(keys))
+
+
+def read(session, keys):
+    """{key: (count, total)} للمفاتيح المطلوبة (المفتاح الذي لم يُحدَّث بعد يُرجع (0, 0))."""
+    values = {row.key: (row.count, row.total) for row in session.execute(select_counters(keys))}
+    return {key: values.get(key, (0, 0)) for key in keys}
+
+
+def rebuild(conn):
+    """إعادة حساب العدادات من orders و tickets (في migrations.py عند إنشاء الجدول أو تعديل الطلبات مباشرة)."""
+    orders, tickets = Order.__table__, Ticket.__table__
+    totals = defaultdict(lambda: [0, 0.0])
+    status = func.coalesce(orders.c.status, "pending")
+    for name, count, total in conn.execute(
+        select(status, func.count(), func.coalesce(func.sum(orders.c.price), 0.0)).group_by(status)
+    ):
+        totals[order_key(name)] = [count, total]
+    for is_open, count in conn.execute(select(tickets.c.is_open, func.count()).group_by(tickets.c.is_open)):
+        totals[TICKETS_OPEN if is_open else TICKETS_CLOSED][0] += count
+
+    conn.execute(delete(StatCounter.__table__))
+    if totals:
+        conn.execute(insert(StatCounter.__table__), [
+            {"key": key, "count": count, "total": total} for key, (count, total) in totals.items()
+        ])
@@ -1,5 +1,10 @@
 import os
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, Boolean, DateTime
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from sqlalchemy import create_engine, event, Column, Integer, String, Float, ForeignKey, Boolean, Date, DateTime, Index, LargeBinary
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
 from sqlalchemy.sql import func
 
@@ -10,13 +15,57 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     DATABASE_URL = "sqlite:///./store.db"
 
-engine = create_engine(DATABASE_URL)
+# --- إعدادات المحرك وتجمع الاتصالات (قابلة للتعديل من متغيرات البيئة) ---
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+DB_WORKERS = int(os.getenv("DB_WORKERS", str(DB_POOL_SIZE)))
+SQLITE_WAL = os.getenv("SQLITE_WAL", "1") == "1"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+if IS_SQLITE:
+    # الاتصال الواحد قد يُستخدم من أكثر من خيط في مجمع الخيوط (لكن ليس في نفس الوقت)
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """تفعيل وضع WAL ومهلة الانتظار عند القفل لكل اتصال SQLite جديد."""
+        cursor = dbapi_connection.cursor()
+        if SQLITE_WAL:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+else:
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
 
 # --- إعداد جلسة قاعدة البيانات ---
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: الكائنات تبقى قابلة للقراءة في حلقة الأحداث بعد الحفظ دون استعلامات إضافية
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 Base = declarative_base()
 
 # --- تعريف الجداول (النماذج) ---
+# تغيير المخطط هنا يحتاج خطوة مقابلة في migrations.py لترقية قواعد البيانات الموجودة.
+
+def _utcnow():
+    return datetime.now(timezone.utc)
+
 
 class User(Base):
     """جدول لتخزين معلومات المستخدمين ولغتهم المفضلة."""
@@ -25,6 +74,8 @@ class User(Base):
     user_id = Column(Integer, unique=True, nullable=False, index=True)
     username = Column(String)
     language = Column(String, default=None)  # 'en' or 'ar'
+    # متى فشل الإرسال لأن المستخدم حظر البوت أو حذف حسابه؛ هؤلاء يُستثنون من البث
+    blocked_at = Column(DateTime(timezone=True), nullable=True)
 
 class Product(Base):
     """جدول لتخزين المنتجات الرئيسية."""
@@ -39,9 +90,15 @@ class ProductOption(Base):
     id = Column(Integer, primary_key=True, index=True)
     option = Column(String)
     price = Column(Float)
-    product_id = Column(Integer, ForeignKey("products.id"))
+    product_id = Column(Integer, ForeignKey("products.id"), index=True)
     product = relationship("Product", back_populates="options")
 
+class CatalogVersion(Base):
+    """جدول بصف واحد يحمل رقم مراجعة الكتالوج، يُزاد عند كل تعديل على المنتجات."""
+    __tablename__ = "catalog_version"
+    id = Column(Integer, primary_key=True)
+    revision = Column(Integer, nullable=False, default=0)
+
 class Order(Base):
     """جدول لتخزين طلبات المستخدمين."""
     __tablename__ = "orders"
@@ -50,8 +107,67 @@ class Order(Base):
     username = Column(String)
     product_name = Column(String)
     option = Column(String)
+    # بدون ForeignKey: الطلب القديم يبقى كما هو حتى لو حُذف الخيار من الكتالوج لاحقًا
+    option_id = Column(Integer, nullable=True)
     price = Column(Float)
-    status = Column(String, default="pending")  # (pending, paid, delivered, rejected)
+    status = Column(String, default="pending")  # (pending, paid, delivered, rejected, cancelled)
+    # القيمة تُحسب في بايثون لأن SQLite لا يقبل CURRENT_TIMESTAMP افتراضيًا لعمود يُضاف بـ ALTER TABLE
+    created_at = Column(DateTime(timezone=True), default=_utcnow, index=True)
+    # وقت أول ضغطة على "لقد دفعت"؛ الضغطات التالية على نفس الطلب لا تُرسل للمدير مرة أخرى
+    paid_claimed_at = Column(DateTime(timezone=True), nullable=True)
+    # متى وصل إشعار تلك الضغطة للمدير؛ الضغطات التي لم يصل إشعارها تُعاد عند الإقلاع (انظر payment_digest.py)
+    payment_notified_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_orders_status_id", "status", "id"),        # قوائم المشرف حسب الحالة مع ترقيم keyset
+        Index("ix_orders_user_status", "user_id", "status"),  # طلبات مستخدم معين حسب الحالة
+        # طلب معلق واحد فقط لكل مستخدم وخيار: الضغط المزدوج أو إعادة إرسال التحديث لا ينشئ طلبًا ثانيًا
+        Index(
+            "uq_orders_pending_user_option", "user_id", "option_id", unique=True,
+            sqlite_where=status == "pending", postgresql_where=status == "pending",
+        ),
+    )
+
+class OrderRollup(Base):
+    """إحصاءات الطلبات اليومية: العدد ومجموع الأسعار لكل يوم إنشاء ومنتج وخيار وحالة حالية (انظر analytics.py)."""
+    __tablename__ = "order_rollups"
+    day = Column(Date, primary_key=True)
+    product_name = Column(String, primary_key=True)
+    option = Column(String, primary_key=True)
+    status = Column(String, primary_key=True)
+    orders = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0)
+
+class StatCounter(Base):
+    """عدادات إجمالية (عدد ومجموع لكل مفتاح) تُحدَّث في نفس معاملة كل تغيير (انظر counters.py)."""
+    __tablename__ = "stat_counters"
+    key = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    total = Column(Float, nullable=False, default=0)
+
+class FSMRecord(Base):
+    """جدول لحفظ حالات المحادثة (FSM) حتى لا تضيع عند إعادة التشغيل."""
+    __tablename__ = "fsm_states"
+    chat = Column(String, primary_key=True)
+    user = Column(String, primary_key=True)
+    state = Column(String, nullable=True)
+    data = Column(String, nullable=False, default="{}")    # JSON
+    bucket = Column(String, nullable=False, default="{}")  # JSON
+    updated_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+class Broadcast(Base):
+    """رسالة بث لكل المستخدمين مع نقطة الاستئناف (آخر users.id أُرسل إليه) وعداداتها."""
+    __tablename__ = "broadcasts"
+    id = Column(Integer, primary_key=True, index=True)
+    texts = Column(String, nullable=False)  # JSON: {lang: text}
+    status = Column(String, nullable=False, default="running", index=True)  # (running, done, cancelled)
+    cursor = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=False, default=0)
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    blocked = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), default=_utcnow)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
 
 class Ticket(Base):
     """جدول لتخزين تذاكر الدعم الفني."""
@@ -59,22 +175,128 @@ class Ticket(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
     is_open = Column(Boolean, default=True)
+    created_at = Column(DateTime(timezone=True), default=_utcnow, index=True)
+    closed_at = Column(DateTime(timezone=True), nullable=True, index=True)
+    # بعد الأرشفة تُحذف رسائل التذكرة من ticket_messages وتبقى مضغوطة في ticket_archives
+    archived_at = Column(DateTime(timezone=True), nullable=True)
     messages = relationship("TicketMessage", back_populates="ticket", cascade="all, delete-orphan")
     user = relationship("User")
 
+    __table_args__ = (
+        Index("ix_tickets_user_open", "user_id", "is_open"),  # التذكرة المفتوحة للمستخدم (مع كل رسالة دعم)
+        Index("ix_tickets_open_id", "is_open", "id"),        # قائمة التذاكر المفتوحة مع ترقيم keyset
+    )
+
 class TicketMessage(Base):
     """جدول لتخزين الرسائل داخل كل تذكرة."""
     __tablename__ = "ticket_messages"
     id = Column(Integer, primary_key=True, index=True)
-    ticket_id = Column(Integer, ForeignKey("tickets.id"), nullable=False)
+    ticket_id = Column(Integer, ForeignKey("tickets.id"), nullable=False, index=True)
     sender = Column(String)  # 'user' or 'admin'
     text = Column(String, nullable=False)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
     ticket = relationship("Ticket", back_populates="messages")
 
+    __table_args__ = (
+        Index("ix_ticket_messages_ticket_id_id", "ticket_id", "id"),  # صفحات سجل المحادثة بترتيب keyset
+    )
+
+class TicketArchive(Base):
+    """سجل محادثة تذكرة مغلقة قديمة: رسائلها كسطور JSON مضغوطة بـ zlib (انظر tickets.py)."""
+    __tablename__ = "ticket_archives"
+    ticket_id = Column(Integer, ForeignKey("tickets.id"), primary_key=True)
+    message_count = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    archived_at = Column(DateTime(timezone=True), default=_utcnow, nullable=False)
+
+
+# --- تشغيل الاستعلامات خارج حلقة الأحداث ---
+# كل استعلامات SQLAlchemy متزامنة، لذلك ننفذها في مجمع خيوط محدود الحجم
+# حتى لا تتوقف حلقة aiogram أثناء انتظار قاعدة البيانات.
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+
+# الجلسة الخاصة بالتحديث الحالي مع المهمة التي فتحتها: (Task, Session)، تُفتح وتُغلق بواسطة DBSessionMiddleware.
+# المهام التي تُنشأ أثناء التحديث ترث هذا المتغير، لكنها قد تعمل بالتوازي مع المعالج أو بعد إغلاق الجلسة،
+# والجلسة لا تحتمل الاستخدام من خيطين في نفس الوقت؛ لذلك لا تستخدمها إلا المهمة التي فتحتها.
+current_session = contextvars.ContextVar("current_session", default=None)
+
+
+def _run_in_new_session(fn, args, kwargs):
+    """تنفيذ دالة داخل جلسة مؤقتة تُغلق بعد الانتهاء."""
+    session = SessionLocal()
+    try:
+        return fn(session, *args, **kwargs)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def _run_in_session(session, fn, args, kwargs):
+    """
+    تنفيذ دالة على جلسة التحديث الحالي مع التراجع عند الخطأ.
+    ننهي المعاملة بعد كل استدعاء حتى يعود الاتصال إلى المجمع فورًا، وإلا فإن التحديثات
+    المتزامنة تحجز كل الاتصالات وتنتظر خيوط قاعدة البيانات المشغولة بانتظار اتصال.
+    """
+    try:
+        result = fn(session, *args, **kwargs)
+        session.commit()
+        return result
+    except Exception:
+        session.rollback()
+        raise
+
+
+def _update_session():
+    """جلسة التحديث الحالي إذا كنا في المهمة التي فتحتها، وإلا None."""
+    entry = current_session.get()
+    if entry is None:
+        return None
+    owner, session = entry
+    return session if owner is asyncio.current_task() else None
+
+
+async def run_db(fn, *args, **kwargs):
+    """
+    تنفيذ fn(session, *args, **kwargs) في مجمع خيوط قاعدة البيانات.
+    تُستخدم جلسة التحديث الحالي إن وُجدت، وإلا تُفتح جلسة جديدة لهذا الاستدعاء فقط.
+    """
+    loop = asyncio.get_running_loop()
+    session = _update_session()
+    if session is None:
+        call = functools.partial(_run_in_new_session, fn, args, kwargs)
+    else:
+        call = functools.partial(_run_in_session, session, fn, args, kwargs)
+    # ننسخ السياق حتى تصل متغيرات السياق (contextvars) إلى خيط قاعدة البيانات
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(db_executor, ctx.run, call)
+
+
+def open_update_session():
+    """فتح جلسة جديدة وربطها بالتحديث الحالي (والمهمة التي تعالجه). تُرجع رمزًا لاستعادته لاحقًا."""
+    return current_session.set((asyncio.current_task(), SessionLocal()))
+
+
+async def close_update_session(token):
+    """إغلاق جلسة التحديث الحالي (في مجمع الخيوط) وفك ربطها."""
+    entry = current_session.get()
+    current_session.reset(token)
+    if entry is not None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(db_executor, entry[1].close)
+
+
+def create_background_task(coro):
+    """
+    مهمة خلفية لا ترث سياق التحديث الحالي (جلسته ومقاييسه) حتى لو أُنشئت أثناء معالجته،
+    فتفتح run_db داخلها جلسة مؤقتة لكل استدعاء.
+    """
+    return asyncio.create_task(coro, context=contextvars.Context())
+
 
 def create_db():
-    """دالة لإنشاء جميع الجداول المحددة أعلاه في قاعدة البيانات."""
+    """دالة لإنشاء جميع الجداول المحددة أعلاه في قاعدة البيانات (لا تُرقّي الجداول الموجودة، انظر migrations.py)."""
     Base.metadata.create_all(bind=engine)
 
 
@@ -0,0 +1,216 @@
+import asyncio
+import copy
+import json
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from aiogram.dispatcher.storage import BaseStorage
+from sqlalchemy import delete, insert, tuple_
+
+from database import create_background_task, run_db, FSMRecord
+from idempotency import singleflight
+
+log = logging.getLogger(__name__)
+
+# --- تخزين حالات FSM في قاعدة البيانات ---
+# القراءة والكتابة تتم على نسخة في الذاكرة (بسرعة MemoryStorage تقريبًا)،
+# والتغييرات تُحفظ في جدول fsm_states على دفعات كل flush_interval ثانية.
+# الحالات التي لم تتغير منذ ttl ثانية تُحذف من الذاكرة ومن قاعدة البيانات.
+# ملاحظة: بيانات الحالة (data/bucket) يجب أن تكون قابلة للتحويل إلى JSON.
+
+class _Record:
+    __slots__ = ("state", "data", "bucket", "accessed", "changed")
+
+    def __init__(self, state=None, data=None, bucket=None, changed=None):
+        self.state = state
+        self.data = data or {}
+        self.bucket = bucket or {}
+        self.accessed = time.monotonic()
+        self.changed = changed if changed is not None else time.time()
+
+    @property
+    def empty(self):
+        return self.state is None and not self.data and not self.bucket
+
+
+class SQLAlchemyStorage(BaseStorage):
+    def __init__(self, flush_interval=1.0, ttl=24 * 3600, hot_ttl=600, sweep_interval=300):
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.hot_ttl = hot_ttl
+        self.sweep_interval = sweep_interval
+        self._records = {}     # (chat, user) -> _Record
+        self._dirty = set()
+        self._loading = {}     # (chat, user) -> Future
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._last_sweep = time.monotonic()
+
+    # ---------- الذاكرة ----------
+    async def _get(self, chat, user):
+        chat, user = map(str, self.check_address(chat=chat, user=user))
+        key = (chat, user)
+        record = self._records.get(key)
+        if record is not None and self._expired(record):
+            del self._records[key]
+            record = None
+        if record is None:
+            record = await self._load(key)
+        record.accessed = time.monotonic()
+        return key, record
+
+    def _expired(self, record):
+        return time.time() - record.changed > self.ttl
+
+    async def _load(self, key):
+        async def fetch():
+            row = await run_db(_load_record, key)
+            record = self._records.get(key)
+            # إذا كُتب السجل أثناء التحميل فالنسخة في الذاكرة أحدث
+            if record is None:
+                record = self._records[key] = row if row is not None and not self._expired(row) else _Record()
+            return record
+
+        record, _loaded = await singleflight(self._loading, key, fetch)
+        return record
+
+    def _touch(self, key, record):
+        record.changed = time.time()
+        self._dirty.add(key)
+        self._ensure_flusher()
+
+    # ---------- واجهة BaseStorage ----------
+    async def get_state(self, *, chat=None, user=None, default=None):
+        _, record = await self._get(chat, user)
+        return record.state if record.state is not None else self.resolve_state(default)
+
+    async def get_data(self, *, chat=None, user=None, default=None):
+        _, record = await self._get(chat, user)
+        return copy.deepcopy(record.data) if record.data else (default or {})
+
+    async def set_state(self, *, chat=None, user=None, state=None):
+        key, record = await self._get(chat, user)
+        record.state = self.resolve_state(state)
+        self._touch(key, record)
+
+    async def set_data(self, *, chat=None, user=None, data=None):
+        key, record = await self._get(chat, user)
+        record.data = copy.deepcopy(data) or {}
+        self._touch(key, record)
+
+    async def update_data(self, *, chat=None, user=None, data=None, **kwargs):
+        key, record = await self._get(chat, user)
+        record.data.update(data or {}, **kwargs)
+        self._touch(key, record)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat=None, user=None, default=None):
+        _, record = await self._get(chat, user)
+        return copy.deepcopy(record.bucket) if record.bucket else (default or {})
+
+    async def set_bucket(self, *, chat=None, user=None, bucket=None):
+        key, record = await self._get(chat, user)
+        record.bucket = copy.deepcopy(bucket) or {}
+        self._touch(key, record)
+
+    async def update_bucket(self, *, chat=None, user=None, bucket=None, **kwargs):
+        key, record = await self._get(chat, user)
+        record.bucket.update(bucket or {}, **kwargs)
+        self._touch(key, record)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def wait_closed(self):
+        pass
+
+    # ---------- الحفظ على دفعات ----------
+    def _ensure_flusher(self):
+        # أول كتابة تحدث داخل تحديث؛ المهمة تعيش طوال عمر العملية فلا ترث سياقه
+        if self._task is None:
+            self._task = create_background_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - self._last_sweep > self.sweep_interval:
+                    await self.sweep()
+            except Exception:
+                log.exception("FSM storage flush failed")
+
+    async def flush(self):
+        """حفظ كل السجلات المتغيرة في معاملة واحدة."""
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+            keys, self._dirty = self._dirty, set()
+            upserts, deletes = [], []
+            for key in keys:
+                record = self._records.get(key)
+                if record is None or record.empty:
+                    deletes.append(key)
+                else:
+                    upserts.append({
+                        "chat": key[0],
+                        "user": key[1],
+                        "state": record.state,
+                        "data": json.dumps(record.data),
+                        "bucket": json.dumps(record.bucket),
+                        "updated_at": datetime.fromtimestamp(record.changed, timezone.utc),
+                    })
+            try:
+                await run_db(_write_records, upserts, deletes)
+            except Exception:
+                # نعيد المفاتيح حتى تُحفظ في المحاولة القادمة
+                self._dirty |= keys
+                raise
+            return len(keys)
+
+    async def sweep(self):
+        """حذف الحالات المنتهية من قاعدة البيانات، والسجلات الخاملة من الذاكرة."""
+        self._last_sweep = time.monotonic()
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+        await run_db(_delete_expired, cutoff)
+
+        idle_before = time.monotonic() - self.hot_ttl
+        for key, record in list(self._records.items()):
+            if key in self._dirty:
+                continue
+            if record.accessed < idle_before or self._expired(record):
+                del self._records[key]
+
+
+# --- دوال قاعدة البيانات (تعمل داخل مجمع الخيوط) ---
+def _load_record(session, key):
+    row = session.get(FSMRecord, key)
+    if row is None:
+        return None
+    changed = row.updated_at
+    if changed.tzinfo is None:
+        # SQLite لا يحفظ المنطقة الزمنية
+        changed = changed.replace(tzinfo=timezone.utc)
+    return _Record(row.state, json.loads(row.data), json.loads(row.bucket), changed=changed.timestamp())
+
+
+def _write_records(session, upserts, deletes, chunk_size=500):
+    # حذف ثم إدخال بدل upsert خاص بكل قاعدة بيانات
+    keys = deletes + [(row["chat"], row["user"]) for row in upserts]
+    table = FSMRecord.__table__
+    for i in range(0, len(keys), chunk_size):
+        session.execute(delete(table).where(tuple_(table.c.chat, table.c.user).in_(keys[i:i + chunk_size])))
+    if upserts:
+        session.execute(insert(table), upserts)
+    session.commit()
+
+
+def _delete_expired(session, cutoff):
+    session.execute(delete(FSMRecord.__table__).where(FSMRecord.updated_at < cutoff))
+    session.commit()
@@ -0,0 +1,134 @@
+import os
+import json
+import string
+from types import MappingProxyType
+
+# --- إعداد نظام الترجمة ---
+# النصوص تُحلَّل مرة واحدة عند التحميل إلى قوالب جاهزة، ويُتحقق من تطابق المفاتيح
+# والمتغيرات بين كل اللغات قبل أن يبدأ البوت.
+SUPPORTED_LANGUAGES = ('en', 'ar')
+LANGUAGES = {}
+
+# يزداد مع كل تحميل للترجمات؛ ذاكرة لوحات المفاتيح تستخدمه لمعرفة متى تعيد البناء
+translations_version = 0
+
+# مفاتيح أزرار القائمة الرئيسية التي يجب التعرف عليها من نص الرسالة
+MENU_BUTTON_KEYS = (
+    "select_language_button",
+    "report_problem",
+    "view_orders",
+    "view_tickets",
+    "manage_products",
+)
+
+# فهرس عكسي ثابت: نص الزر -> (المفتاح، اللغة). يُبنى مرة واحدة في load_translations
+BUTTON_INDEX = MappingProxyType({})
+
+_formatter = string.Formatter()
+_CONVERSIONS = {None: None, "s": str, "r": repr, "a": ascii}
+
+
+class TranslationError(ValueError):
+    """ملفات الترجمة غير متطابقة أو تحتوي صيغة غير مدعومة."""
+
+
+class Template:
+    """نص ترجمة محلَّل مسبقًا إلى أجزاء ثابتة ومتغيرات بالاسم."""
+    __slots__ = ("text", "parts", "fields")
+
+    def __init__(self, text):
+        parts = []
+        for literal, field, spec, conversion in _formatter.parse(text):
+            if field is not None:
+                if not field.isidentifier():
+                    raise ValueError(f"placeholders must be named, got {{{field}}}")
+                if spec and "{" in spec:
+                    raise ValueError(f"nested format spec in {{{field}}} is not supported")
+                if conversion not in _CONVERSIONS:
+                    raise ValueError(f"unknown conversion !{conversion} in {{{field}}}")
+            parts.append((literal, field, spec or "", _CONVERSIONS.get(conversion)))
+        self.parts = tuple(parts)
+        self.fields = frozenset(field for _lit, field, _spec, _conv in parts if field is not None)
+        # نص بلا متغيرات يُعاد كما هو ({{ و }} بعد فكها)
+        self.text = "".join(literal for literal, *_rest in parts)
+
+    def render(self, kwargs):
+        if not self.fields:
+            return self.text
+        out = []
+        for literal, field, spec, conversion in self.parts:
+            out.append(literal)
+            if field is not None:
+                value = kwargs[field]
+                if conversion is not None:
+                    value = conversion(value)
+                out.append(format(value, spec))
+        return "".join(out)
+
+
+def _compile(lang_code, texts, problems):
+    templates = {}
+    for key, text in texts.items():
+        try:
+            templates[key] = Template(text)
+        except ValueError as e:
+            problems.append(f"{lang_code}.json: '{key}': {e}")
+    return templates
+
+
+def validate_translations(languages):
+    """مقارنة اللغات ببعضها: مفاتيح ناقصة ومتغيرات مختلفة لنفس المفتاح."""
+    problems = []
+    all_keys = set(MENU_BUTTON_KEYS).union(*(t.keys() for t in languages.values()))
+    for lang_code, templates in languages.items():
+        missing = sorted(all_keys - templates.keys())
+        if missing:
+            problems.append(f"{lang_code}.json: missing keys: {', '.join(missing)}")
+    for key in sorted(all_keys):
+        fields = {lang: t[key].fields for lang, t in languages.items() if key in t}
+        if len(set(fields.values())) > 1:
+            detail = "; ".join(f"{lang}: {{{', '.join(sorted(f))}}}" for lang, f in fields.items())
+            problems.append(f"'{key}': placeholders differ ({detail})")
+    return problems
+
+
+def load_translations():
+    """تحميل ملفات الترجمة JSON عند بدء التشغيل، تحليلها والتحقق منها، وبناء الفهرس العكسي للأزرار."""
+    global BUTTON_INDEX, LANGUAGES, translations_version
+    problems = []
+    languages = {}
+    for lang_code in SUPPORTED_LANGUAGES:
+        # تأكد من وجود الملفات قبل محاولة فتحها
+        if os.path.exists(f'{lang_code}.json'):
+            with open(f'{lang_code}.json', 'r', encoding='utf-8') as f:
+                languages[lang_code] = _compile(lang_code, json.load(f), problems)
+        else:
+            problems.append(f"Translation file '{lang_code}.json' not found.")
+            languages[lang_code] = {}
+
+    problems.extend(validate_translations(languages))
+    if problems:
+        raise TranslationError("Invalid translations:\n  " + "\n  ".join(problems))
+
+    index = {}
+    for lang_code, templates in languages.items():
+        for key in MENU_BUTTON_KEYS:
+            index.setdefault(templates[key].text, (key, lang_code))
+    LANGUAGES = languages
+    BUTTON_INDEX = MappingProxyType(index)
+    translations_version += 1
+
+
+def lookup_button(text):
+    """إرجاع (المفتاح، اللغة) إذا كان النص زرًا من أزرار القائمة، وإلا None."""
+    return BUTTON_INDEX.get(text)
+
+
+def _(text_key, lang='en', **kwargs):
+    """دالة لجلب النص المترجم. إذا لم تكن اللغة موجودة، تستخدم الإنجليزية كافتراضي."""
+    # Fallback to English if language is not set or not found
+    lang = lang if lang in LANGUAGES else 'en'
+    template = LANGUAGES.get(lang, {}).get(text_key)
+    if template is None:
+        return f"<{text_key}>"
+    return template.render(kwargs)
@@ -0,0 +1,87 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+# --- منع تكرار العمليات (مثل الضغط المزدوج على زر الشراء) ---
+# أول طلب لمفتاح ما ينفذ العملية، والطلبات التالية بنفس المفتاح خلال ttl ثانية
+# (أو أثناء تنفيذ الأول) تحصل على نفس النتيجة دون تنفيذها مرة أخرى.
+# الذاكرة محدودة الحجم؛ الضمان الدائم يأتي من قاعدة البيانات (انظر uq_orders_pending_user_option).
+
+
+async def singleflight(running, key, factory):
+    """
+    تنفيذ factory() مرة واحدة في الوقت نفسه لكل مفتاح: من يطلب المفتاح أثناء التنفيذ ينتظر نفس النتيجة
+    (أو نفس الخطأ). running: {key: Future} للتنفيذات الجارية، يملكه المستدعي. تُرجع (النتيجة، نُفذت هنا؟).
+    إذا أُلغيت المهمة المنفذة يُلغى الـ Future، فينفذ أحد المنتظرين من جديد بدل أن يبقوا معلقين.
+    """
+    pending = running.get(key)
+    while pending is not None:
+        try:
+            return await asyncio.shield(pending), False
+        except asyncio.CancelledError:
+            # أُلغيت المهمة المنفذة لا مهمتنا
+            if not pending.cancelled():
+                raise
+        pending = running.get(key)
+
+    future = asyncio.get_running_loop().create_future()
+    running[key] = future
+    try:
+        result = await factory()
+        future.set_result(result)
+        return result, True
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # منع تحذير "exception was never retrieved" إذا لم ينتظره أحد
+        raise
+    finally:
+        del running[key]
+        if not future.done():
+            future.cancel()
+
+
+class IdempotencyCache:
+    def __init__(self, ttl=10, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()   # key -> (expires_at, result)
+        self._running = {}              # key -> Future
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        return entry
+
+    def _store(self, key, result):
+        self._entries[key] = (time.monotonic() + self.ttl, result)
+        self._entries.move_to_end(key)
+        # الإدخالات تُضاف بترتيب انتهائها تقريبًا، فالأقدم في البداية
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def run(self, key, factory):
+        """
+        تنفيذ factory() مرة واحدة لكل مفتاح خلال ttl. تُرجع (النتيجة، نُفذت الآن؟).
+        إذا فشل التنفيذ لا يُحفظ شيء، فالمحاولة التالية تنفذ من جديد.
+        """
+        entry = self._get(key)
+        if entry is not None:
+            return entry[1], False
+
+        async def execute():
+            result = await factory()
+            self._store(key, result)
+            return result
+
+        return await singleflight(self._running, key, execute)
+
+    def discard(self, key):
+        self._entries.pop(key, None)
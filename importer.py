@@ -0,0 +1,265 @@
+"""
+استيراد الكتالوج من ملف JSON أو CSV ومزامنته مع جدولي products و product_options.
+
+    python importer.py products.json              # تطبيق الفروقات
+    python importer.py catalog.csv --dry-run      # عرض الفروقات دون تعديل قاعدة البيانات
+
+JSON: {"<product>": {"<option>": <price>, ...}, ...}
+CSV:  ترويسة product,option,price ثم صف لكل خيار.
+
+الملف يُقرأ تدريجيًا (منتجًا منتجًا أو صفًا صفًا)، ثم يُقارن بالجداول الحالية وتُطبق الإضافات
+والتعديلات والحذف كاستعلامات مجمّعة في معاملة واحدة مع زيادة رقم مراجعة الكتالوج.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+
+from sqlalchemy import bindparam, delete, insert, select, update
+
+from database import SessionLocal, Product, ProductOption
+from catalog import bump_revision
+
+# SQLite يحد عدد المتغيرات في الاستعلام الواحد، فالحذف بـ IN يتم على دفعات
+DELETE_CHUNK = 500
+
+
+# ================= القراءة =================
+
+def _iter_json_members(fp, chunk_size=1 << 16):
+    """يقرأ كائن JSON علويًا {key: value, ...} عنصرًا عنصرًا دون تحميل الملف كاملًا في الذاكرة."""
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def more():
+        nonlocal buf, pos, eof
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            eof = True
+            return False
+        buf, pos = buf[pos:] + chunk, 0
+        return True
+
+    def skip_ws():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buf) or not more():
+                return
+
+    def expect(chars):
+        nonlocal pos
+        skip_ws()
+        if pos >= len(buf) or buf[pos] not in chars:
+            raise ValueError(f"invalid catalog JSON: expected one of {chars!r}")
+        pos += 1
+        return buf[pos - 1]
+
+    def value():
+        nonlocal pos
+        skip_ws()
+        while True:
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # القيمة مقطوعة عند نهاية الجزء المقروء
+                if eof or not more():
+                    raise
+                continue
+            # رقم في نهاية الجزء المقروء قد يكون له بقية
+            if end == len(buf) and not eof and more():
+                continue
+            pos = end
+            return obj
+
+    expect("{")
+    skip_ws()
+    if buf[pos:pos + 1] == "}":
+        return
+    while True:
+        key = value()
+        if not isinstance(key, str):
+            raise ValueError("invalid catalog JSON: product names must be strings")
+        expect(":")
+        yield key, value()
+        if expect(",}") == "}":
+            return
+
+
+def read_json(fp):
+    """(product, option, price) لكل خيار في ملف JSON."""
+    for product_name, options in _iter_json_members(fp):
+        if not isinstance(options, dict):
+            raise ValueError(f"product {product_name!r}: expected an object of option -> price")
+        for option, price in options.items():
+            yield product_name, option, float(price)
+
+
+def read_csv(fp):
+    """(product, option, price) لكل صف في ملف CSV."""
+    reader = csv.DictReader(fp)
+    missing = {"product", "option", "price"} - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError(f"CSV is missing columns: {', '.join(sorted(missing))}")
+    for row in reader:
+        yield row["product"].strip(), row["option"].strip(), float(row["price"])
+
+
+def read_catalog(path):
+    """الكتالوج المطلوب: {product: {option: price}} بترتيب ظهوره في الملف (آخر تكرار هو المعتمد)."""
+    reader = read_csv if path.lower().endswith(".csv") else read_json
+    catalog = {}
+    with open(path, "r", encoding="utf-8-sig", newline="") as fp:
+        for product_name, option, price in reader(fp):
+            catalog.setdefault(product_name, {})[option] = price
+    return catalog
+
+
+# ================= المقارنة =================
+
+@dataclass
+class CatalogDiff:
+    new_products: list = field(default_factory=list)      # [name]
+    removed_products: list = field(default_factory=list)  # [(id, name)]
+    new_options: list = field(default_factory=list)       # [(product_name, option, price)]
+    changed_options: list = field(default_factory=list)   # [(id, product_name, option, old_price, new_price)]
+    removed_options: list = field(default_factory=list)   # [(id, product_name, option)]
+
+    def __bool__(self):
+        return any((self.new_products, self.removed_products, self.new_options,
+                    self.changed_options, self.removed_options))
+
+    def summary(self):
+        return (
+            f"products: +{len(self.new_products)} -{len(self.removed_products)} | "
+            f"options: +{len(self.new_options)} ~{len(self.changed_options)} -{len(self.removed_options)}"
+        )
+
+    def report(self, limit=20):
+        """ملخص الفروقات مع أول limit تغيير من كل نوع."""
+        lines = [self.summary()]
+        sections = (
+            ("+ product", self.new_products, lambda name: name),
+            ("- product", self.removed_products, lambda p: p[1]),
+            ("+ option ", self.new_options, lambda o: f"{o[0]} / {o[1]}: {o[2]:g}"),
+            ("~ option ", self.changed_options, lambda o: f"{o[1]} / {o[2]}: {o[3]:g} -> {o[4]:g}"),
+            ("- option ", self.removed_options, lambda o: f"{o[1]} / {o[2]}"),
+        )
+        for label, items, fmt in sections:
+            for item in items[:limit]:
+                lines.append(f"  {label} {fmt(item)}")
+            if len(items) > limit:
+                lines.append(f"  {label} ... and {len(items) - limit} more")
+        return "\n".join(lines)
+
+
+def diff_catalog(session, desired):
+    """مقارنة الكتالوج المطلوب بالجداول الحالية (استعلامان فقط مهما كان حجم الكتالوج)."""
+    diff = CatalogDiff()
+    products = {row.id: row.name for row in session.execute(select(Product.id, Product.name))}
+    existing = {}  # (product_name, option) -> (id, price)
+    for row in session.execute(
+        select(ProductOption.id, ProductOption.product_id, ProductOption.option, ProductOption.price)
+        .order_by(ProductOption.id)
+    ):
+        product_name = products.get(row.product_id)
+        key = (product_name, row.option)
+        if product_name is None or key in existing:
+            # خيار يتيم أو مكرر: يُحذف حتى يطابق الجدول الملف
+            diff.removed_options.append((row.id, product_name, row.option))
+            continue
+        existing[key] = (row.id, row.price)
+
+    existing_names = set(products.values())
+    diff.new_products = [name for name in desired if name not in existing_names]
+    diff.removed_products = [(pid, name) for pid, name in products.items() if name not in desired]
+
+    for product_name, options in desired.items():
+        for option, price in options.items():
+            current = existing.pop((product_name, option), None)
+            if current is None:
+                diff.new_options.append((product_name, option, price))
+            elif current[1] != price:
+                diff.changed_options.append((current[0], product_name, option, current[1], price))
+    # ما تبقى لم يعد موجودًا في الملف (ومنه خيارات المنتجات المحذوفة)
+    diff.removed_options.extend((oid, name, option) for (name, option), (oid, _price) in existing.items())
+    return diff
+
+
+# ================= التطبيق =================
+
+def _delete_ids(session, table, ids):
+    for start in range(0, len(ids), DELETE_CHUNK):
+        session.execute(delete(table).where(table.c.id.in_(ids[start:start + DELETE_CHUNK])))
+
+
+def apply_diff(session, diff):
+    """تطبيق الفروقات باستعلامات مجمّعة داخل المعاملة الحالية (بدون commit)."""
+    products = Product.__table__
+    options = ProductOption.__table__
+
+    _delete_ids(session, options, [o[0] for o in diff.removed_options])
+    _delete_ids(session, products, [p[0] for p in diff.removed_products])
+
+    if diff.new_products:
+        session.execute(insert(products), [{"name": name} for name in diff.new_products])
+
+    if diff.new_options:
+        product_ids = {row.name: row.id for row in session.execute(select(products.c.id, products.c.name))}
+        session.execute(insert(options), [
+            {"product_id": product_ids[name], "option": option, "price": price}
+            for name, option, price in diff.new_options
+        ])
+
+    if diff.changed_options:
+        stmt = update(options).where(options.c.id == bindparam("oid")).values(price=bindparam("new_price"))
+        session.execute(stmt, [{"oid": o[0], "new_price": o[4]} for o in diff.changed_options])
+
+
+def import_catalog(path, dry_run=False):
+    """قراءة الملف ومزامنة الجداول معه في معاملة واحدة. تُرجع (الفروقات، رقم المراجعة أو None)."""
+    desired = read_catalog(path)
+    session = SessionLocal()
+    try:
+        diff = diff_catalog(session, desired)
+        if dry_run or not diff:
+            session.rollback()
+            return diff, None
+        apply_diff(session, diff)
+        # إعلام نسخ البوت العاملة بتغير الكتالوج حتى تعيد تحميله
+        revision = bump_revision(session)
+        session.commit()
+        return diff, revision
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+# هذا الجزء يسمح بتشغيل الملف مباشرة
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "products.json"))
+    parser.add_argument("--dry-run", action="store_true", help="print the changes without applying them")
+    parser.add_argument("--limit", type=int, default=20, help="changes listed per kind in the report")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    try:
+        diff, revision = import_catalog(args.path, dry_run=args.dry_run)
+    except (OSError, ValueError) as e:
+        print(f"Import failed: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(diff.report(args.limit))
+    elapsed = time.perf_counter() - started
+    if args.dry_run:
+        print(f"Dry run: nothing was written ({elapsed:.2f}s).")
+    elif revision is None:
+        print(f"Catalog is already up to date ({elapsed:.2f}s).")
+    else:
+        print(f"Import complete in {elapsed:.2f}s. Catalog revision: {revision}")
@@ -0,0 +1,79 @@
+from aiogram import types
+from aiogram.utils.payload import prepare_arg
+
+import i18n
+from i18n import _
+from catalog import catalog
+from callbacks import encode_buy
+
+# --- لوحات مفاتيح جاهزة ---
+# لوحات القائمة الرئيسية وخيارات المنتجات لا تتغير إلا بتغير الكتالوج أو الترجمات،
+# فتُبنى مرة واحدة وتُحفظ كنص JSON جاهز للإرسال (aiogram يرسل النص كما هو).
+# كل المفاتيح تُمسح معًا عند تغير رقم مراجعة الكتالوج أو نسخة الترجمات.
+
+ROLE_ADMIN = "admin"
+ROLE_CUSTOMER = "customer"
+
+
+class RenderCache:
+    """نسخ JSON من لوحات المفاتيح، مفتاحها (النوع، اللغة، الدور...) ضمن جيل (مراجعة الكتالوج، الترجمات)."""
+
+    def __init__(self):
+        self._generation = None
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, build):
+        generation = (catalog.revision, i18n.translations_version)
+        if generation != self._generation:
+            self._entries = {}
+            self._generation = generation
+        markup = self._entries.get(key)
+        if markup is None:
+            markup = self._entries[key] = prepare_arg(build())
+        return markup
+
+
+render_cache = RenderCache()
+
+
+def language_picker():
+    def build():
+        keyboard = types.InlineKeyboardMarkup(row_width=2)
+        keyboard.add(
+            types.InlineKeyboardButton("English 🇬🇧", callback_data="setlang:en"),
+            types.InlineKeyboardButton("العربية 🇸🇦", callback_data="setlang:ar")
+        )
+        return keyboard
+    return render_cache.get(("language_picker",), build)
+
+
+def main_menu(lang, role):
+    """القائمة الرئيسية: أزرار الإدارة للمدير، وأسماء المنتجات للعملاء."""
+    def build():
+        keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
+        if role == ROLE_ADMIN:
+            keyboard.add(_("view_orders", lang), _("view_tickets", lang))
+            keyboard.add(_("manage_products", lang))
+        else:
+            for product_name in catalog.product_names():
+                keyboard.add(product_name)
+            keyboard.add(_("report_problem", lang))
+        keyboard.add(_("select_language_button", lang))
+        return keyboard
+    return render_cache.get(("main_menu", lang, role), build)
+
+
+def product_options(product):
+    """أزرار شراء خيارات منتج (لا تعتمد على اللغة)."""
+    def build():
+        keyboard = types.InlineKeyboardMarkup()
+        for option in product.options:
+            keyboard.add(types.InlineKeyboardButton(
+                text=f"{option.option} - ${option.price}",
+                callback_data=encode_buy(option.id, catalog.revision)
+            ))
+        return keyboard
+    return render_cache.get(("product_options", product.id), build)
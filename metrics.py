@@ -0,0 +1,246 @@
+import bisect
+import contextvars
+import threading
+import time
+
+from aiogram import Bot
+from sqlalchemy import event
+
+# --- مقاييس الأداء بصيغة Prometheus ---
+# مقاييس خفيفة بدون مكتبات خارجية: عدادات ومدرجات تكرارية (histograms) بتسميات،
+# تُعرض كنص على المسار /metrics بجانب فحص الصحة.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()  # بعض المقاييس تُحدَّث من خيوط قاعدة البيانات
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [counts per bucket..., +Inf count, sum]
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * (len(self.buckets) + 2)
+            state[index] += 1
+            state[-1] += value
+
+    def render(self):
+        lines = self.header()
+        for labels, state in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), state[:-1]):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, labels, ('le', bound))} {cumulative}"
+                )
+            base = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{base} {state[-1]}")
+            lines.append(f"{self.name}_count{base} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """دالة تُستدعى قبل كل عرض لتحديث المقاييس المحسوبة (مثل طول الطابور)."""
+        self._collectors.append(collector)
+
+    def render(self):
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def merge_expositions(sources):
+    """
+    دمج عدة نصوص /metrics في نص واحد (المشرف يعرض مقاييس عماله).
+    sources: [(label, text)] حيث label زوج (name, value) يُضاف لكل عينة، أو None.
+    عينات العائلة الواحدة من كل المصادر تُجمع تحت HELP و TYPE واحدين.
+    """
+    families = {}   # name -> [header lines, samples] بترتيب أول ظهور
+    for label, text in sources:
+        samples = None
+        for line in text.splitlines():
+            if not line:
+                continue
+            if line.startswith("# "):
+                parts = line.split(" ", 3)
+                family = families.get(parts[2])
+                if family is None:
+                    family = families[parts[2]] = [[], []]
+                if len(family[0]) < 2:
+                    family[0].append(line)
+                samples = family[1]
+                continue
+            if samples is None:
+                continue
+            if label is not None:
+                name, sep, rest = line.partition("{")
+                pair = _format_labels((label[0],), (label[1],))[1:-1]
+                if sep:
+                    line = f"{name}{{{pair},{rest}"
+                else:
+                    name, _, value = line.partition(" ")
+                    line = f"{name}{{{pair}}} {value}"
+            samples.append(line)
+    lines = []
+    for header, samples in families.values():
+        lines.extend(header)
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+handler_latency = registry.register(Histogram(
+    "bot_handler_latency_seconds", "Handler execution time.", ("handler",)))
+handler_errors = registry.register(Counter(
+    "bot_handler_errors_total", "Exceptions raised by handlers.", ("handler", "error")))
+handler_in_flight = registry.register(Gauge(
+    "bot_handler_in_flight", "Handlers currently running.", ("handler",)))
+filter_latency = registry.register(Histogram(
+    "bot_filter_latency_seconds", "Time spent evaluating filters before a handler is chosen.", ("event",)))
+update_latency = registry.register(Histogram(
+    "bot_update_latency_seconds", "Total processing time per update.", ("event",)))
+db_queries = registry.register(Counter(
+    "bot_db_queries_total", "SQL statements executed.", ()))
+db_query_latency = registry.register(Histogram(
+    "bot_db_query_latency_seconds", "SQL statement execution time.", ()))
+db_queries_per_update = registry.register(Histogram(
+    "bot_db_queries_per_update", "SQL statements executed while handling one update.", ("event",), COUNT_BUCKETS))
+db_time_per_update = registry.register(Histogram(
+    "bot_db_time_per_update_seconds", "Time spent in SQL while handling one update.", ("event",)))
+api_latency = registry.register(Histogram(
+    "bot_telegram_api_latency_seconds", "Outbound Bot API call time.", ("method",)))
+api_errors = registry.register(Counter(
+    "bot_telegram_api_errors_total", "Outbound Bot API calls that failed.", ("method", "error")))
+
+outbox_queued = registry.register(Gauge(
+    "bot_outbox_queued_messages", "Messages waiting in the outbound queue.", ()))
+outbox_messages = registry.register(Gauge(
+    "bot_outbox_messages", "Outbound queue totals since start.", ("result",)))
+broadcast_messages = registry.register(Gauge(
+    "bot_broadcast_messages", "Messages of running broadcasts, by result.", ("result",)))
+cache_entries = registry.register(Gauge(
+    "bot_cache_entries", "Entries held in in-memory caches.", ("cache",)))
+
+
+# --- استعلامات SQL لكل تحديث ---
+class UpdateMetrics:
+    __slots__ = ("queries", "query_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+
+
+# يُنسخ السياق إلى خيوط قاعدة البيانات في run_db، فيصل هذا المتغير إلى مستمعي SQLAlchemy
+current_update_metrics = contextvars.ContextVar("current_update_metrics", default=None)
+
+
+def instrument_engine(engine):
+    """عدّ الاستعلامات وقياس زمنها، وإسنادها إلى التحديث الحالي إن وُجد."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info.pop("query_started", time.perf_counter())
+        db_queries.inc()
+        db_query_latency.observe(elapsed)
+        update = current_update_metrics.get()
+        if update is not None:
+            update.queries += 1
+            update.query_time += elapsed
+
+
+# --- طلبات Bot API الصادرة ---
+class MeteredBot(Bot):
+    """Bot يقيس زمن كل طلب إلى Bot API، ويمرره أولًا على throttle(method) إن وُجد (انظر Outbox.throttle)."""
+
+    throttle = None
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        if self.throttle is not None:
+            await self.throttle(method)
+        started = time.perf_counter()
+        try:
+            return await super().request(method, data, files, **kwargs)
+        except Exception as e:
+            api_errors.inc(method, type(e).__name__)
+            raise
+        finally:
+            api_latency.observe(time.perf_counter() - started, method)
@@ -0,0 +1,101 @@
+import sys
+import time
+
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler, SkipHandler, CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from database import open_update_session, close_update_session
+import metrics
+
+
+class DBSessionMiddleware(BaseMiddleware):
+    """فتح جلسة قاعدة بيانات خاصة بكل تحديث وإغلاقها بعد انتهاء معالجته."""
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        data["_db_session_token"] = open_update_session()
+
+    async def on_post_process_update(self, update: types.Update, results, data: dict):
+        token = data.pop("_db_session_token", None)
+        if token is not None:
+            await close_update_session(token)
+
+
+def _event_type(update: types.Update):
+    for name in ("message", "callback_query", "edited_message", "inline_query", "my_chat_member"):
+        if getattr(update, name, None) is not None:
+            return name
+    return "other"
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    قياس زمن كل معالج وعدد أخطائه والمعالجات الجارية، وزمن الفلاتر،
+    وعدد استعلامات SQL لكل تحديث. التكلفة: بضع استدعاءات perf_counter لكل تحديث.
+    """
+
+    # ---------- مستوى التحديث ----------
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        data["_metrics_started"] = time.perf_counter()
+        data["_metrics_token"] = metrics.current_update_metrics.set(metrics.UpdateMetrics())
+
+    async def on_post_process_update(self, update: types.Update, results, data: dict):
+        event = _event_type(update)
+        metrics.update_latency.observe(time.perf_counter() - data.pop("_metrics_started"), event)
+        token = data.pop("_metrics_token")
+        update_metrics = metrics.current_update_metrics.get()
+        metrics.current_update_metrics.reset(token)
+        metrics.db_queries_per_update.observe(update_metrics.queries, event)
+        metrics.db_time_per_update.observe(update_metrics.query_time, event)
+
+    # ---------- مستوى المعالج ----------
+    def _pre(self, data):
+        data["_filters_started"] = time.perf_counter()
+
+    def _process(self, event, data):
+        now = time.perf_counter()
+        # SkipHandler يعني أن معالجًا آخر سيُجرب، فنغلق قياس السابق أولًا
+        self._finish_handler(data, now, None)
+        metrics.filter_latency.observe(now - data["_filters_started"], event)
+        # المعالجات الموجهة عبر جدول (أزرار القائمة و callback) تُقاس باسمها لا باسم الموجِّه
+        routed = data.get("routed_handler")
+        name = routed.__name__ if routed is not None else current_handler.get().__name__
+        data["_handler"] = (name, now)
+        metrics.handler_in_flight.inc(name)
+
+    def _post(self, event, data):
+        now = time.perf_counter()
+        error = sys.exc_info()[1]
+        if "_handler" not in data:
+            # لم يطابق أي معالج: كل الوقت ذهب في الفلاتر
+            metrics.filter_latency.observe(now - data["_filters_started"], event)
+        self._finish_handler(data, now, error)
+
+    @staticmethod
+    def _finish_handler(data, now, error):
+        handler = data.pop("_handler", None)
+        if handler is None:
+            return
+        name, started = handler
+        metrics.handler_in_flight.dec(name)
+        metrics.handler_latency.observe(now - started, name)
+        if error is not None and not isinstance(error, (SkipHandler, CancelHandler)):
+            metrics.handler_errors.inc(name, type(error).__name__)
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        self._pre(data)
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        self._process("message", data)
+
+    async def on_post_process_message(self, message: types.Message, results, data: dict):
+        self._post("message", data)
+
+    async def on_pre_process_callback_query(self, callback: types.CallbackQuery, data: dict):
+        self._pre(data)
+
+    async def on_process_callback_query(self, callback: types.CallbackQuery, data: dict):
+        self._process("callback_query", data)
+
+    async def on_post_process_callback_query(self, callback: types.CallbackQuery, results, data: dict):
+        self._post("callback_query", data)
@@ -0,0 +1,215 @@
+"""
+ترقية مخطط قاعدة البيانات في مكانه (store.db أو Postgres) دون فقدان البيانات.
+
+    python migrations.py                # إنشاء الجداول الناقصة وإضافة الأعمدة والفهارس الجديدة
+    python migrations.py --check-plans  # فشل إذا كان أحد الاستعلامات الساخنة يمسح جدولًا كاملًا
+
+كل الخطوات idempotent: تشغيلها مرة ثانية لا يغير شيئًا، لذلك تُشغَّل قبل كل إقلاع (انظر Procfile).
+"""
+import argparse
+import json
+import logging
+import re
+import sys
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import inspect, select, update
+
+from database import engine, Base, IS_SQLITE, User, Order, OrderRollup, StatCounter, Ticket, TicketMessage
+import analytics
+import counters
+
+log = logging.getLogger(__name__)
+
+# ================= الأعمدة الجديدة =================
+# الأعمدة الموجودة في النماذج والناقصة من الجدول تُضاف بـ ALTER TABLE،
+# ثم تُملأ الصفوف القديمة بالتعبير المحدد هنا (إن وُجد).
+BACKFILL = {
+    ("orders", "created_at"): "CURRENT_TIMESTAMP",
+    # الضغطات السابقة للعمود أُرسلت بالفعل
+    ("orders", "payment_notified_at"): "paid_claimed_at",
+    # أقدم رسالة في التذكرة أقرب تقدير لوقت فتحها
+    ("tickets", "created_at"): (
+        "COALESCE((SELECT MIN(ticket_messages.timestamp) FROM ticket_messages "
+        "WHERE ticket_messages.ticket_id = tickets.id), CURRENT_TIMESTAMP)"
+    ),
+    # التذاكر المغلقة قبل إضافة العمود: آخر رسالة فيها أقرب تقدير لوقت إغلاقها
+    ("tickets", "closed_at"): (
+        "CASE WHEN tickets.is_open THEN NULL ELSE COALESCE((SELECT MAX(ticket_messages.timestamp) "
+        "FROM ticket_messages WHERE ticket_messages.ticket_id = tickets.id), tickets.created_at) END"
+    ),
+}
+
+
+def _column_ddl(conn, column):
+    """تعريف العمود لجملة ADD COLUMN (النوع والقيمة الافتراضية الثابتة فقط)."""
+    preparer = conn.dialect.identifier_preparer
+    ddl = f"{preparer.quote(column.name)} {column.type.compile(dialect=conn.dialect)}"
+    if column.server_default is not None:
+        default = conn.dialect.ddl_compiler(conn.dialect, None).get_column_default_string(column)
+        ddl += f" DEFAULT {default}"
+        if not column.nullable:
+            ddl += " NOT NULL"
+    return ddl
+
+
+def _add_missing_columns(conn):
+    inspector = inspect(conn)
+    preparer = conn.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            name = preparer.quote(table.name)
+            conn.exec_driver_sql(f"ALTER TABLE {name} ADD COLUMN {_column_ddl(conn, column)}")
+            backfill = BACKFILL.get((table.name, column.name))
+            if backfill:
+                conn.exec_driver_sql(
+                    f"UPDATE {name} SET {preparer.quote(column.name)} = {backfill} "
+                    f"WHERE {preparer.quote(column.name)} IS NULL"
+                )
+            log.info("Added column %s.%s", table.name, column.name)
+
+
+def _cancel_duplicate_pending_orders(conn):
+    """
+    قبل إنشاء الفهرس الفريد uq_orders_pending_user_option: يبقى طلب معلق واحد لكل (مستخدم، خيار)،
+    المضغوط عليه "لقد دفعت" إن وُجد وإلا الأحدث، والبقية تُغلق بحالة cancelled (لا rejected، فالمدير
+    لم يرفضها) وتُسجل أرقامها ليراجعها المدير.
+    """
+    orders = Order.__table__
+    rows = conn.execute(
+        select(orders.c.id, orders.c.user_id, orders.c.option_id, orders.c.paid_claimed_at)
+        .where(orders.c.status == "pending", orders.c.option_id.is_not(None))
+        .order_by(orders.c.id)
+    ).all()
+    groups = {}
+    for row in rows:
+        groups.setdefault((row.user_id, row.option_id), []).append(row)
+    duplicates = []
+    for group in groups.values():
+        if len(group) > 1:
+            keep = max(group, key=lambda r: (r.paid_claimed_at is not None, r.id))
+            duplicates.extend(r.id for r in group if r.id != keep.id)
+    if duplicates:
+        conn.execute(update(orders).where(orders.c.id.in_(duplicates)).values(status="cancelled"))
+        log.warning("Cancelled %d duplicate pending orders: %s", len(duplicates), ", ".join(map(str, duplicates)))
+    return len(duplicates)
+
+
+def upgrade(bind=engine):
+    """جعل قاعدة البيانات مطابقة للنماذج في database.py."""
+    inspector = inspect(bind)
+    new_rollups = not inspector.has_table(OrderRollup.__tablename__)
+    new_counters = not inspector.has_table(StatCounter.__tablename__)
+    # الجداول الجديدة بالكامل (مع فهارسها)؛ الجداول الموجودة لا تُلمس هنا
+    Base.metadata.create_all(bind=bind)
+    with bind.begin() as conn:
+        _add_missing_columns(conn)
+        changed = _cancel_duplicate_pending_orders(conn)
+        if new_rollups or changed:
+            # الجدول يُحدَّث تدريجيًا بعد ذلك مع كل تغيير حالة
+            analytics.rebuild(conn)
+            log.info("Rebuilt order_rollups from orders")
+        if new_counters or changed:
+            counters.rebuild(conn)
+            log.info("Rebuilt stat_counters from orders and tickets")
+    # الفهارس على الجداول القديمة (بعد إضافة أعمدتها)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+
+# ================= فحص خطط الاستعلام =================
+
+def hot_queries():
+    """الاستعلامات التي تُنفذ مع كل رسالة أو صفحة مشرف، بنفس شكلها في repository.py."""
+    since = datetime.now(timezone.utc) - timedelta(days=1)
+    return {
+        "user by telegram id": select(User).filter_by(user_id=1),
+        "open ticket of user": select(Ticket).filter_by(user_id=1, is_open=True).limit(1),
+        "open tickets page": (
+            select(Ticket).filter_by(is_open=True).filter(Ticket.id < 1000).order_by(Ticket.id.desc()).limit(11)
+        ),
+        "ticket messages": select(TicketMessage).filter_by(ticket_id=1),
+        "ticket transcript page": (
+            select(TicketMessage).filter_by(ticket_id=1).filter(TicketMessage.id < 1000)
+            .order_by(TicketMessage.id.desc()).limit(11)
+        ),
+        "closed tickets to archive": (
+            select(Ticket.id).filter(Ticket.closed_at < since, Ticket.archived_at.is_(None)).limit(100)
+        ),
+        "orders page by status": (
+            select(Order).filter_by(status="paid").filter(Order.id < 1000).order_by(Order.id.desc()).limit(11)
+        ),
+        "user orders by status": select(Order).filter_by(user_id=1, status="pending"),
+        "unnotified payment claims": (
+            select(Order).filter(
+                Order.status == "pending", Order.paid_claimed_at.is_not(None), Order.payment_notified_at.is_(None)
+            ).order_by(Order.id)
+        ),
+        "orders since": select(Order).filter(Order.created_at >= since),
+        "sales rollups for a range": select(OrderRollup).filter(OrderRollup.day >= since.date()),
+        "admin order stats": counters.select_counters(
+            [counters.order_key(status) for status in ("pending", "paid", "delivered", "rejected", "cancelled")]
+        ),
+        "admin ticket stats": counters.select_counters([counters.TICKETS_OPEN, counters.TICKETS_CLOSED]),
+    }
+
+
+_SQLITE_FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+
+def _sqlite_full_scans(conn, sql):
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    # "SCAN orders" بدون "USING ... INDEX" يعني قراءة الجدول كله
+    return [m.group(1) for m in (_SQLITE_FULL_SCAN.match(row[-1]) for row in rows) if m]
+
+
+def _postgres_full_scans(conn, sql):
+    plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}").scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    scans, nodes = [], [plan[0]["Plan"]]
+    while nodes:
+        node = nodes.pop()
+        if node["Node Type"] == "Seq Scan":
+            scans.append(node["Relation Name"])
+        nodes.extend(node.get("Plans", ()))
+    return scans
+
+
+def check_plans(bind=engine):
+    """يعيد قائمة (اسم الاستعلام، الجداول الممسوحة بالكامل)؛ القائمة الفارغة تعني النجاح."""
+    failures = []
+    with bind.connect() as conn:
+        if not IS_SQLITE:
+            # الجداول الصغيرة تجعل Postgres يفضل المسح الكامل؛ نمنعه لنرى هل يوجد فهرس صالح أصلًا
+            conn.exec_driver_sql("SET enable_seqscan = off")
+        explain = _sqlite_full_scans if IS_SQLITE else _postgres_full_scans
+        for name, stmt in hot_queries().items():
+            sql = str(stmt.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+            scans = explain(conn, sql)
+            if scans:
+                failures.append((name, scans))
+        conn.rollback()
+    return failures
+
+
+# هذا الجزء يسمح بتشغيل الملف مباشرة (في Procfile قبل تشغيل البوت)
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--check-plans", action="store_true", help="upgrade, then fail on full table scans")
+    args = parser.parse_args()
+
+    upgrade()
+    print("Database schema is up to date.")
+    if args.check_plans:
+        failures = check_plans()
+        for name, tables in failures:
+            print(f"FULL SCAN in '{name}': {', '.join(tables)}")
+        if failures:
+            sys.exit(1)
+        print(f"All {len(hot_queries())} hot queries use an index.")
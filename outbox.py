@@ -0,0 +1,366 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+from collections import OrderedDict, deque
+
+from aiogram.utils.exceptions import NetworkError, RestartingTelegram, RetryAfter
+
+log = logging.getLogger(__name__)
+
+# --- طابور الرسائل الصادرة ---
+# المعالجات تضيف الرسالة إلى الطابور وتعود فورًا دون انتظار تيليجرام.
+# الإرسال يحترم حدود تيليجرام: حد عام لكل البوت وحد لكل محادثة (token buckets)،
+# وحد أقل للرسائل بالجملة (البث) يترك من الحد العام مساحة لردود المستخدمين،
+# مع احترام RetryAfter، وأولويات (ردود المستخدمين قبل إشعارات المدير)،
+# ودمج رسائل التذكرة الواحدة المتتالية في رسالة واحدة للمدير.
+# ردود المعالجات المباشرة (message.answer و edit_* و callback.answer) لا تمر بالطابور،
+# لكنها تحجز رمزها من نفس الحد العام عبر Outbox.throttle فيبقى مجموع الإرسال ضمن الحد.
+
+PRIORITY_USER = 0
+PRIORITY_ADMIN = 10
+PRIORITY_BULK = 20
+
+# أخطاء مؤقتة تستحق إعادة المحاولة
+TRANSIENT_ERRORS = (NetworkError, RestartingTelegram, asyncio.TimeoutError)
+
+# حد تيليجرام لطول الرسالة (بوحدات UTF-16)
+MAX_MESSAGE_LENGTH = 4096
+
+# طلبات Bot API التي تُحتسب من الحد العام: كل ما يرسل أو يعدل شيئًا في محادثة
+THROTTLED_PREFIXES = ("send", "edit", "copy", "forward", "answerCallbackQuery")
+
+# داخل _deliver: الرمز محجوز مسبقًا فلا يُحتسب الطلب مرة ثانية في throttle
+_delivering = contextvars.ContextVar("outbox_delivering", default=False)
+
+
+def utf16_len(text):
+    """طول النص كما يحسبه تيليجرام (وحدات UTF-16: الرموز التعبيرية وأمثالها بوحدتين)."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def truncate_text(text, limit=MAX_MESSAGE_LENGTH):
+    """قص النص إلى limit وحدة UTF-16 على الأكثر (مع "…")."""
+    if utf16_len(text) <= limit:
+        return text
+    # errors="ignore" يسقط نصف زوج بديل (surrogate) إن وقع القطع في منتصفه
+    return text.encode("utf-16-le")[:(limit - 1) * 2].decode("utf-16-le", errors="ignore") + "…"
+
+
+class TokenBucket:
+    """دلو رموز بسيط: rate رمز في الثانية، وسعة capacity."""
+
+    def __init__(self, rate, capacity, now=0.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now):
+        """كم ثانية حتى يتوفر رمز (0 إذا كان متوفرًا الآن)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Outgoing:
+    __slots__ = ("priority", "seq", "chat_id", "header", "lines", "kwargs", "coalesce_key", "future", "attempts")
+
+    def __init__(self, priority, seq, chat_id, header, text, kwargs, coalesce_key, future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.header = header
+        self.lines = [text]
+        self.kwargs = kwargs
+        self.coalesce_key = coalesce_key
+        self.future = future
+        self.attempts = 0
+
+    def _full_text(self, lines):
+        body = "\n".join(lines)
+        return f"{self.header}\n\n{body}" if self.header else body
+
+    def can_append(self, text):
+        """هل يتسع النص المدمج لسطر آخر دون تجاوز حد تيليجرام؟"""
+        return utf16_len(self._full_text(self.lines + [text])) <= MAX_MESSAGE_LENGTH
+
+    @property
+    def text(self):
+        # رسالة واحدة أطول من الحد (مع العنوان) تُقص بدل أن يرفضها تيليجرام
+        return truncate_text(self._full_text(self.lines))
+
+
+class Outbox:
+    def __init__(self, bot, global_rate=30, chat_rate=1.0, chat_burst=3, bulk_rate=None, chat_limits=None,
+                 max_in_flight=20, max_retries=5):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_limits = chat_limits or {}   # chat_id -> (rate, burst) لمحادثات حدها غير الافتراضي
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        # رسائل PRIORITY_BULK تستهلك رمزًا من هنا أيضًا (None = الحد العام وحده)
+        self._bulk = TokenBucket(bulk_rate, max(bulk_rate, 1)) if bulk_rate else None
+        self._buckets = OrderedDict()   # chat_id -> TokenBucket
+        self._queues = {}               # chat_id -> deque (ترتيب الرسائل داخل المحادثة محفوظ)
+        self._ready = []                # heap: (priority, seq, chat_id) لرأس كل محادثة جاهزة
+        self._sleeping = []             # heap: (wake_at, chat_id) لمحادثات تنتظر حدها
+        self._sleeping_chats = set()
+        self._busy = set()              # محادثات لديها رسالة قيد الإرسال
+        self._coalesce = {}             # coalesce_key -> _Outgoing لم تُرسل بعد
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._paused_until = 0.0
+        self._closing = False
+        self._task = None
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return sum(len(q) for q in self._queues.values())
+
+    # ---------- الواجهة العامة ----------
+    def send_message(self, chat_id, text, *, priority=PRIORITY_USER, coalesce_key=None, header=None, **kwargs):
+        """
+        إضافة رسالة إلى الطابور والعودة فورًا. تُرجع Future بنتيجة الإرسال لمن يريد انتظارها.
+        الرسائل التي تحمل نفس coalesce_key وما زالت في الطابور تُدمج تحت نفس header،
+        ما دام النص المدمج ضمن حد الطول؛ بعده تبدأ رسالة جديدة تُدمج فيها الرسائل التالية.
+        """
+        if coalesce_key is not None:
+            pending = self._coalesce.get(coalesce_key)
+            if pending is not None and pending.can_append(text):
+                pending.lines.append(text)
+                self.coalesced += 1
+                return pending.future
+
+        future = asyncio.get_running_loop().create_future()
+        item = _Outgoing(priority, next(self._seq), chat_id, header, text, kwargs, coalesce_key, future)
+        if coalesce_key is not None:
+            self._coalesce[coalesce_key] = item
+
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+        queue.append(item)
+        if len(queue) == 1:
+            self._schedule(chat_id)
+        self._wakeup.set()
+        return future
+
+    async def throttle(self, method):
+        """
+        يُستدعى قبل كل طلب Bot API مباشر (MeteredBot.throttle): الطلب يحجز رمزه من الحد العام فورًا،
+        قبل رسائل الطابور، ثم ينتظر دوره (وانتهاء أي RetryAfter) إذا كان الحد مستنفدًا.
+        """
+        if _delivering.get() or not method.startswith(THROTTLED_PREFIXES):
+            return
+        now = asyncio.get_running_loop().time()
+        wait = max(self._global.wait_time(now), self._paused_until - now)
+        self._global.consume(now)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def cancel_queued(self, futures):
+        """
+        إلغاء رسائل futures التي ما زالت تنتظر في الطابور (futures من send_message)؛
+        الرسائل قيد الإرسال تكمل. تُرجع عدد الرسائل الملغاة.
+        """
+        futures = set(futures)
+        if not futures:
+            return 0
+        cancelled = 0
+        for chat_id, queue in self._queues.items():
+            if not any(item.future in futures for item in queue):
+                continue
+            kept = deque()
+            for item in queue:
+                if item.future not in futures:
+                    kept.append(item)
+                    continue
+                item.future.cancel()
+                cancelled += 1
+                if item.coalesce_key is not None and self._coalesce.get(item.coalesce_key) is item:
+                    del self._coalesce[item.coalesce_key]
+            self._queues[chat_id] = kept
+        if cancelled:
+            # المحادثات التي فرغت تُحذف، ورؤوس المحادثات الجاهزة تُحسب من جديد
+            for chat_id in [c for c, q in self._queues.items() if not q and c not in self._busy]:
+                del self._queues[chat_id]
+            self._ready = [
+                (queue[0].priority, queue[0].seq, chat_id)
+                for chat_id, queue in self._queues.items()
+                if queue and chat_id not in self._busy and chat_id not in self._sleeping_chats
+            ]
+            heapq.heapify(self._ready)
+            self._wakeup.set()
+        return cancelled
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout=10):
+        """إيقاف الطابور بعد محاولة إرسال ما تبقى خلال timeout ثانية."""
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            log.warning("Outbox stopped with %d unsent messages", len(self))
+        self._task = None
+
+    # ---------- الجدولة ----------
+    def _schedule(self, chat_id):
+        """إضافة المحادثة إلى الجاهزة إذا لم تكن مشغولة أو نائمة."""
+        if chat_id in self._busy or chat_id in self._sleeping_chats:
+            return
+        queue = self._queues.get(chat_id)
+        if queue:
+            head = queue[0]
+            heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+
+    def _sleep_chat(self, chat_id, wake_at):
+        self._sleeping_chats.add(chat_id)
+        heapq.heappush(self._sleeping, (wake_at, chat_id))
+
+    def _bucket(self, chat_id, now):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            rate, burst = self.chat_limits.get(chat_id, (self.chat_rate, self.chat_burst))
+            bucket = self._buckets[chat_id] = TokenBucket(rate, burst, now)
+            # الدلاء القديمة تكون ممتلئة على أي حال، فحذفها لا يغير شيئًا
+            if len(self._buckets) > 10000:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(chat_id)
+        return bucket
+
+    async def _wait(self, timeout):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            while self._sleeping and self._sleeping[0][0] <= now:
+                _, chat_id = heapq.heappop(self._sleeping)
+                self._sleeping_chats.discard(chat_id)
+                self._schedule(chat_id)
+
+            if now < self._paused_until:
+                await self._wait(self._paused_until - now)
+                continue
+
+            if not self._ready:
+                if self._closing and not self._busy and not self._sleeping:
+                    return
+                timeout = self._sleeping[0][0] - now if self._sleeping else None
+                await self._wait(timeout)
+                continue
+
+            global_wait = self._global.wait_time(now)
+            if global_wait > 0:
+                await self._wait(global_wait)
+                continue
+
+            # الرأس رسالة بالجملة، أي لا شيء أعلى أولوية جاهز: تنتظر حدها الخاص،
+            # ورسالة جديدة أو محادثة تستيقظ من حدها توقظ الحلقة قبل ذلك
+            bulk = self._ready[0][0] >= PRIORITY_BULK and self._bulk is not None
+            if bulk:
+                bulk_wait = self._bulk.wait_time(now)
+                if bulk_wait > 0:
+                    if self._sleeping:
+                        bulk_wait = min(bulk_wait, self._sleeping[0][0] - now)
+                    await self._wait(bulk_wait)
+                    continue
+
+            _, _, chat_id = heapq.heappop(self._ready)
+            if chat_id in self._busy or not self._queues.get(chat_id):
+                continue  # مدخل قديم بعد cancel_queued
+            bucket = self._bucket(chat_id, now)
+            chat_wait = bucket.wait_time(now)
+            if chat_wait > 0:
+                self._sleep_chat(chat_id, now + chat_wait)
+                continue
+
+            await self._in_flight.acquire()
+            if not self._queues.get(chat_id):
+                # أُلغيت رسائل المحادثة أثناء الانتظار
+                self._in_flight.release()
+                continue
+            bucket.consume(now)
+            self._global.consume(now)
+            if bulk:
+                self._bulk.consume(now)
+            item = self._queues[chat_id].popleft()
+            if item.coalesce_key is not None and self._coalesce.get(item.coalesce_key) is item:
+                del self._coalesce[item.coalesce_key]
+            self._busy.add(chat_id)
+            asyncio.create_task(self._deliver(item))
+
+    async def _deliver(self, item):
+        _delivering.set(True)  # خاص بهذه المهمة
+        loop = asyncio.get_running_loop()
+        chat_id = item.chat_id
+        retry_at = None
+        try:
+            result = await self.bot.send_message(chat_id, item.text, **item.kwargs)
+        except RetryAfter as e:
+            # حد تيليجرام العام: نوقف كل الإرسال حتى تنتهي المدة
+            self._paused_until = max(self._paused_until, loop.time() + e.timeout)
+            retry_at = self._retry(item, e, loop.time() + e.timeout)
+        except TRANSIENT_ERRORS as e:
+            retry_at = self._retry(item, e, loop.time() + min(2 ** item.attempts, 30))
+        except Exception as e:
+            self._fail(item, e)
+        else:
+            self.sent += 1
+            if not item.future.done():
+                item.future.set_result(result)
+        finally:
+            self._in_flight.release()
+            self._busy.discard(chat_id)
+            if retry_at is not None:
+                self._sleep_chat(chat_id, retry_at)
+            elif self._queues.get(chat_id):
+                self._schedule(chat_id)
+            else:
+                self._queues.pop(chat_id, None)
+            self._wakeup.set()
+
+    def _retry(self, item, error, retry_at):
+        item.attempts += 1
+        if item.attempts > self.max_retries:
+            self._fail(item, error)
+            return None
+        self.retried += 1
+        self._queues.setdefault(item.chat_id, deque()).appendleft(item)
+        return retry_at
+
+    def _fail(self, item, error):
+        self.failed += 1
+        log.warning("Failed to send message to %s: %s", item.chat_id, error)
+        if not item.future.done():
+            item.future.set_exception(error)
+            item.future.exception()  # لا أحد مجبر على انتظار النتيجة
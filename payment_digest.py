@@ -0,0 +1,203 @@
+import asyncio
+import logging
+
+from aiogram import types
+
+from database import create_background_task, run_db
+from outbox import PRIORITY_ADMIN
+import repository as repo
+
+log = logging.getLogger(__name__)
+
+# --- إشعارات "لقد دفعت" وملخصها للمدير ---
+# بدل رسالة لكل ضغطة "لقد دفعت"، يمكن جمع الطلبات خلال نافذة زمنية وإرسالها في رسالة واحدة
+# فيها زر اختيار لكل طلب وأزرار تحديد الكل وإلغاء التحديد والتأكيد أو الرفض الجماعي.
+# حالة الاختيار تُقرأ من أزرار الرسالة نفسها، فلا تُحفظ في الذاكرة ولا تضيع بإعادة التشغيل.
+# في وضع الملخص تكون قاعدة البيانات هي قائمة الانتظار: كل نافذة يرسل العامل المسؤول عن المدير
+# كل الضغطات التي لم يُشعر بها، مهما كان العامل الذي استقبلها.
+# الإشعار نفسه ينتظر في طابور الرسائل، لذلك يُعلَّم payment_notified_at بعد وصوله فقط،
+# وما لم يصل (توقف البوت أو فشل الإرسال) يُعاد عند الإقلاع التالي: الإشعار يصل مرة على الأقل.
+
+PREFIX = "digest"
+CHECKED = "✅"
+UNCHECKED = "⬜️"
+
+# Telegram يحد النص بـ 4096 حرفًا وعدد الأزرار بـ 100؛ الدفعة الأكبر تُقسم على عدة رسائل
+MAX_ORDERS_PER_MESSAGE = 25
+
+ACTION_TOGGLE = "t"
+ACTION_ALL = "a"
+ACTION_NONE = "n"
+ACTION_CONFIRM = "c"
+ACTION_REJECT = "r"
+ACTIONS = (ACTION_TOGGLE, ACTION_ALL, ACTION_NONE, ACTION_CONFIRM, ACTION_REJECT)
+
+
+def parse_callback(payload):
+    """بيانات الأزرار: digest:<action>:<order_id> (0 لأزرار الرسالة كلها). تُرجع (action, order_id)."""
+    action, order_id = payload.split(":")
+    if action not in ACTIONS:
+        raise ValueError(f"unknown digest action {action!r}")
+    return action, int(order_id)
+
+
+def order_line(order):
+    return (
+        f"🆔 #{order.id} · @{order.username} (ID: {order.user_id})\n"
+        f"    📦 {order.product_name} ({order.option}) · ${order.price}"
+    )
+
+
+def render_notice(order):
+    """إشعار طلب واحد (بدون ملخص) مع زري التأكيد والرفض. يبقى بالإنجليزية لسهولة المتابعة."""
+    keyboard = types.InlineKeyboardMarkup(row_width=2)
+    keyboard.add(
+        types.InlineKeyboardButton(text="✅ Confirm Payment", callback_data=f"confirm:{order.id}"),
+        types.InlineKeyboardButton(text="❌ Reject Payment", callback_data=f"reject:{order.id}")
+    )
+    text = (
+        f"⚠️ Payment confirmation received!\n\n"
+        f"Order ID: {order.id}\n"
+        f"User: @{order.username} (ID: {order.user_id})\n"
+        f"Product: {order.product_name} ({order.option}) - ${order.price}"
+    )
+    return text, keyboard
+
+
+def render_text(orders):
+    lines = [f"⚠️ {len(orders)} payment confirmation(s) received:", ""]
+    lines.extend(order_line(order) for order in orders)
+    return "\n".join(lines)
+
+
+def render_keyboard(entries):
+    """entries: [(order_id, label, selected)]. تُرجع None إذا لم يبق أي طلب."""
+    if not entries:
+        return None
+    keyboard = types.InlineKeyboardMarkup(row_width=2)
+    for order_id, label, selected in entries:
+        keyboard.row(types.InlineKeyboardButton(
+            f"{CHECKED if selected else UNCHECKED} {label}",
+            callback_data=f"{PREFIX}:{ACTION_TOGGLE}:{order_id}"
+        ))
+    keyboard.row(
+        types.InlineKeyboardButton("☑️ Select all", callback_data=f"{PREFIX}:{ACTION_ALL}:0"),
+        types.InlineKeyboardButton("🔲 Clear", callback_data=f"{PREFIX}:{ACTION_NONE}:0"),
+    )
+    keyboard.row(
+        types.InlineKeyboardButton("✅ Confirm selected", callback_data=f"{PREFIX}:{ACTION_CONFIRM}:0"),
+        types.InlineKeyboardButton("❌ Reject selected", callback_data=f"{PREFIX}:{ACTION_REJECT}:0"),
+    )
+    return keyboard
+
+
+def button_label(order):
+    return f"#{order.id} · {order.product_name} ({order.option}) · ${order.price}"
+
+
+def read_selection(markup):
+    """استخراج [(order_id, label, selected)] من أزرار رسالة الملخص الحالية."""
+    entries = []
+    toggle_prefix = f"{PREFIX}:{ACTION_TOGGLE}:"
+    for row in (markup.inline_keyboard if markup else ()):
+        for button in row:
+            if not (button.callback_data or "").startswith(toggle_prefix):
+                continue
+            order_id = int(button.callback_data[len(toggle_prefix):])
+            mark, _sep, label = button.text.partition(" ")
+            entries.append((order_id, label, mark == CHECKED))
+    return entries
+
+
+def apply_selection(entries, action, order_id):
+    """تطبيق زر اختيار/تحديد الكل/إلغاء التحديد على القائمة."""
+    if action == ACTION_ALL:
+        return [(oid, label, True) for oid, label, _selected in entries]
+    if action == ACTION_NONE:
+        return [(oid, label, False) for oid, label, _selected in entries]
+    return [(oid, label, not selected if oid == order_id else selected) for oid, label, selected in entries]
+
+
+class PaymentDigest:
+    """
+    يرسل طلبات "لقد دفعت" للمدير: فورًا في رسالة لكل طلب (interval=0)، أو في رسالة ملخص واحدة
+    (أو أكثر) كل interval ثانية.
+    الملخص يُبنى من قاعدة البيانات (الضغطات التي لم يصل إشعارها) لا من ذاكرة العملية، ويشغّله العامل
+    المسؤول عن المدير وحده، فيصل ملخص واحد لكل نافذة مهما كان عدد العمال.
+    """
+
+    def __init__(self, outbox, admin_id, interval=0):
+        self.outbox = outbox
+        self.admin_id = admin_id
+        self.interval = interval
+        self._sending = set()       # طلبات إشعارها في الطابور ولم يُعلَّم بعد
+        self._deliveries = set()    # مهام تنتظر وصول الإشعارات لتعليمها
+
+    def __len__(self):
+        return len(self._sending)
+
+    def add(self, order):
+        """ضغطة "لقد دفعت" جديدة (بعد claim_payment). في وضع الملخص تنتظر flush التالي من قاعدة البيانات."""
+        if self.interval <= 0:
+            text, keyboard = render_notice(order)
+            self._send([order], text, keyboard)
+
+    async def flush(self):
+        """إرسال كل الضغطات التي لم يصل إشعارها (عدا ما في الطابور الآن) في رسائل ملخص. تُرجع عددها."""
+        orders = [order for order in await run_db(repo.unnotified_payments) if order.id not in self._sending]
+        for start in range(0, len(orders), MAX_ORDERS_PER_MESSAGE):
+            chunk = orders[start:start + MAX_ORDERS_PER_MESSAGE]
+            # كل الطلبات محددة مبدئيًا: الحالة الشائعة هي تأكيد الدفعة كاملة
+            entries = [(order.id, button_label(order), True) for order in chunk]
+            self._send(chunk, render_text(chunk), render_keyboard(entries))
+        return len(orders)
+
+    def _send(self, orders, text, keyboard):
+        order_ids = [order.id for order in orders]
+        self._sending.update(order_ids)
+        future = self.outbox.send_message(self.admin_id, text, reply_markup=keyboard, priority=PRIORITY_ADMIN)
+        task = create_background_task(self._mark_notified(future, order_ids))
+        self._deliveries.add(task)
+        task.add_done_callback(self._deliveries.discard)
+
+    async def _mark_notified(self, future, order_ids):
+        try:
+            await future
+        except Exception as e:
+            # يبقى payment_notified_at فارغًا فيُعاد الإشعار في الملخص التالي أو عند الإقلاع التالي
+            log.error("Payment notice for orders %s was not delivered: %s", order_ids, e)
+            return
+        else:
+            try:
+                await run_db(repo.mark_payments_notified, order_ids)
+            except Exception:
+                log.exception("Could not mark payment notices for orders %s as delivered", order_ids)
+        finally:
+            self._sending.difference_update(order_ids)
+
+    async def resume(self):
+        """إعادة إرسال ضغطات "لقد دفعت" التي لم يصل إشعارها قبل إعادة التشغيل. تُرجع عددها."""
+        if self.interval > 0:
+            count = await self.flush()
+        else:
+            orders = await run_db(repo.unnotified_payments)
+            for order in orders:
+                self.add(order)
+            count = len(orders)
+        if count:
+            log.info("Re-sent %d undelivered payment notices", count)
+        return count
+
+    async def drain(self, timeout=5):
+        """انتظار تعليم الإشعارات التي أرسلها الطابور (بعد إيقافه)."""
+        if self._deliveries:
+            await asyncio.wait(list(self._deliveries), timeout=timeout)
+
+    async def run(self):
+        """مهمة خلفية ترسل الملخص كل interval ثانية."""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("Payment digest flush failed")
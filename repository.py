@@ -0,0 +1,346 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import bindparam, insert, literal, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+
+from database import Broadcast, Order, Ticket, TicketMessage, User
+import analytics
+import counters
+
+# --- طبقة الوصول إلى البيانات ---
+# كل الدوال هنا متزامنة وتستقبل الجلسة كأول معامل، وتُستدعى من البوت عبر run_db
+# حتى تعمل داخل مجمع خيوط قاعدة البيانات وليس داخل حلقة الأحداث.
+# العلاقات التي يحتاجها البوت تُحمَّل مسبقًا حتى لا يحدث تحميل كسول في حلقة الأحداث.
+# كل تغيير في حالة طلب يمر عبر analytics.record_changes في نفس المعاملة، وفتح التذاكر وإغلاقها
+# يحدّث counters في نفس المعاملة كذلك.
+
+# ================= USERS =================
+def get_or_create_user(session, user_id, username):
+    """جلب مستخدم من قاعدة البيانات أو إنشائه إذا لم يكن موجودًا."""
+    user = session.query(User).filter_by(user_id=user_id).first()
+    if not user:
+        user = User(user_id=user_id, username=username, language=None)
+        session.add(user)
+        try:
+            session.commit()
+        except IntegrityError:
+            # أنشأته عملية أخرى في نفس اللحظة
+            session.rollback()
+            user = session.query(User).filter_by(user_id=user_id).one()
+    elif user.blocked_at is not None:
+        # المستخدم يراسل البوت مجددًا، فقد ألغى الحظر
+        user.blocked_at = None
+        session.commit()
+    return user
+
+def set_user_language(session, user_id, username, lang_code):
+    """تحديث لغة المستخدم (أو إعادة تعيينها إلى None)."""
+    user = get_or_create_user(session, user_id, username)
+    user.language = lang_code
+    session.commit()
+    return user
+
+def get_languages(session, user_ids):
+    """لغات عدة مستخدمين في استعلام واحد: {user_id: language}"""
+    if not user_ids:
+        return {}
+    rows = session.query(User.user_id, User.language).filter(User.user_id.in_(user_ids)).all()
+    return dict(rows)
+
+def update_usernames(session, usernames):
+    """تحديث أسماء عدة مستخدمين في استعلام واحد. usernames: {user_id: username}"""
+    stmt = (
+        update(User.__table__)
+        .where(User.__table__.c.user_id == bindparam("uid"))
+        .values(username=bindparam("uname"))
+    )
+    session.execute(stmt, [{"uid": uid, "uname": name} for uid, name in usernames.items()])
+    session.commit()
+
+# ================= ORDERS =================
+def get_pending_order(session, user_id, option_id):
+    return session.query(Order).filter_by(user_id=user_id, option_id=option_id, status="pending").first()
+
+def get_or_create_pending_order(session, user_id, username, product_name, option, price, option_id):
+    """
+    الطلب المعلق للمستخدم على هذا الخيار، أو طلب جديد إذا لم يوجد. تُرجع (الطلب، أُنشئ الآن؟).
+    الطلب المعلق الذي ضُغط عليه "لقد دفعت" يُرجع كما هو (الدفع قيد المراجعة).
+    الطلب المعلق الذي تغير خياره منذ إنشائه (السعر أو الاسم) يُلغى ويُنشأ بدله طلب بالسعر الحالي.
+    الفهرس الفريد الجزئي على الطلبات المعلقة يحسم السباق بين ضغطتين متزامنتين (أو عمليتين).
+    """
+    order = get_pending_order(session, user_id, option_id)
+    if order is not None:
+        if order.paid_claimed_at is not None or (order.product_name, order.option, order.price) == (product_name, option, price):
+            return order, False
+        if not _cancel_stale_order(session, order):
+            # ضغط المستخدم "لقد دفعت" عليه في هذه الأثناء
+            session.refresh(order)
+            return order, False
+    try:
+        return create_order(session, user_id, username, product_name, option, price, option_id), True
+    except IntegrityError:
+        session.rollback()
+        return get_pending_order(session, user_id, option_id), False
+
+def _cancel_stale_order(session, order):
+    """إلغاء طلب معلق لم يُضغط عليه "لقد دفعت". التحديث مشروط فلا يسبق ضغطة متزامنة. تُرجع هل أُلغي؟"""
+    table = Order.__table__
+    stmt = (
+        update(table)
+        .where(table.c.id == order.id, table.c.status == "pending", table.c.paid_claimed_at.is_(None))
+        .values(status="cancelled")
+    )
+    if session.execute(stmt).rowcount != 1:
+        session.rollback()
+        return False
+    analytics.record_changes(session, [(order, "pending", "cancelled")])
+    session.commit()
+    return True
+
+def create_order(session, user_id, username, product_name, option, price, option_id=None):
+    order = Order(
+        user_id=user_id,
+        username=username,
+        product_name=product_name,
+        option=option,
+        option_id=option_id,
+        price=price,
+        status="pending"
+    )
+    session.add(order)
+    session.flush()  # لتعبئة created_at
+    analytics.record_changes(session, [(order, None, "pending")])
+    session.commit()
+    return order
+
+def get_order(session, order_id):
+    return session.get(Order, order_id)
+
+def set_order_status(session, order_id, status, from_status):
+    """
+    تغيير حالة الطلب إذا كان ما زال في from_status (انظر set_orders_status).
+    تُرجع (الطلب، تغير؟)، أو (None, False) إذا لم يكن موجودًا. زر قديم (مثل تأكيد طلب رُفض أو سُلّم)
+    لا يغير شيئًا، ويُرجع الطلب بحالته الحالية.
+    """
+    changed = set_orders_status(session, [order_id], status, from_status)
+    if changed:
+        return changed[0], True
+    return session.get(Order, order_id, populate_existing=True), False
+
+def claim_payment(session, order_id, user_id):
+    """
+    تسجيل ضغطة "لقد دفعت" من صاحب الطلب. تُرجع (الطلب، أول ضغطة؟)، أو (None, False) إذا لم يكن الطلب له.
+    التحديث المشروط ذري، فالضغطات المتكررة (حتى من نسخ بوت مختلفة) لا تُحتسب إلا مرة واحدة.
+    """
+    table = Order.__table__
+    stmt = (
+        update(table)
+        .where(
+            table.c.id == order_id,
+            table.c.user_id == user_id,
+            table.c.status == "pending",
+            table.c.paid_claimed_at.is_(None),
+        )
+        .values(paid_claimed_at=datetime.now(timezone.utc))
+    )
+    first = session.execute(stmt).rowcount == 1
+    session.commit()
+    order = session.get(Order, order_id)
+    if order is None or order.user_id != user_id:
+        return None, False
+    return order, first
+
+def mark_payments_notified(session, order_ids):
+    """تسجيل وصول إشعار "لقد دفعت" للمدير."""
+    table = Order.__table__
+    session.execute(
+        update(table).where(table.c.id.in_(order_ids)).values(payment_notified_at=datetime.now(timezone.utc))
+    )
+    session.commit()
+
+def unnotified_payments(session):
+    """الطلبات المعلقة التي ضغط أصحابها "لقد دفعت" ولم يصل إشعارها للمدير بعد."""
+    return (
+        session.query(Order)
+        .filter(Order.status == "pending", Order.paid_claimed_at.is_not(None), Order.payment_notified_at.is_(None))
+        .order_by(Order.id)
+        .all()
+    )
+
+def set_orders_status(session, order_ids, status, from_status="pending"):
+    """
+    تغيير حالة عدة طلبات في معاملة واحدة، فقط للطلبات التي ما زالت في from_status.
+    تُرجع الطلبات التي تغيرت (الطلبات التي عالجها المدير من قبل تُتجاهل).
+    الشرط في UPDATE نفسه لا في قراءة سابقة (SELECT ... FOR UPDATE لا يقفل شيئًا في SQLite)،
+    فالإحصاءات (order_rollups و stat_counters) تُحدَّث للصفوف التي غيرها هذا التحديث فقط.
+    """
+    if not order_ids:
+        return []
+    table = Order.__table__
+    changed_ids = session.execute(
+        update(table)
+        .where(table.c.id.in_(order_ids), table.c.status == from_status)
+        .values(status=status)
+        .returning(table.c.id)
+    ).scalars().all()
+    if not changed_ids:
+        session.commit()
+        return []
+    orders = (
+        session.query(Order)
+        .filter(Order.id.in_(changed_ids))
+        .order_by(Order.id)
+        .populate_existing()
+        .all()
+    )
+    analytics.record_changes(session, [(order, from_status, status) for order in orders])
+    session.commit()
+    return orders
+
+def _keyset_page(query, id_column, before=None, after=None, limit=10):
+    """
+    صفحة بترتيب تنازلي حسب المعرف باستخدام keyset pagination بدل OFFSET.
+    before: الصفحة الأقدم (المعرفات أصغر من before). after: الصفحة الأحدث (أكبر من after).
+    تُرجع (الصفوف، يوجد أحدث؟، يوجد أقدم؟).
+    """
+    if after is not None:
+        rows = query.filter(id_column > after).order_by(id_column.asc()).limit(limit + 1).all()
+        has_newer = len(rows) > limit
+        return rows[:limit][::-1], has_newer, True
+
+    if before is not None:
+        query = query.filter(id_column < before)
+    rows = query.order_by(id_column.desc()).limit(limit + 1).all()
+    has_older = len(rows) > limit
+    return rows[:limit], before is not None, has_older
+
+def page_orders(session, status=None, before=None, after=None, limit=10):
+    query = session.query(Order)
+    if status:
+        query = query.filter(Order.status == status)
+    return _keyset_page(query, Order.id, before, after, limit)
+
+def order_stats(session, statuses):
+    """عدد الطلبات ومجموع الأسعار لكل حالة من العدادات الإجمالية: {status: (count, total)}"""
+    stats = counters.read(session, [counters.order_key(status) for status in statuses])
+    return {status: stats[counters.order_key(status)] for status in statuses}
+
+# ================= BROADCASTS =================
+def _active_users(session):
+    return session.query(User).filter(User.blocked_at.is_(None))
+
+def create_broadcast(session, texts_json):
+    broadcast = Broadcast(texts=texts_json, status="running", total=_active_users(session).count())
+    session.add(broadcast)
+    session.commit()
+    return broadcast
+
+def get_broadcast(session, broadcast_id):
+    return session.get(Broadcast, broadcast_id)
+
+def running_broadcasts(session):
+    return session.query(Broadcast).filter_by(status="running").order_by(Broadcast.id).all()
+
+def broadcast_recipients(session, after_id, limit):
+    """الدفعة التالية من المستخدمين غير المحظورين بترتيب users.id: [(id, user_id, language)]"""
+    return (
+        session.query(User.id, User.user_id, User.language)
+        .filter(User.id > after_id, User.blocked_at.is_(None))
+        .order_by(User.id)
+        .limit(limit)
+        .all()
+    )
+
+def save_broadcast_progress(session, broadcast_id, cursor, sent, failed, blocked_user_ids, status=None):
+    """نقطة استئناف البث وعداداته، مع تعليم المستخدمين الذين حظروا البوت، في معاملة واحدة."""
+    now = datetime.now(timezone.utc)
+    if blocked_user_ids:
+        session.execute(
+            update(User.__table__)
+            .where(User.__table__.c.user_id.in_(blocked_user_ids))
+            .values(blocked_at=now)
+        )
+    values = {
+        "cursor": cursor,
+        "sent": Broadcast.sent + sent,
+        "failed": Broadcast.failed + failed,
+        "blocked": Broadcast.blocked + len(blocked_user_ids),
+    }
+    if status is not None:
+        values["status"] = status
+        values["finished_at"] = now
+    session.execute(update(Broadcast.__table__).where(Broadcast.__table__.c.id == broadcast_id).values(**values))
+    session.commit()
+
+def set_broadcast_status(session, broadcast_id, status):
+    broadcast = session.get(Broadcast, broadcast_id)
+    if broadcast and broadcast.status == "running":
+        broadcast.status = status
+        broadcast.finished_at = datetime.now(timezone.utc)
+        session.commit()
+    return broadcast
+
+# ================= TICKETS =================
+def get_open_ticket(session, user_id):
+    return session.query(Ticket).filter_by(user_id=user_id, is_open=True).first()
+
+def create_ticket(session, user_id):
+    ticket = Ticket(user_id=user_id)
+    session.add(ticket)
+    counters.bump(session, {counters.TICKETS_OPEN: (1, 0)})
+    session.commit()
+    return ticket
+
+def get_ticket(session, ticket_id):
+    return session.query(Ticket).options(joinedload(Ticket.user)).filter_by(id=ticket_id).first()
+
+def open_tickets(session):
+    """كل التذاكر المفتوحة: [(user_id, ticket_id)] (لتعبئة OpenTickets عند الإقلاع)."""
+    return session.query(Ticket.user_id, Ticket.id).filter(Ticket.is_open.is_(True)).all()
+
+def add_message_if_open(session, ticket_id, sender, text):
+    """
+    إضافة رسالة إلى التذكرة فقط إذا كانت ما زالت مفتوحة، في استعلام INSERT ... SELECT واحد.
+    تُرجع False إذا أُغلقت التذكرة (مثلًا من عملية أخرى).
+    """
+    tickets = Ticket.__table__
+    source = select(literal(ticket_id), literal(sender), literal(text)).where(
+        tickets.c.id == ticket_id, tickets.c.is_open.is_(True)
+    )
+    result = session.execute(insert(TicketMessage.__table__).from_select(["ticket_id", "sender", "text"], source))
+    session.commit()
+    return result.rowcount == 1
+
+def page_ticket_messages(session, ticket_id, before=None, after=None, limit=10):
+    """صفحة من سجل محادثة التذكرة (الأحدث أولًا، بترتيب الإضافة)."""
+    query = session.query(TicketMessage).filter(TicketMessage.ticket_id == ticket_id)
+    return _keyset_page(query, TicketMessage.id, before, after, limit)
+
+def add_ticket_message(session, ticket_id, sender, text):
+    message = TicketMessage(ticket_id=ticket_id, sender=sender, text=text)
+    session.add(message)
+    session.commit()
+    return message
+
+def close_ticket(session, ticket_id):
+    """إغلاق التذكرة. تُرجع التذكرة (مع المستخدم) أو None."""
+    ticket = get_ticket(session, ticket_id)
+    if ticket:
+        if ticket.is_open:
+            ticket.closed_at = datetime.now(timezone.utc)
+            counters.bump(session, {counters.TICKETS_OPEN: (-1, 0), counters.TICKETS_CLOSED: (1, 0)})
+        ticket.is_open = False
+        session.commit()
+    return ticket
+
+def page_tickets(session, is_open=None, before=None, after=None, limit=10):
+    query = session.query(Ticket).options(joinedload(Ticket.user))
+    if is_open is not None:
+        query = query.filter(Ticket.is_open == is_open)
+    return _keyset_page(query, Ticket.id, before, after, limit)
+
+def ticket_stats(session):
+    """عدد التذاكر المفتوحة والمغلقة من العدادات الإجمالية: {is_open: count}"""
+    stats = counters.read(session, [counters.TICKETS_OPEN, counters.TICKETS_CLOSED])
+    return {True: stats[counters.TICKETS_OPEN][0], False: stats[counters.TICKETS_CLOSED][0]}
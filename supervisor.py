@@ -0,0 +1,318 @@
+"""
+وضع العمليات المتعددة: عملية مشرفة تستقبل التحديثات وتوزعها على WORKERS عملية عاملة.
+
+    python supervisor.py                # webhook إذا كان WEBHOOK_HOST محددًا، وإلا polling
+    python supervisor.py --workers 4 --polling
+
+المشرف لا يشغّل المعالجات: يستقبل التحديث (webhook أو getUpdates)، يقرأ معرف المستخدم
+من JSON الخام، ويمرره إلى العامل shard_of(user_id) عبر stdin الخاص به. كل عامل هو
+"python bot.py --worker" بكامل الـ Dispatcher، ويعالج تحديثات المستخدم الواحد بالترتيب.
+
+التحديثات التي لم يؤكد العامل معالجتها تُعاد إليه إذا توقف فجأة وأُعيد تشغيله.
+عند الإيقاف يتوقف الاستقبال أولًا، ثم يُغلق stdin كل عامل لينهي ما لديه ويخرج.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from collections import OrderedDict
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
+
+import config
+import metrics
+from webserver import authorized, health, start_app
+from workers import shard_key, shard_of
+
+log = logging.getLogger(__name__)
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+
+worker_up = metrics.registry.register(metrics.Gauge(
+    "bot_worker_up", "1 while the worker process is running.", ("worker",)))
+worker_restarts = metrics.registry.register(metrics.Counter(
+    "bot_worker_restarts_total", "Worker processes restarted after exiting unexpectedly.", ("worker",)))
+worker_pending = metrics.registry.register(metrics.Gauge(
+    "bot_worker_pending_updates", "Updates sent to the worker and not yet acknowledged.", ("worker",)))
+worker_updates = metrics.registry.register(metrics.Gauge(
+    "bot_worker_updates", "Worker totals since its last start, as last reported.", ("worker", "result")))
+
+
+class WorkerProcess:
+    """عملية عاملة واحدة: إرسال التحديثات إليها، وقراءة تأكيداتها وإحصاءاتها، وإعادة تشغيلها عند التوقف."""
+
+    def __init__(self, index, count, max_backoff=30):
+        self.index = index
+        self.count = count
+        self.max_backoff = max_backoff
+        self.proc = None
+        self.ready = False
+        self.stats = {}
+        self.metrics = ""              # آخر نص /metrics أرسله العامل
+        self.restarts = 0
+        self.forwarded = 0
+        self._unacked = OrderedDict()  # update_id -> سطر JSON (بترتيب الإرسال)
+        self._lock = asyncio.Lock()    # الكتابة وإعادة الإرسال لا تتداخل فيبقى الترتيب محفوظًا
+        self._stopping = False
+        self._monitor = None
+
+    @property
+    def pending(self):
+        return len(self._unacked)
+
+    async def start(self):
+        self._monitor = asyncio.create_task(self._supervise())
+
+    async def _spawn(self):
+        env = dict(os.environ, WORKER_INDEX=str(self.index), WORKER_COUNT=str(self.count))
+        # القفل يشمل إنشاء العملية: send() المنتظرة لا تكتب في العملية الجديدة قبل إعادة إرسال السابقة
+        async with self._lock:
+            self.proc = await asyncio.create_subprocess_exec(
+                sys.executable, BOT_SCRIPT, "--worker",
+                stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, env=env,
+                limit=1 << 20,
+            )
+            self.ready = False
+            worker_up.set(str(self.index), value=1)
+            log.info("Worker %d started (pid %d)", self.index, self.proc.pid)
+            # التحديثات التي لم تُؤكد قبل توقف العملية السابقة تُعاد بنفس ترتيبها
+            for line in self._unacked.values():
+                self.proc.stdin.write(line)
+            await self._drain_stdin()
+
+    async def _supervise(self):
+        backoff = 1
+        while not self._stopping:
+            await self._spawn()
+            started = time.monotonic()
+            await asyncio.gather(self._read(), self.proc.wait())
+            worker_up.set(str(self.index), value=0)
+            if self._stopping:
+                break
+            self.restarts += 1
+            worker_restarts.inc(str(self.index))
+            # التوقف السريع المتكرر يعني خطأ في الإقلاع: ننتظر أكثر قبل المحاولة التالية
+            backoff = 1 if time.monotonic() - started > 60 else min(backoff * 2, self.max_backoff)
+            log.error("Worker %d exited with code %s, %d pending updates; restarting in %ds",
+                      self.index, self.proc.returncode, self.pending, backoff)
+            await asyncio.sleep(backoff)
+
+    async def _read(self):
+        while True:
+            line = await self.proc.stdout.readline()
+            if not line:
+                return
+            try:
+                message = json.loads(line)
+            except ValueError:
+                log.warning("Worker %d: unexpected output %r", self.index, line[:200])
+                continue
+            if "ack" in message:
+                self._unacked.pop(message["ack"], None)
+            elif "stats" in message:
+                self.stats = message["stats"]
+                self.metrics = message.get("metrics", "")
+                for result in ("processed", "errors"):
+                    worker_updates.set(str(self.index), result, value=self.stats.get(result, 0))
+            elif message.get("ready"):
+                self.ready = True
+
+    async def _drain_stdin(self):
+        try:
+            await self.proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # العملية توقفت؛ التحديثات باقية في _unacked وتُعاد بعد إعادة التشغيل
+
+    async def send(self, update_id, line):
+        self.forwarded += 1
+        async with self._lock:
+            self._unacked[update_id] = line
+            proc = self.proc
+            if proc is None or proc.returncode is not None or proc.stdin.is_closing():
+                return
+            proc.stdin.write(line)
+            await self._drain_stdin()
+
+    async def stop(self, timeout):
+        """إغلاق stdin لينهي العامل التحديثات الجارية ويخرج؛ قتله إذا تجاوز timeout."""
+        self._stopping = True
+        if self.proc is not None and self.proc.returncode is None:
+            self.proc.stdin.close()
+            try:
+                await asyncio.wait_for(self.proc.wait(), timeout)
+            except asyncio.TimeoutError:
+                log.warning("Worker %d did not drain in %ss, killing it", self.index, timeout)
+                self.proc.kill()
+                await self.proc.wait()
+        if self._monitor is not None:
+            await self._monitor
+        if self.pending:
+            log.warning("Worker %d stopped with %d unprocessed updates", self.index, self.pending)
+
+
+class Supervisor:
+    def __init__(self, count, drain_timeout=25):
+        self.count = count
+        self.drain_timeout = drain_timeout
+        self.workers = [WorkerProcess(i, count) for i in range(count)]
+        self.accepting = True
+
+    async def start(self):
+        for worker in self.workers:
+            await worker.start()
+
+    def worker_for(self, raw):
+        """العامل المسؤول عن مستخدم التحديث الخام."""
+        return self.workers[shard_of(shard_key(raw), self.count)]
+
+    async def dispatch(self, raw, line=None, worker=None):
+        """تمرير تحديث خام إلى العامل المسؤول عن مستخدمه."""
+        if worker is None:
+            worker = self.worker_for(raw)
+        if line is None:
+            line = json.dumps(raw, separators=(",", ":")).encode("utf-8") + b"\n"
+        await worker.send(raw.get("update_id"), line)
+
+    async def stop(self):
+        self.accepting = False
+        await asyncio.gather(*(worker.stop(self.drain_timeout) for worker in self.workers))
+
+    def collect_metrics(self):
+        for worker in self.workers:
+            worker_pending.set(str(worker.index), value=worker.pending)
+
+    def render_metrics(self):
+        """مقاييس المشرف ومقاييس كل عامل (بتسمية worker) في نص واحد."""
+        sources = [(None, metrics.registry.render())]
+        sources.extend((("worker", str(worker.index)), worker.metrics) for worker in self.workers if worker.metrics)
+        return metrics.merge_expositions(sources)
+
+    def status(self):
+        return [
+            {
+                "worker": worker.index,
+                "pid": worker.proc.pid if worker.proc else None,
+                "ready": worker.ready,
+                "restarts": worker.restarts,
+                "forwarded": worker.forwarded,
+                "pending": worker.pending,
+                **worker.stats,
+            }
+            for worker in self.workers
+        ]
+
+
+def create_metrics_app(supervisor):
+    """/metrics و/workers على الخادم الداخلي (METRICS_HOST/METRICS_PORT)، لا على منفذ webhook."""
+    app = web.Application()
+
+    async def metrics_endpoint(request):
+        return web.Response(body=supervisor.render_metrics().encode("utf-8"), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+    app.router.add_get("/metrics", metrics_endpoint)
+
+    async def workers_status(request):
+        return web.json_response(supervisor.status())
+
+    app.router.add_get("/workers", workers_status)
+    return app
+
+
+def create_app(supervisor, webhook_path=None, secret_token=None):
+    app = web.Application()
+    app.router.add_get("/", health)
+
+    if webhook_path:
+        async def webhook(request):
+            if not authorized(request, secret_token):
+                return web.Response(status=401)
+            if not supervisor.accepting:
+                # تيليجرام يعيد المحاولة لاحقًا (بعد إعادة التشغيل)
+                return web.Response(status=503)
+            body = await request.read()
+            # JSON غير صالح، أو بلا شكل التحديث (مثل [1]): 400 حتى لا يعيد تيليجرام إرساله
+            try:
+                raw = json.loads(body)
+                worker = supervisor.worker_for(raw)
+            except (ValueError, TypeError, KeyError, AttributeError):
+                return web.Response(status=400)
+            await supervisor.dispatch(raw, worker=worker)
+            return web.Response()
+
+        app.router.add_post(webhook_path, webhook)
+    return app
+
+
+async def poll(bot, supervisor, timeout=30):
+    """getUpdates في المشرف؛ العمال لا يتصلون بتيليجرام إلا للإرسال."""
+    await bot.delete_webhook(drop_pending_updates=True)
+    offset = None
+    while supervisor.accepting:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("getUpdates failed")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            await supervisor.dispatch(update.to_python())
+            offset = update.update_id + 1
+
+
+async def main(count, mode):
+    bot = Bot(
+        token=config.TOKEN,
+        server=TelegramAPIServer.from_base(config.TELEGRAM_API_URL) if config.TELEGRAM_API_URL else TELEGRAM_PRODUCTION
+    )
+    supervisor = Supervisor(count, drain_timeout=config.WORKER_DRAIN_TIMEOUT)
+    metrics.registry.add_collector(supervisor.collect_metrics)
+    await supervisor.start()
+
+    webhook_path = config.WEBHOOK_PATH if mode == "webhook" else None
+    runner = await start_app(create_app(supervisor, webhook_path, config.WEBHOOK_SECRET), config.WEB_HOST, config.PORT)
+    metrics_runner = await start_app(create_metrics_app(supervisor), config.METRICS_HOST, config.METRICS_PORT)
+    poller = None
+    if mode == "webhook":
+        if config.WEBHOOK_HOST:
+            await bot.set_webhook(
+                config.WEBHOOK_HOST.rstrip("/") + config.WEBHOOK_PATH,
+                secret_token=config.WEBHOOK_SECRET,
+                drop_pending_updates=True,
+            )
+    else:
+        poller = asyncio.create_task(poll(bot, supervisor))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    log.info("Supervisor running %d workers (%s)", count, mode)
+    await stop.wait()
+
+    log.info("Stopping: draining workers")
+    if poller is not None:
+        poller.cancel()
+    supervisor.accepting = False
+    await supervisor.stop()
+    await runner.cleanup()
+    await metrics_runner.cleanup()
+    await (await bot.get_session()).close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=config.WORKERS)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--polling", dest="mode", action="store_const", const="polling")
+    group.add_argument("--webhook", dest="mode", action="store_const", const="webhook")
+    args = parser.parse_args()
+    asyncio.run(main(max(args.workers, 1), args.mode or config.RUN_MODE))
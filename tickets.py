@@ -0,0 +1,198 @@
+import asyncio
+import io
+import json
+import logging
+import tempfile
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, insert, select, update
+
+from database import run_db, Ticket, TicketArchive, TicketMessage
+import repository as repo
+
+log = logging.getLogger(__name__)
+
+# --- التذاكر: التذكرة المفتوحة لكل مستخدم، سجل المحادثة، والأرشفة ---
+# التذاكر المفتوحة قليلة، فتُحفظ كلها في الذاكرة (user_id -> ticket_id) وتُحدَّث عند الفتح والإغلاق
+# بدل استعلام مع كل رسالة. إذا أُغلقت التذكرة في عملية أخرى (وضع العمليات المتعددة)
+# يرفض repo.add_message_if_open الإضافة فتُحذف من الذاكرة.
+# رسائل التذاكر المغلقة منذ أكثر من N يوم تُضغط في ticket_archives وتُحذف من ticket_messages.
+
+
+class OpenTickets:
+    def __init__(self):
+        self._by_user = {}  # user_id -> ticket_id
+
+    def __len__(self):
+        return len(self._by_user)
+
+    async def load(self):
+        self._by_user = dict(await run_db(repo.open_tickets))
+
+    def get(self, user_id):
+        return self._by_user.get(user_id)
+
+    def opened(self, user_id, ticket_id):
+        self._by_user[user_id] = ticket_id
+
+    def closed(self, user_id, ticket_id):
+        if self._by_user.get(user_id) == ticket_id:
+            del self._by_user[user_id]
+
+
+# ================= سجل المحادثة =================
+
+@dataclass(frozen=True)
+class TranscriptMessage:
+    id: int
+    sender: str
+    text: str
+    timestamp: datetime
+
+
+def _from_row(row):
+    return TranscriptMessage(id=row.id, sender=row.sender, text=row.text, timestamp=row.timestamp)
+
+
+def format_message(message):
+    when = message.timestamp.strftime("%Y-%m-%d %H:%M") if message.timestamp else "?"
+    return f"[{when}] {message.sender}: {message.text}"
+
+
+def _compress(messages):
+    lines = (
+        json.dumps([m.id, m.sender, m.text, m.timestamp.isoformat() if m.timestamp else None], ensure_ascii=False)
+        for m in messages
+    )
+    return zlib.compress("\n".join(lines).encode("utf-8"), 9)
+
+
+def _decompress(data):
+    messages = []
+    for line in zlib.decompress(data).decode("utf-8").splitlines():
+        message_id, sender, text, timestamp = json.loads(line)
+        messages.append(TranscriptMessage(
+            id=message_id, sender=sender, text=text,
+            timestamp=datetime.fromisoformat(timestamp) if timestamp else None,
+        ))
+    return messages
+
+
+def _archived_messages(session, ticket_id):
+    archive = session.get(TicketArchive, ticket_id)
+    return _decompress(archive.data) if archive is not None else None
+
+
+def _page_list(messages, before, after, limit):
+    """نفس نتيجة repo._keyset_page لكن على قائمة في الذاكرة (رسائل تذكرة مؤرشفة)."""
+    if after is not None:
+        newer = [m for m in messages if m.id > after]
+        return newer[:limit][::-1], len(newer) > limit, True
+    older = [m for m in messages if before is None or m.id < before][::-1]
+    return older[:limit], before is not None, len(older) > limit
+
+
+def page_transcript(session, ticket_id, before=None, after=None, limit=10):
+    """
+    صفحة من سجل المحادثة (الأحدث أولًا) سواء كانت الرسائل في الجدول أو في الأرشيف.
+    تُرجع (التذكرة، الرسائل، يوجد أحدث؟، يوجد أقدم؟)، أو (None, ...) إذا لم توجد التذكرة.
+    """
+    ticket = repo.get_ticket(session, ticket_id)
+    if ticket is None:
+        return None, [], False, False
+    if ticket.archived_at is not None:
+        messages, has_newer, has_older = _page_list(_archived_messages(session, ticket_id) or [], before, after, limit)
+    else:
+        rows, has_newer, has_older = repo.page_ticket_messages(session, ticket_id, before, after, limit)
+        messages = [_from_row(row) for row in rows]
+    return ticket, messages, has_newer, has_older
+
+
+def transcript_file(session, ticket_id, batch_size=500, spool_size=1 << 20):
+    """
+    سجل المحادثة كاملًا كملف نصي مؤقت (يُكتب دفعة دفعة). تُرجع (ملف ثنائي من بدايته، عدد الرسائل)،
+    أو (None, 0) إذا لم توجد التذكرة.
+    """
+    ticket = repo.get_ticket(session, ticket_id)
+    if ticket is None:
+        return None, 0
+    fp = tempfile.SpooledTemporaryFile(max_size=spool_size, mode="w+b")
+    out = io.TextIOWrapper(fp, encoding="utf-8", newline="\n")
+    out.write(f"Ticket #{ticket.id} - @{ticket.user.username} (ID: {ticket.user_id})\n\n")
+    count = 0
+    if ticket.archived_at is not None:
+        messages = _archived_messages(session, ticket_id) or []
+    else:
+        table = TicketMessage.__table__
+        messages = (
+            _from_row(row) for row in session.execute(
+                select(table.c.id, table.c.sender, table.c.text, table.c.timestamp)
+                .where(table.c.ticket_id == ticket_id)
+                .order_by(table.c.id)
+                .execution_options(yield_per=batch_size)
+            )
+        )
+    for message in messages:
+        out.write(format_message(message) + "\n")
+        count += 1
+    out.flush()
+    out.detach()
+    fp.seek(0)
+    return fp, count
+
+
+# ================= الأرشفة =================
+
+def archive_closed(session, older_than, limit=100):
+    """
+    ضغط رسائل حتى limit تذكرة مغلقة قبل older_than وحذفها من ticket_messages، في معاملة واحدة.
+    تُرجع عدد التذاكر المؤرشفة (أقل من limit يعني أنه لم يبق شيء).
+    """
+    tickets, messages = Ticket.__table__, TicketMessage.__table__
+    ticket_ids = session.execute(
+        select(tickets.c.id)
+        .where(tickets.c.is_open.is_(False), tickets.c.closed_at < older_than, tickets.c.archived_at.is_(None))
+        .order_by(tickets.c.closed_at)
+        .limit(limit)
+    ).scalars().all()
+    if not ticket_ids:
+        return 0
+
+    grouped = {ticket_id: [] for ticket_id in ticket_ids}
+    rows = session.execute(
+        select(messages.c.id, messages.c.ticket_id, messages.c.sender, messages.c.text, messages.c.timestamp)
+        .where(messages.c.ticket_id.in_(ticket_ids))
+        .order_by(messages.c.ticket_id, messages.c.id)
+    )
+    for row in rows:
+        grouped[row.ticket_id].append(_from_row(row))
+
+    now = datetime.now(timezone.utc)
+    session.execute(insert(TicketArchive.__table__), [
+        {"ticket_id": ticket_id, "message_count": len(items), "data": _compress(items), "archived_at": now}
+        for ticket_id, items in grouped.items()
+    ])
+    session.execute(delete(messages).where(messages.c.ticket_id.in_(ticket_ids)))
+    session.execute(update(tickets).where(tickets.c.id.in_(ticket_ids)).values(archived_at=now))
+    session.commit()
+    return len(ticket_ids)
+
+
+async def run_archiver(days, interval=3600, batch=100):
+    """مهمة خلفية: أرشفة التذاكر المغلقة منذ أكثر من days يوم، على دفعات صغيرة حتى لا تطول المعاملات."""
+    while True:
+        try:
+            total = 0
+            while True:
+                cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+                archived = await run_db(archive_closed, cutoff, batch)
+                total += archived
+                if archived < batch:
+                    break
+            if total:
+                log.info("Archived %d closed tickets", total)
+        except Exception:
+            log.exception("Ticket archiving failed")
+        await asyncio.sleep(interval)
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+
+from database import run_db
+from idempotency import singleflight
+import repository as repo
+
+log = logging.getLogger(__name__)
+
+# --- ذاكرة تخزين مؤقت للمستخدمين ---
+# معرفة لغة المستخدم هي أكثر استعلام يتكرر، لذلك نحتفظ بآخر المستخدمين في ذاكرة LRU
+# محدودة الحجم ولها مدة صلاحية. تغيير اللغة يُكتب في قاعدة البيانات ثم في الذاكرة مباشرة،
+# أما تغيّر اسم المستخدم فيُجمع ويُحفظ دفعة واحدة في الخلفية.
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    user_id: int
+    username: str
+    language: str
+
+    @classmethod
+    def from_row(cls, user):
+        return cls(user_id=user.user_id, username=user.username, language=user.language)
+
+
+class UserCache:
+    def __init__(self, maxsize=10000, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()   # user_id -> (expires_at, CachedUser)
+        self._loading = {}              # user_id -> Future (لدمج طلبات الإنشاء المتزامنة)
+        self._dirty_usernames = {}      # user_id -> username
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return user
+
+    def _store(self, user):
+        self._entries[user.user_id] = (time.monotonic() + self.ttl, user)
+        self._entries.move_to_end(user.user_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return user
+
+    async def get_or_create(self, user_id, username, update_username=True):
+        """
+        جلب المستخدم من الذاكرة، أو من قاعدة البيانات (مع إنشائه) عند عدم وجوده.
+        update_username=False عند جلب مستخدم آخر (مثل صاحب الطلب) حتى لا نكتب اسمًا قديمًا.
+        """
+        user = self._get(user_id)
+        if user is None:
+            user = await self._load(user_id, username)
+        if update_username and username != user.username:
+            user = self._store(replace(user, username=username))
+            self._dirty_usernames[user_id] = username
+        return user
+
+    async def _load(self, user_id, username):
+        # إذا كان هناك تحميل جارٍ لنفس المستخدم ننتظره بدل إرسال استعلام آخر
+        async def fetch():
+            row = await run_db(repo.get_or_create_user, user_id, username)
+            return self._store(CachedUser.from_row(row))
+
+        user, _loaded = await singleflight(self._loading, user_id, fetch)
+        return user
+
+    async def set_language(self, user_id, username, lang_code):
+        """تحديث اللغة في قاعدة البيانات ثم في الذاكرة (write-through)."""
+        row = await run_db(repo.set_user_language, user_id, username, lang_code)
+        self._dirty_usernames.pop(user_id, None)
+        return self._store(CachedUser.from_row(row))
+
+    def invalidate(self, user_id):
+        self._entries.pop(user_id, None)
+
+    async def flush(self):
+        """حفظ أسماء المستخدمين المتغيرة دفعة واحدة."""
+        if not self._dirty_usernames:
+            return 0
+        batch, self._dirty_usernames = self._dirty_usernames, {}
+        try:
+            await run_db(repo.update_usernames, batch)
+        except Exception:
+            # نعيد الدفعة حتى تُحاول في المرة القادمة (دون الكتابة فوق تغييرات أحدث)
+            for user_id, username in batch.items():
+                self._dirty_usernames.setdefault(user_id, username)
+            raise
+        return len(batch)
+
+    async def run_flusher(self, interval=10):
+        """مهمة خلفية لحفظ أسماء المستخدمين المتغيرة كل interval ثانية."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("Username flush failed")
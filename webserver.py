@@ -0,0 +1,104 @@
+import asyncio
+import hmac
+import logging
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+
+from metrics import CONTENT_TYPE, registry
+
+log = logging.getLogger(__name__)
+
+# --- خادم aiohttp واحد على نفس حلقة الأحداث ---
+# يخدم فحص الصحة على "/" واستقبال تحديثات تيليجرام (وضع webhook) معًا، بدل خادم Flask في خيط منفصل.
+# مقاييس Prometheus على "/metrics" في تطبيق ثانٍ على عنوان داخلي (METRICS_HOST/METRICS_PORT)،
+# فلا تُكشف أرقام الطلبات والعمال لمن يصل إلى منفذ webhook العام.
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def authorized(request: web.Request, secret_token):
+    """هل يحمل الطلب رمز webhook الصحيح؟ (None = بدون تحقق)"""
+    if secret_token is None:
+        return True
+    return hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret_token)
+
+
+async def health(request: web.Request):
+    return web.Response(text="Bot is up and running!")
+
+
+async def metrics_endpoint(request: web.Request):
+    return web.Response(
+        body=registry.render().encode("utf-8"),
+        headers={"Content-Type": CONTENT_TYPE},
+    )
+
+
+class WebhookHandler:
+    """استقبال التحديثات من تيليجرام ومعالجتها بالتوازي (بحد أقصى max_concurrency)."""
+
+    def __init__(self, dispatcher: Dispatcher, secret_token=None, max_concurrency=100):
+        self.dispatcher = dispatcher
+        self.secret_token = secret_token
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks = set()
+
+    async def __call__(self, request: web.Request):
+        if not authorized(request, self.secret_token):
+            return web.Response(status=401)
+
+        # JSON غير صالح، أو JSON صالح ليس كائنًا (مثل [1]): 400 حتى لا يعيد تيليجرام إرساله
+        try:
+            update = types.Update(**(await request.json()))
+        except (ValueError, TypeError, KeyError):
+            return web.Response(status=400)
+
+        # نرد على تيليجرام فورًا ونعالج التحديث في الخلفية
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: types.Update):
+        try:
+            Bot.set_current(self.dispatcher.bot)
+            Dispatcher.set_current(self.dispatcher)
+            await self.dispatcher.process_updates([update])
+        except Exception:
+            log.exception("Failed to process update %s", update.update_id)
+        finally:
+            self._semaphore.release()
+
+    async def drain(self):
+        """انتظار انتهاء التحديثات الجارية (عند الإيقاف)."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def create_app(dispatcher: Dispatcher, webhook_path=None, secret_token=None, max_concurrency=100):
+    """إنشاء تطبيق aiohttp. يُضاف مسار webhook فقط إذا حُدد webhook_path."""
+    app = web.Application()
+    app.router.add_get("/", health)
+    if webhook_path:
+        handler = WebhookHandler(dispatcher, secret_token=secret_token, max_concurrency=max_concurrency)
+        app["webhook_handler"] = handler
+        app.router.add_post(webhook_path, handler)
+    return app
+
+
+def create_metrics_app():
+    """تطبيق المقاييس الداخلي (يُشغَّل بـ start_app على METRICS_HOST/METRICS_PORT)."""
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_endpoint)
+    return app
+
+
+async def start_app(app: web.Application, host, port):
+    """تشغيل التطبيق داخل حلقة أحداث موجودة (يُستخدم في وضع polling لفحص الصحة)."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from collections import deque
+
+from aiogram import Bot, Dispatcher, types
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+# --- جانب العامل في وضع العمليات المتعددة (انظر supervisor.py) ---
+# المشرف يوزع التحديثات على العمال حسب معرف المستخدم، فكل تحديثات المستخدم الواحد
+# (وحالة FSM الخاصة به في الذاكرة) تبقى في نفس العملية.
+# القناة بين المشرف والعامل أنابيب عادية بلا وسيط خارجي:
+#   stdin  <- سطر JSON لكل تحديث (نهاية الملف = إيقاف بعد إنهاء التحديثات الجارية)
+#   stdout -> سطر JSON لكل رسالة: {"ready": true}، {"ack": update_id}، {"stats": {...}, "metrics": "..."}
+# المشرف يعرض نص metrics (مقاييس المعالجات وقاعدة البيانات في العامل) على /metrics الخاص به.
+# مخرجات print والسجلات في العامل تذهب إلى stderr حتى لا تختلط بالقناة.
+
+# أنواع التحديث التي تحمل حقل from (أو chat) بالترتيب الذي نبحث فيه عن مفتاح التوزيع
+_UPDATE_FIELDS = (
+    "message", "callback_query", "edited_message", "inline_query", "chosen_inline_result",
+    "shipping_query", "pre_checkout_query", "my_chat_member", "chat_member", "chat_join_request",
+    "channel_post", "edited_channel_post", "poll_answer",
+)
+
+
+def shard_key(update):
+    """مفتاح التوزيع لتحديث خام (dict): معرف المستخدم، وإلا المحادثة، وإلا رقم التحديث."""
+    for name in _UPDATE_FIELDS:
+        event = update.get(name)
+        if event is None:
+            continue
+        sender = event.get("from") or event.get("user")
+        if sender:
+            return sender["id"]
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+    return update.get("update_id", 0)
+
+
+def shard_of(key, count):
+    """رقم العامل المسؤول عن المفتاح (ثابت بين العمليات، بعكس hash())."""
+    return abs(int(key)) % count
+
+
+class KeyedExecutor:
+    """
+    تنفيذ العناصر ذات المفتاح الواحد واحدًا تلو الآخر بترتيب وصولها،
+    والعناصر ذات المفاتيح المختلفة بالتوازي (بحد أقصى max_concurrency).
+    """
+
+    def __init__(self, process, max_concurrency=100):
+        self._process = process
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._queues = {}   # key -> deque
+        self._tasks = set()
+
+    def __len__(self):
+        return sum(len(q) for q in self._queues.values())
+
+    @property
+    def active_keys(self):
+        return len(self._queues)
+
+    def submit(self, key, item):
+        queue = self._queues.get(key)
+        if queue is not None:
+            queue.append(item)
+            return
+        self._queues[key] = deque([item])
+        task = asyncio.create_task(self._run_key(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_key(self, key):
+        queue = self._queues[key]
+        try:
+            while queue:
+                item = queue.popleft()
+                async with self._semaphore:
+                    await self._process(item)
+        finally:
+            del self._queues[key]
+
+    async def drain(self):
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+
+class _Channel:
+    """كتابة رسائل القناة إلى stdout الأصلي، بعد تحويل sys.stdout إلى stderr."""
+
+    def __init__(self):
+        self._out = os.fdopen(os.dup(sys.stdout.fileno()), "wb", buffering=0)
+        sys.stdout.flush()
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    def send(self, message):
+        self._out.write(json.dumps(message, separators=(",", ":")).encode("utf-8") + b"\n")
+
+
+async def _stdin_reader():
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=1 << 22)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin.buffer)
+    return reader
+
+
+async def serve(dispatcher: Dispatcher, on_startup, on_shutdown, max_concurrency=100, stats_interval=5):
+    """حلقة العامل: قراءة التحديثات من stdin ومعالجتها بترتيب كل مستخدم حتى نهاية الملف."""
+    # المشرف هو من يقرر متى نتوقف (بإغلاق stdin)، فنتجاهل الإشارات الموجهة لمجموعة العمليات
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    channel = _Channel()
+    Bot.set_current(dispatcher.bot)
+    Dispatcher.set_current(dispatcher)
+    stats = {"processed": 0, "errors": 0}
+
+    async def process(raw):
+        try:
+            await dispatcher.process_updates([types.Update(**raw)])
+        except Exception:
+            stats["errors"] += 1
+            log.exception("Failed to process update %s", raw.get("update_id"))
+        stats["processed"] += 1
+        channel.send({"ack": raw.get("update_id")})
+
+    executor = KeyedExecutor(process, max_concurrency)
+
+    def report():
+        channel.send({
+            "stats": dict(stats, queued=len(executor), active_users=executor.active_keys),
+            "metrics": metrics.registry.render(),
+        })
+
+    async def report_periodically():
+        while True:
+            await asyncio.sleep(stats_interval)
+            report()
+
+    await on_startup(dispatcher)
+    reader = await _stdin_reader()
+    reporter = asyncio.create_task(report_periodically())
+    channel.send({"ready": True, "pid": os.getpid()})
+    started = time.monotonic()
+
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        try:
+            raw = json.loads(line)
+        except ValueError:
+            log.warning("Malformed update line from supervisor: %r", line[:200])
+            continue
+        executor.submit(shard_key(raw), raw)
+
+    log.info("Worker draining %d queued updates", len(executor))
+    await executor.drain()
+    reporter.cancel()
+    report()
+    await on_shutdown(dispatcher)
+    await dispatcher.storage.close()
+    await dispatcher.storage.wait_closed()
+    await (await dispatcher.bot.get_session()).close()
+    log.info("Worker stopped after %.0fs, %d updates", time.monotonic() - started, stats["processed"])